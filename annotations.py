@@ -0,0 +1,216 @@
+"""Maps evaluations back to phrases and aggregates them into retention proportions.
+
+The evaluator answers with one phrase per line (or a proposition number, or a phrase and
+its tone). `PhraseIndex` resolves each line to a canonical phrase ID, i.e., its index in
+`task.task_data["phrases"]`, through a dictionary of normalised phrases with a fuzzy
+fallback. `EvaluationMatrix` stores the parsed evaluations of many nodes as a sparse
+boolean (phrases × nodes) matrix, plus a sparse tone channel for `AmbiguityTask`, and
+computes per-category retention proportions by chain and generation without loops over
+nodes.
+"""
+
+import difflib
+import re
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, TYPE_CHECKING
+
+import numpy as np
+from scipy import sparse
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+PUNCTUATION_PATTERN = re.compile(r"[^\w\s]")
+# "- phrase", "* phrase", "3. phrase", "3) phrase"
+LIST_MARKER_PATTERN = re.compile(r"^\s*(?:[-*•]+|\d+[.)])\s+")
+
+
+def normalize_phrase(text: str) -> str:
+    text = text.lower().replace("’", "'").replace("'", "")
+    return " ".join(PUNCTUATION_PATTERN.sub(" ", text).split())
+
+
+class PhraseIndex:
+    """Resolves evaluator lines to canonical phrase IDs.
+
+    A line matches a phrase if, once normalised, it equals the phrase, its text or its label
+    (e.g., the number of a proposition), with or without a leading list marker. Other lines
+    are matched to the closest key with `difflib` if its similarity reaches `cutoff`.
+
+    Args:
+        phrase_ids (list(int)): canonical IDs of the phrases.
+        keys (list(list(str))): the texts each phrase may be reported as.
+        cutoff (float, optional, default: 0.85): similarity needed for a fuzzy match.
+    """
+
+    def __init__(self, phrase_ids: Sequence[int], keys: Sequence[Sequence[str]], cutoff: float=0.85):
+        self.cutoff = cutoff
+        self._exact: Dict[str, int] = {}
+        for phrase_id, phrase_keys in zip(phrase_ids, keys):
+            for key in phrase_keys:
+                key = normalize_phrase(key)
+                if key:
+                    self._exact.setdefault(key, phrase_id)
+        # fuzzy matching only considers texts, not labels such as "24"
+        self._fuzzy_keys = [key for key in self._exact if not key.isdigit()]
+        self._cache: Dict[str, Optional[int]] = {}
+
+    def lookup(self, line: str) -> Optional[int]:
+        """Canonical ID of the phrase `line` reports, or `None`."""
+        key = normalize_phrase(line)
+        if key in self._exact:
+            return self._exact[key]
+        if key in self._cache:
+            return self._cache[key]
+
+        phrase_id = self._exact.get(normalize_phrase(LIST_MARKER_PATTERN.sub("", line)))
+        if phrase_id is None and key:
+            matches = difflib.get_close_matches(key, self._fuzzy_keys, n=1, cutoff=self.cutoff)
+            phrase_id = self._exact[matches[0]] if matches else None
+        self._cache[key] = phrase_id
+        return phrase_id
+
+
+class EvaluationMatrix:
+    """Parsed evaluations of many nodes.
+
+    Attributes:
+        phrase_ids (np.ndarray): canonical ID of each row.
+        categories (list(list(str))): category labels of each row.
+        nodes (np.ndarray): (sim_id, generation, position) of each column.
+        presence (sparse.csr_matrix): (phrases × nodes) booleans, whether the evaluation of
+            the node reports the phrase.
+        tones (sparse.csr_matrix or None): (phrases × nodes) codes of the tone reported with
+            each phrase, 1 + its index in `tone_levels`; 0 if none.
+        tone_levels (tuple(str)): the tones of `task.evaluation_tones`.
+
+    Example:
+        matrix = EvaluationMatrix.from_simulations(task, simulations)
+        data = matrix.retention_proportions()  # chain_id, chain_step, proportion, content
+    """
+
+    def __init__(self, phrase_ids: Sequence[int], categories: Sequence[Sequence[str]], nodes: Sequence[Tuple[int, int, int]],
+                 presence: sparse.spmatrix, tones: Optional[sparse.spmatrix]=None, tone_levels: Sequence[str]=()):
+        self.phrase_ids = np.asarray(phrase_ids)
+        self.categories = [list(labels) for labels in categories]
+        self.nodes = np.asarray(nodes, dtype=np.int64).reshape(-1, 3)
+        self.presence = sparse.csr_matrix(presence, dtype=bool)
+        self.tones = None if tones is None else sparse.csr_matrix(tones, dtype=np.int8)
+        self.tone_levels = tuple(tone_levels)
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.presence.shape
+
+    @classmethod
+    def _build(cls, task: Any, nodes: List[Tuple[int, int, int]],
+               annotations: Iterable[Iterable[Tuple[int, Optional[str]]]]) -> "EvaluationMatrix":
+        phrase_ids = task.evaluation_phrase_ids
+        row_of = {phrase_id: row for row, phrase_id in enumerate(phrase_ids)}
+        tone_code = {tone: code + 1 for code, tone in enumerate(task.evaluation_tones)}
+
+        rows, cols, codes = [], [], []
+        for col, node_annotations in enumerate(annotations):
+            for phrase_id, tone in node_annotations:
+                row = row_of.get(phrase_id)
+                if row is not None:
+                    rows.append(row)
+                    cols.append(col)
+                    codes.append(tone_code.get(tone, 0))
+
+        shape = (len(phrase_ids), len(nodes))
+        # a phrase reported twice by one node counts once; its last tone is kept
+        presence = sparse.coo_matrix((np.ones(len(rows), dtype=bool), (rows, cols)), shape=shape).tocsr()
+        presence.sum_duplicates()
+        tones = None
+        if tone_code:
+            tones = sparse.dok_matrix(shape, dtype=np.int8)
+            for row, col, code in zip(rows, cols, codes):
+                tones[row, col] = code
+        categories = [task.task_data["categories"][phrase_id] for phrase_id in phrase_ids]
+        return cls(phrase_ids, categories, nodes, presence, tones, task.evaluation_tones)
+
+    @classmethod
+    def from_records(cls, task: Any, records: Iterable[Tuple[int, int, int, Optional[str]]]) -> "EvaluationMatrix":
+        """From (sim_id, generation, position, evaluation) records; a `None` evaluation reports no phrase."""
+        records = list(records)
+        nodes = [(sim_id, generation, position) for sim_id, generation, position, _ in records]
+        return cls._build(task, nodes, (task.parse_evaluation(evaluation) for *_, evaluation in records))
+
+    @classmethod
+    def from_simulations(cls, task: Any, simulations: Iterable[List[List[Any]]]) -> "EvaluationMatrix":
+        """From the nodes of `utils.setup_transmission_chain` simulations."""
+        return cls.from_records(task, [(node.sim_id, node.id[0], node.id[1], node.evaluation)
+                                       for all_nodes in simulations for generation in all_nodes for node in generation])
+
+    @classmethod
+    def from_frame(cls, task: Any, data: "pd.DataFrame") -> "EvaluationMatrix":
+        """From a DataFrame with sim_id, generation, evaluation and optionally position columns,
+        e.g., from `task.aevaluate_many` or `sink.load_results`."""
+        positions = data["position"] if "position" in data else [0] * len(data)
+        evaluations = [None if not isinstance(e, str) else e for e in data["evaluation"]]
+        return cls.from_records(task, zip(data["sim_id"], data["generation"], positions, evaluations))
+
+    @classmethod
+    def from_codings(cls, task: Any) -> "EvaluationMatrix":
+        """The human codings of `task` (see `task_data`), with one node per chain and chain step."""
+        codings = task.task_data["codings"]
+        n_steps, n_chains = len(codings[0]), len(codings[0][0])
+        nodes = [(chain, step, 0) for chain in range(n_chains) for step in range(n_steps)]
+        annotations = [[(phrase_id, (codings[phrase_id][step][chain] or "").upper() or None)
+                        for phrase_id in task.evaluation_phrase_ids if codings[phrase_id][step][chain] is not None]
+                       for chain, step, _ in nodes]
+        return cls._build(task, nodes, annotations)
+
+    def category_membership(self) -> Tuple[List[str], sparse.csr_matrix]:
+        """Category labels and the (categories × phrases) membership matrix."""
+        labels = sorted({label for labels in self.categories for label in labels})
+        col_of = {label: col for col, label in enumerate(labels)}
+        rows = [col_of[label] for labels in self.categories for label in labels]
+        cols = [row for row, labels in enumerate(self.categories) for _ in labels]
+        membership = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(labels), len(self.categories)))
+        return labels, membership
+
+    def _group_nodes(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Unique (sim_id, generation) pairs and the group of every node."""
+        return np.unique(self.nodes[:, :2], axis=0, return_inverse=True)
+
+    def retention_proportions(self, channel: str="presence") -> "pd.DataFrame":
+        """Share of the phrases of each category retained by each chain at each generation.
+
+        Nodes of the same chain and generation are averaged. With `channel="tone"`, the
+        content is "<category><tone>" and the proportion counts the phrases reported with
+        that tone.
+
+        Returns:
+            A DataFrame with columns chain_id, chain_step, proportion and content, as used
+            by the analysis notebooks.
+        """
+        import pandas as pd
+
+        labels, membership = self.category_membership()
+        totals = np.asarray(membership.sum(axis=1)).ravel()
+        if channel == "presence":
+            contents, indicators = labels, [self.presence]
+        elif channel == "tone":
+            if self.tones is None:
+                raise ValueError("The task reports no tones.")
+            contents = [label + tone for tone in self.tone_levels for label in labels]
+            indicators = [self.tones == code + 1 for code in range(len(self.tone_levels))]
+        else:
+            raise ValueError(f"Unknown channel: {channel!r}")
+
+        # (contents × nodes) counts, then per-category shares averaged per (chain, generation)
+        counts = np.vstack([(membership @ indicator.astype(np.float64)).toarray() for indicator in indicators])
+        shares = counts / np.tile(np.maximum(totals, 1), len(indicators))[:, np.newaxis]
+        groups, inverse = self._group_nodes()
+        inverse = np.asarray(inverse).ravel()
+        sums = np.zeros((len(contents), len(groups)))
+        np.add.at(sums.T, inverse, shares.T)
+        means = sums / np.bincount(inverse, minlength=len(groups))[np.newaxis, :]
+
+        return pd.DataFrame({
+            "chain_id": np.tile(groups[:, 0], len(contents)),
+            "chain_step": np.tile(groups[:, 1], len(contents)),
+            "proportion": means.ravel(),
+            "content": np.repeat(contents, len(groups)),
+        })
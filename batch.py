@@ -0,0 +1,299 @@
+"""Runs transmission chains through the Batch API instead of interactive chat completions.
+
+Calls are collected from the nodes of one or more simulations into a Batch-format JSONL
+file, submitted to a `BatchEndpoint`, and the results are mapped back onto the nodes
+through their `custom_id`s (`<kind>-<sim_id>-<generation>-<position>`).
+"""
+
+import json
+import pathlib
+import shutil
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterable, List, Tuple
+
+from openai.types.chat import ChatCompletion
+
+from base_model import BaseAPIModel
+
+EXECUTE = "execute"
+EVALUATE = "evaluate"
+CHAT_COMPLETIONS_URL = "/v1/chat/completions"
+
+
+def make_custom_id(kind: str, sim_id: int, node_id: Tuple[int, int], prefix: str="") -> str:
+    custom_id = f"{kind}-{sim_id}-{node_id[0]}-{node_id[1]}"
+    return f"{prefix}-{custom_id}" if prefix else custom_id
+
+
+def parse_custom_id(custom_id: str) -> Tuple[str, int, Tuple[int, int]]:
+    """Inverse of `make_custom_id`, ignoring the prefix."""
+    kind, sim_id, generation, position = custom_id.rsplit("-", 4)[-4:]
+    return kind, int(sim_id), (int(generation), int(position))
+
+
+def model_name(llm_model: BaseAPIModel) -> str:
+    """The model (or Azure deployment) name sent in the request body."""
+    model_type = getattr(llm_model, "model_type", None)
+    return model_type.value if model_type is not None else getattr(llm_model, "model_name", "")
+
+
+def batch_line(custom_id: str, llm_model: BaseAPIModel, messages: List[Dict[str, str]]) -> Dict[str, Any]:
+    """A single request in the Batch input format."""
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": CHAT_COMPLETIONS_URL,
+        "body": {
+            "model": model_name(llm_model),
+            "messages": messages,
+            **getattr(llm_model, "model_config_dict", {})
+        }
+    }
+
+
+def write_jsonl(lines: Iterable[Dict[str, Any]], path: pathlib.Path) -> pathlib.Path:
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        for line in lines:
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+    return path
+
+
+def read_jsonl(path: pathlib.Path) -> List[Dict[str, Any]]:
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class BatchEndpoint(ABC):
+    """Where batch files are submitted and results fetched from."""
+
+    @abstractmethod
+    def submit(self, input_path: pathlib.Path) -> str:
+        """Submits the JSONL file and returns the batch id."""
+        pass
+
+    @abstractmethod
+    def status(self, batch_id: str) -> str:
+        """Returns the status of the batch, e.g., "in_progress", "completed" or "failed"."""
+        pass
+
+    @abstractmethod
+    def results(self, batch_id: str) -> List[Dict[str, Any]]:
+        """Returns the output lines of a completed batch."""
+        pass
+
+
+class OpenAIBatchEndpoint(BatchEndpoint):
+    """The OpenAI / Azure OpenAI Batch API, through a blocking `OpenAI` / `AzureOpenAI` client.
+
+    `from_model` builds one from the credentials of any `OpenAIModel`, including the async
+    models `Node` uses, whose own clients are async.
+    """
+
+    def __init__(self, client: Any, completion_window: str="24h"):
+        from openai import AsyncOpenAI
+
+        if isinstance(client, AsyncOpenAI):
+            raise TypeError("OpenAIBatchEndpoint calls the client synchronously; pass an OpenAI or AzureOpenAI "
+                            "client, or use OpenAIBatchEndpoint.from_model(llm_model).")
+        self.client = client
+        self.completion_window = completion_window
+
+    @classmethod
+    def from_model(cls, llm_model: BaseAPIModel, completion_window: str="24h") -> "OpenAIBatchEndpoint":
+        """An endpoint with a blocking client for the endpoint and credentials of `llm_model`."""
+        from openai import AsyncAzureOpenAI, AsyncOpenAI, AzureOpenAI, OpenAI
+
+        sync_clients = {AsyncOpenAI: OpenAI, AsyncAzureOpenAI: AzureOpenAI}
+        client_cls = sync_clients.get(llm_model.client_cls, llm_model.client_cls)
+        return cls(client_cls(**llm_model._client_args), completion_window)
+
+    def submit(self, input_path: pathlib.Path) -> str:
+        with open(input_path, "rb") as f:
+            batch_file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint=CHAT_COMPLETIONS_URL,
+            completion_window=self.completion_window
+        )
+        return batch.id
+
+    def status(self, batch_id: str) -> str:
+        return self.client.batches.retrieve(batch_id).status
+
+    def results(self, batch_id: str) -> List[Dict[str, Any]]:
+        batch = self.client.batches.retrieve(batch_id)
+        lines = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id is None:
+                continue
+            content = self.client.files.content(file_id).text
+            lines += [json.loads(line) for line in content.splitlines() if line.strip()]
+        return lines
+
+
+class DirectoryBatchEndpoint(BatchEndpoint):
+    """A local stand-in for the Batch API.
+
+    `submit` copies the input file to `<root>/<batch_id>/input.jsonl`. The batch is answered
+    by `llm_model` (e.g., `fake_model.FakeModel`) the first time its status is polled, and the
+    results are written to `<root>/<batch_id>/output.jsonl` in the Batch output format.
+    """
+
+    def __init__(self, root: pathlib.Path, llm_model: BaseAPIModel):
+        self.root = pathlib.Path(root)
+        self.llm_model = llm_model
+
+    def submit(self, input_path: pathlib.Path) -> str:
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        (self.root / batch_id).mkdir(parents=True)
+        shutil.copy(input_path, self.root / batch_id / "input.jsonl")
+        return batch_id
+
+    def _process(self, batch_id: str) -> None:
+        output = []
+        for line in read_jsonl(self.root / batch_id / "input.jsonl"):
+            body = dict(line["body"])
+            body.pop("model", None)
+            messages = body.pop("messages")
+            try:
+                response = self.llm_model.query(messages, body)
+            except Exception as e:
+                output.append({"id": uuid.uuid4().hex, "custom_id": line["custom_id"], "response": None,
+                               "error": {"code": type(e).__name__, "message": str(e)}})
+                continue
+            output.append({
+                "id": uuid.uuid4().hex,
+                "custom_id": line["custom_id"],
+                "response": {"status_code": 200, "request_id": uuid.uuid4().hex, "body": response.model_dump()},
+                "error": None
+            })
+        write_jsonl(output, self.root / batch_id / "output.jsonl")
+
+    def status(self, batch_id: str) -> str:
+        if not (self.root / batch_id / "output.jsonl").exists():
+            self._process(batch_id)
+        return "completed"
+
+    def results(self, batch_id: str) -> List[Dict[str, Any]]:
+        return read_jsonl(self.root / batch_id / "output.jsonl")
+
+
+class BatchPipeline:
+    """Collects calls from simulations, runs them as batches and ingests the results.
+
+    Args:
+        task (BaseTelephoneGameTask): renders messages and parses responses.
+        endpoint (BatchEndpoint): where batches are submitted.
+        work_dir (Path): where input files are written.
+        prefix (str, optional): prepended to every `custom_id`, e.g., a run id.
+        poll_interval (float, optional): seconds between status checks.
+
+    Example:
+        simulations = [setup_transmission_chain(connections, Node, task, idx) for idx in range(100)]
+        pipeline = BatchPipeline(task, OpenAIBatchEndpoint.from_model(llm_model), "batches/")
+        pipeline.run(simulations)
+    """
+
+    def __init__(self, task: Any, endpoint: BatchEndpoint, work_dir: pathlib.Path, prefix: str="",
+                 poll_interval: float=60.0):
+        self.task = task
+        self.endpoint = endpoint
+        self.work_dir = pathlib.Path(work_dir)
+        self.prefix = prefix
+        self.poll_interval = poll_interval
+        self.errors: Dict[str, Any] = {}
+
+    def collect_executions(self, simulations: List[List[List[Any]]], generation: int) -> List[Dict[str, Any]]:
+        """Batch lines for the nodes of `generation` that have all their inputs and no output."""
+        lines = []
+        for all_nodes in simulations:
+            if generation >= len(all_nodes):
+                continue
+            for node in all_nodes[generation]:
+                if node.output is not None or len(node.inputs) != len(node.receive_input_from):
+                    continue
+                messages = self.task.execution_messages(node.inputs, node.sim_id, node.id)
+                custom_id = make_custom_id(EXECUTE, node.sim_id, node.id, self.prefix)
+                lines.append(batch_line(custom_id, self.task.llm_model_execute, messages))
+        return lines
+
+    def collect_evaluations(self, simulations: List[List[List[Any]]]) -> List[Dict[str, Any]]:
+        """Batch lines for the nodes that have an output but no evaluation."""
+        lines = []
+        if not self.task.requires_evaluation:
+            return lines
+        for all_nodes in simulations:
+            for generation in all_nodes:
+                for node in generation:
+                    if node.output is None or node.evaluation is not None:
+                        continue
+                    messages = self.task.evaluation_messages(node.output)
+                    custom_id = make_custom_id(EVALUATE, node.sim_id, node.id, self.prefix)
+                    lines.append(batch_line(custom_id, self.task.llm_model_evaluate, messages))
+        return lines
+
+    def submit(self, lines: List[Dict[str, Any]], name: str) -> str:
+        input_path = write_jsonl(lines, self.work_dir / f"{self.prefix or 'batch'}-{name}.jsonl")
+        return self.endpoint.submit(input_path)
+
+    def wait(self, batch_id: str) -> List[Dict[str, Any]]:
+        """Polls until the batch is done and returns its output lines."""
+        while True:
+            status = self.endpoint.status(batch_id)
+            if status == "completed":
+                return self.endpoint.results(batch_id)
+            if status in ("failed", "expired", "cancelled"):
+                raise RuntimeError(f"Batch {batch_id} ended with status {status}.")
+            time.sleep(self.poll_interval)
+
+    def ingest(self, results: List[Dict[str, Any]], simulations: List[List[List[Any]]]) -> int:
+        """Writes batch results onto their nodes; outputs are forwarded downstream.
+
+        Returns the number of nodes updated. Failed requests are kept in `self.errors`.
+        """
+        nodes = {
+            (node.sim_id, node.id): node
+            for all_nodes in simulations for generation in all_nodes for node in generation
+        }
+
+        updated = 0
+        for line in results:
+            custom_id = line["custom_id"]
+            response = line.get("response")
+            if line.get("error") or response is None or response.get("status_code") != 200:
+                self.errors[custom_id] = line.get("error") or response
+                continue
+
+            kind, sim_id, node_id = parse_custom_id(custom_id)
+            node = nodes.get((sim_id, node_id))
+            if node is None:
+                continue
+
+            completion = ChatCompletion.model_validate(response["body"])
+            if kind == EXECUTE:
+                node.output = self.task.parse_execution_response(completion)
+                node.send_output()
+            else:
+                node.evaluation = self.task.parse_evaluation_response(completion)
+            updated += 1
+        return updated
+
+    def run(self, simulations: List[List[List[Any]]], execute: bool=True, evaluate: bool=True) -> None:
+        """Runs the chains generation by generation, then evaluates every node in one batch."""
+        if execute:
+            n_generations = max(len(all_nodes) for all_nodes in simulations)
+            for generation in range(n_generations):
+                lines = self.collect_executions(simulations, generation)
+                if lines:
+                    batch_id = self.submit(lines, f"{EXECUTE}-{generation}")
+                    self.ingest(self.wait(batch_id), simulations)
+
+        if evaluate:
+            lines = self.collect_evaluations(simulations)
+            if lines:
+                batch_id = self.submit(lines, EVALUATE)
+                self.ingest(self.wait(batch_id), simulations)
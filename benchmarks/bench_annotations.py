@@ -0,0 +1,109 @@
+"""Compares `annotations.EvaluationMatrix` with the per-column pandas loops of the notebooks.
+
+Synthetic evaluations are generated for `--chains` chains of `--depth` generations: each
+node reports a random subset of the task's phrases, some behind a list marker. Both
+pipelines turn them into per-category retention proportions; the report gives their time
+and the share of lines the matrix resolved. With `--noise 0` both give the same proportions.
+
+Usage:
+    python benchmarks/bench_annotations.py --chains 100 1000 5000 --depth 3
+"""
+
+import argparse
+import collections
+import json
+import pathlib
+import random
+import sys
+import time
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
+
+from annotations import EvaluationMatrix
+from enums import TaskType
+from tasks import TaskFactory
+
+
+def synthetic_records(task, n_chains, depth, noise, seed=0):
+    rng = random.Random(seed)
+    phrases = [task.phrase_label(phrase) for phrase in task.evaluation_phrases]
+    records = []
+    for sim_id in range(n_chains):
+        for generation in range(depth):
+            lines = []
+            for phrase in rng.sample(phrases, rng.randint(0, len(phrases) // 2)):
+                if rng.random() < noise:
+                    phrase = rng.choice(["- ", "* ", "1. "]) + phrase
+                lines.append(phrase)
+            records.append((sim_id, generation, 0, "\n".join(lines)))
+    return records
+
+
+def notebook_proportions(task, records):
+    """`convert_summaries_to_annotations` and `convert_annotations_to_proportions` of the notebooks."""
+    import pandas as pd
+
+    categories = [task.task_data["categories"][i][0] for i in task.evaluation_phrase_ids]
+    analysis = pd.DataFrame({"Text part": [task.phrase_label(p) for p in task.evaluation_phrases], "Type": categories})
+    stripped_text = analysis["Text part"].apply(lambda x: x.strip())
+    columns = {}
+    for sim_id, generation, _, evaluation in records:
+        column = [0] * len(analysis)
+        for x in evaluation.split("\n"):
+            row = stripped_text == x
+            if sum(row) == 0:
+                continue
+            for idx in row[row].index:
+                column[idx] = 1
+        columns[(sim_id, generation)] = column
+    analysis = pd.concat([analysis, pd.DataFrame(columns)], axis=1)
+
+    totals = collections.Counter(categories)
+    data = []
+    for (sim_id, generation) in columns:
+        codes = collections.Counter(analysis[analysis[(sim_id, generation)] == 1]["Type"])
+        for category in totals:
+            data.append((sim_id, generation, codes[category] / totals[category], category))
+    return pd.DataFrame(data, columns=["chain_id", "chain_step", "proportion", "content"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--task", default=TaskType.GENDER_STEREOTYPE_CONSISTENCY.value)
+    parser.add_argument("--chains", nargs="+", type=int, default=[100, 1000, 5000])
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--noise", type=float, default=0.1, help="share of lines with a list marker")
+    parser.add_argument("--json", type=pathlib.Path, help="write the results to this file")
+    args = parser.parse_args()
+
+    task = TaskFactory.create(TaskType(args.task), None, None)
+    results = []
+    print(f"{'chains':>7} {'nodes':>7} {'notebook s':>11} {'matrix s':>9} {'speedup':>8} {'parsed':>7}")
+    for n_chains in args.chains:
+        records = synthetic_records(task, n_chains, args.depth, args.noise)
+
+        start = time.perf_counter()
+        expected = notebook_proportions(task, records)
+        notebook_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        matrix = EvaluationMatrix.from_records(task, records)
+        proportions = matrix.retention_proportions()
+        matrix_s = time.perf_counter() - start
+
+        # the matrix also resolves the lines with list markers, which the notebooks drop
+        merged = proportions.merge(expected, on=["chain_id", "chain_step", "content"])
+        parsed = matrix.presence.sum() / sum(len(r[-1].split("\n")) for r in records if r[-1])
+        result = {"chains": n_chains, "nodes": len(records), "notebook_s": notebook_s, "matrix_s": matrix_s,
+                  "speedup": notebook_s / matrix_s, "lines_parsed": float(parsed),
+                  "at_least_notebook": bool((merged.proportion_x >= merged.proportion_y - 1e-12).all())}
+        results.append(result)
+        print(f"{n_chains:>7} {len(records):>7} {notebook_s:>11.2f} {matrix_s:>9.3f} {result['speedup']:>7.0f}x "
+              f"{parsed:>7.1%}")
+
+    if args.json is not None:
+        args.json.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
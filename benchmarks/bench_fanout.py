@@ -0,0 +1,86 @@
+"""Compares first-generation requests with and without `fanout.ExecutionFanOut`.
+
+The same simulations run on `fake_model.AsyncFakeModel` with one request per node, and with
+the identical first-generation requests served by requests with `n` choices
+(`task.set_execution_fanout`). The report gives the execution requests and prompt tokens of
+generation 0, the number of distinct first-generation summaries, and the wall time.
+
+Usage:
+    python benchmarks/bench_fanout.py --simulations 10 100 1000 --latency 0.2
+    python benchmarks/bench_fanout.py --simulations 1000 --max-n 16 --max-concurrency 64
+"""
+
+import argparse
+import asyncio
+import json
+import pathlib
+import sys
+import time
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
+
+from bench_orchestration import chain_connections
+from configs import FakeModelConfig, SchedulerConfig
+from enums import TaskType
+from fake_model import AsyncFakeModel
+from fanout import MAX_N
+from node import Node
+from scheduler import CallScheduler, run_simulations
+from tasks import TaskFactory
+from tracing import Tracer
+from utils import setup_transmission_chain
+
+
+async def run(args, n_simulations, max_n):
+    config = FakeModelConfig(latency_mean=args.latency, latency_distribution="constant")
+    execute_model, evaluate_model = AsyncFakeModel(config), AsyncFakeModel(config)
+    task = TaskFactory.create(TaskType(args.task), execute_model, evaluate_model)
+    if max_n is not None:
+        task.set_execution_fanout(max_n)
+    simulations = [setup_transmission_chain(chain_connections(args.depth, 1), Node, task, idx)
+                   for idx in range(n_simulations)]
+
+    start = time.perf_counter()
+    with Tracer() as tracer:
+        await run_simulations(simulations, CallScheduler(SchedulerConfig(max_concurrency=args.max_concurrency)))
+    elapsed = time.perf_counter() - start
+
+    # execution calls are the `llm.query` spans below a `node.process` span
+    spans = [span for span in tracer.spans if span.name == "llm.query" and span.parent.name == "node.process"
+             and span.lookup("generation") == 0]
+    return {
+        "simulations": n_simulations,
+        "fanout": max_n is not None,
+        "requests": len(spans),
+        "prompt_tokens": sum(span.attributes.get("prompt_tokens", 0) for span in spans),
+        "distinct_summaries": len({simulation[0][0].output for simulation in simulations}),
+        "seconds": elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--task", default=TaskType.NEGATIVITY.value)
+    parser.add_argument("--simulations", nargs="+", type=int, default=[10, 100, 1000])
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per call")
+    parser.add_argument("--max-n", type=int, default=MAX_N)
+    parser.add_argument("--max-concurrency", type=int, default=256)
+    parser.add_argument("--json", type=pathlib.Path, help="write the results to this file")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'sims':>6} {'fan-out':>8} {'gen-0 requests':>15} {'gen-0 prompt tokens':>20} {'distinct':>9} {'seconds':>8}")
+    for n_simulations in args.simulations:
+        for max_n in (None, args.max_n):
+            result = asyncio.run(run(args, n_simulations, max_n))
+            results.append(result)
+            print(f"{n_simulations:>6} {'yes' if result['fanout'] else 'no':>8} {result['requests']:>15} "
+                  f"{result['prompt_tokens']:>20} {result['distinct_summaries']:>9} {result['seconds']:>8.2f}")
+
+    if args.json is not None:
+        args.json.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
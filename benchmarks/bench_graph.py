@@ -0,0 +1,98 @@
+"""Compares `Node` graphs from `setup_transmission_chain` with `graph.ChainGraph`.
+
+For each size, both representations are built for the same chains and their construction
+time and memory (tracemalloc peak) are reported. Up to `--execute-nodes`, both are also run
+on `fake_model.AsyncFakeModel` with the same concurrency: gathering `Node.start` through a
+`scheduler.CallScheduler`, and `graph.TopologicalExecutor`.
+
+Usage:
+    python benchmarks/bench_graph.py --nodes 10000 100000 1000000
+    python benchmarks/bench_graph.py --nodes 1000000 --depth 20 --width 3 --execute-nodes 0
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import pathlib
+import sys
+import time
+import tracemalloc
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
+
+from bench_orchestration import chain_connections
+from configs import SchedulerConfig
+from enums import TaskType
+from fake_model import AsyncFakeModel
+from graph import ChainGraph, TopologicalExecutor
+from node import Node
+from scheduler import CallScheduler, run_simulations
+from tasks import TaskFactory
+from utils import setup_transmission_chain
+
+
+def measure(build):
+    """Returns (result, seconds, peak MB) of `build()`."""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - start
+    peak_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    return result, elapsed, peak_mb
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", nargs="+", type=int, default=[10000, 100000, 1000000],
+                        help="approximate number of nodes; rounded to whole simulations")
+    parser.add_argument("--depth", type=int, default=10)
+    parser.add_argument("--width", type=int, default=1)
+    parser.add_argument("--execute-nodes", type=int, default=20000, help="largest size that is also executed")
+    parser.add_argument("--max-concurrency", type=int, default=256)
+    parser.add_argument("--json", type=pathlib.Path, help="write the results to this file")
+    args = parser.parse_args()
+
+    connections = chain_connections(args.depth, args.width)
+    nodes_per_simulation = len(ChainGraph(connections))
+    model = AsyncFakeModel()
+    task = TaskFactory.create(TaskType.NEGATIVITY, model, model)
+    config = SchedulerConfig(max_concurrency=args.max_concurrency)
+
+    results = []
+    print(f"{'nodes':>9} {'repr.':6} {'build s':>8} {'build MB':>9} {'B/node':>7} {'run s':>7} {'nodes/s':>9}")
+    for n_nodes in args.nodes:
+        n_simulations = max(1, n_nodes // nodes_per_simulation)
+        n_nodes = n_simulations * nodes_per_simulation
+
+        builders = {
+            "Node": lambda: [setup_transmission_chain(connections, Node, task, idx) for idx in range(n_simulations)],
+            "CSR": lambda: ChainGraph(connections, n_simulations),
+        }
+        for name, build in builders.items():
+            built, build_s, build_mb = measure(build)
+            run_s = float("nan")
+            if n_nodes <= args.execute_nodes:
+                start = time.perf_counter()
+                if name == "Node":
+                    asyncio.run(run_simulations(built, CallScheduler(config)))
+                else:
+                    asyncio.run(TopologicalExecutor(built, task, config).run())
+                run_s = time.perf_counter() - start
+            del built
+
+            result = {"nodes": n_nodes, "representation": name, "build_s": build_s, "build_mb": build_mb,
+                      "bytes_per_node": build_mb * 2 ** 20 / n_nodes, "run_s": run_s,
+                      "run_nodes_per_s": n_nodes / run_s}
+            results.append(result)
+            print(f"{n_nodes:>9} {name:6} {build_s:>8.2f} {build_mb:>9.1f} {result['bytes_per_node']:>7.0f} "
+                  f"{run_s:>7.2f} {result['run_nodes_per_s']:>9.0f}")
+
+    if args.json is not None:
+        args.json.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""Compares a client per model with the clients borrowed from `http_pool`.
+
+A local HTTP/1.1 server answers chat completions after `--latency` seconds. Each round stands
+for one configuration of a sweep: it creates `--models` async models (e.g. an executor and
+an evaluator per task) that send `--requests` calls each, `--concurrency` at a time. With a
+client per model, as `OpenAIModel._setup_client` used to create, every model of every round
+opens its own connections. With the shared pool, all models of the endpoint borrow the same
+client, so connections are reused across models and rounds. The report gives the
+connections the server accepted, the pool's counters and the wall time.
+
+Usage:
+    python benchmarks/bench_http_pool.py --models 4 --rounds 5 --requests 50 --concurrency 16
+    python benchmarks/bench_http_pool.py --max-connections 8 --latency 0.05
+"""
+
+import argparse
+import asyncio
+import json
+import pathlib
+import sys
+import threading
+import time
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
+
+from openai import AsyncOpenAI
+
+from configs import HTTPPoolConfig
+from http_pool import HTTPPool, aclose_http_pools, get_pool
+
+COMPLETION = json.dumps({
+    "id": "chatcmpl-bench", "object": "chat.completion", "created": 0, "model": "bench",
+    "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "A summary."}}],
+    "usage": {"prompt_tokens": 10, "completion_tokens": 3, "total_tokens": 13},
+}).encode()
+
+
+class CompletionServer:
+    """Answers every request with `COMPLETION` on keep-alive connections, in a thread of its own."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.connections = 0
+        self.loop = asyncio.new_event_loop()
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = next((int(line.split(b":")[1]) for line in head.split(b"\r\n")
+                               if line.lower().startswith(b"content-length")), 0)
+                await reader.readexactly(length)
+                await asyncio.sleep(self.latency)
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                             b"Content-Length: %d\r\n\r\n%s" % (len(COMPLETION), COMPLETION))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.CancelledError, ConnectionError):
+            writer.close()
+
+    def _serve(self):
+        asyncio.set_event_loop(self.loop)
+        self.server = self.loop.run_until_complete(asyncio.start_server(self._handle, "127.0.0.1", 0))
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.ready.set()
+        self.loop.run_forever()
+
+    def __enter__(self):
+        self.thread.start()
+        self.ready.wait()
+        return self
+
+    async def _shutdown(self):
+        self.server.close()
+        handlers = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in handlers:
+            task.cancel()
+        await asyncio.gather(*handlers, return_exceptions=True)
+        self.loop.stop()
+
+    def __exit__(self, *exc):
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop)
+        self.thread.join()
+        self.loop.close()
+
+
+async def run_model(client, args):
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def call():
+        async with semaphore:
+            await client.chat.completions.create(model="bench", messages=[{"role": "user", "content": "Summarize."}])
+
+    await asyncio.gather(*(call() for _ in range(args.requests)))
+
+
+async def run(args, server, shared):
+    client_kwargs = {"api_key": "bench", "base_url": f"http://127.0.0.1:{server.port}/v1"}
+    config = HTTPPoolConfig(max_connections=args.max_connections)
+    owned = []
+    start = time.perf_counter()
+    for _ in range(args.rounds):
+        if shared:
+            pools = [get_pool(AsyncOpenAI, client_kwargs, config)] * args.models
+        else:
+            pools = [HTTPPool(AsyncOpenAI, client_kwargs, config) for _ in range(args.models)]
+            owned.extend(pools)
+        await asyncio.gather(*(run_model(pool.client(), args) for pool in pools))
+    elapsed = time.perf_counter() - start
+
+    stats = [pool.stats() for pool in (owned or pools[:1])]
+    if shared:
+        await aclose_http_pools()
+    for pool in owned:
+        await pool.aclose()
+    return {
+        "pool": "shared" if shared else "per model",
+        "requests": sum(s.total_requests for s in stats),
+        "server_connections": server.connections,
+        "opened": sum(s.total_opened for s in stats),
+        "reused": sum(s.total_reused for s in stats),
+        "waited": sum(s.total_waited for s in stats),
+        "wait_s": sum(s.wait_time for s in stats),
+        "seconds": elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", type=int, default=4, help="models created per round")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--requests", type=int, default=50, help="calls per model and round")
+    parser.add_argument("--concurrency", type=int, default=16, help="calls in flight per model")
+    parser.add_argument("--max-connections", type=int, default=None, help="connections per pool")
+    parser.add_argument("--latency", type=float, default=0.01, help="seconds the server takes per call")
+    parser.add_argument("--json", type=pathlib.Path, help="write the results to this file")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'pool':10} {'requests':>9} {'server conns':>13} {'opened':>7} {'reused':>7} {'waited':>7} "
+          f"{'wait s':>7} {'seconds':>8}")
+    for shared in (False, True):
+        with CompletionServer(args.latency) as server:
+            result = asyncio.run(run(args, server, shared))
+        results.append(result)
+        print(f"{result['pool']:10} {result['requests']:>9} {result['server_connections']:>13} {result['opened']:>7} "
+              f"{result['reused']:>7} {result['waited']:>7} {result['wait_s']:>7.2f} {result['seconds']:>8.2f}")
+
+    if args.json is not None:
+        args.json.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Measures the cold import time of our modules with `python -X importtime`.
+
+Each module is imported in a fresh interpreter, several times, and the median cumulative
+time is reported together with the heaviest dependencies it pulled in. The run fails when
+a module exceeds its budget or loads a dependency it should not, which keeps short-lived
+batch workers from regressing to importing pandas or the openai SDK just to create a task.
+
+Usage:
+    python benchmarks/bench_import_time.py
+    python benchmarks/bench_import_time.py --modules tasks openai_model --repeat 10 --json out.json
+"""
+
+import argparse
+import json
+import pathlib
+import statistics
+import subprocess
+import sys
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+# module -> (budget in ms, dependencies it must not import)
+BUDGETS = {
+    "registry": (50, ["pandas", "openai", "tasks"]),
+    "prompt_generator": (150, ["pandas", "openai"]),
+    "tasks": (300, ["pandas", "openai", "openpyxl", "docx"]),
+    "node": (150, ["pandas", "openai"]),
+    "utils": (150, ["pandas", "openai", "docx"]),
+    "fake_model": (2000, ["pandas"]),
+    "openai_model": (2000, ["pandas"]),
+}
+
+
+def import_profile(module):
+    """Imports `module` in a fresh interpreter; returns {imported module: (self us, cumulative us)}."""
+    code = f"import {module}"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    profile = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        profile[name.strip()] = (int(self_us), int(cumulative_us))
+    return profile
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modules", nargs="+", default=list(BUDGETS))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=3, help="number of heaviest dependencies to show")
+    parser.add_argument("--json", type=pathlib.Path, help="write the results to this file")
+    args = parser.parse_args()
+
+    results, failures = [], []
+    print(f"{'module':18} {'median ms':>10} {'budget ms':>10}  heaviest dependencies")
+    for module in args.modules:
+        budget_ms, forbidden = BUDGETS.get(module, (None, []))
+        profiles = [import_profile(module) for _ in range(args.repeat)]
+        median_ms = statistics.median(profile[module][1] for profile in profiles) / 1000
+
+        # top-level packages ranked by their cumulative time in the last run
+        profile = profiles[-1]
+        packages = {name: cumulative for name, (_, cumulative) in profile.items()
+                    if "." not in name and name != module}
+        heaviest = sorted(packages.items(), key=lambda item: -item[1])[:args.top]
+        loaded = sorted(dependency for dependency in forbidden if dependency in profile)
+
+        print(f"{module:18} {median_ms:>10.1f} {budget_ms if budget_ms is not None else '-':>10}  "
+              + ", ".join(f"{name} {cumulative / 1000:.1f}" for name, cumulative in heaviest))
+
+        if budget_ms is not None and median_ms > budget_ms:
+            failures.append(f"{module} took {median_ms:.1f} ms (budget {budget_ms} ms)")
+        if loaded:
+            failures.append(f"{module} imports {', '.join(loaded)}")
+        results.append({"module": module, "median_ms": median_ms, "budget_ms": budget_ms,
+                        "heaviest": dict(heaviest), "forbidden_imports": loaded})
+
+    if args.json is not None:
+        args.json.write_text(json.dumps(results, indent=2))
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
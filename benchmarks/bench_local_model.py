@@ -0,0 +1,98 @@
+"""Measures the throughput of `local_model.AsyncLocalModel` at several batch sizes.
+
+`--requests` execution calls, cycling through the first-generation prompts of every task
+on its bundled story or statements, are sent at once, as concurrent nodes would send
+them. They are greedy (`temperature=0`) and generate up to `--max-tokens` tokens each. For
+every `--batch-sizes` value, the batcher runs at most that many calls per forward pass;
+the weights are loaded once and a warm-up batch runs before the timed calls. The report
+gives the requests and generated tokens per second, the mean batch size the batcher
+formed and the median and 95th percentile latency of a call.
+
+Usage:
+    python benchmarks/bench_local_model.py --model HuggingFaceTB/SmolLM2-135M-Instruct
+    python benchmarks/bench_local_model.py --model ./my-model --batch-sizes 1 4 16 --requests 64 --threads 8
+"""
+
+import argparse
+import asyncio
+import json
+import pathlib
+import statistics
+import sys
+import time
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
+
+from bench_orchestration import TASK_KWARGS
+from configs import LocalModelConfig
+from fake_model import FakeModel
+from local_model import AsyncLocalModel
+from tasks import TaskFactory
+
+
+def bundled_prompts():
+    """The messages of the first execution call of every task."""
+    prompts = []
+    for task_type, kwargs in TASK_KWARGS.items():
+        task = TaskFactory.create(task_type, FakeModel(), FakeModel(), **kwargs)
+        prompts.append(task.execution_messages(None))
+    return prompts
+
+
+async def run(args, batch_size, prompts):
+    config = LocalModelConfig(args.model, dtype=args.dtype, num_threads=args.threads, max_batch_size=batch_size,
+                              batch_window_s=args.window)
+    model = AsyncLocalModel(config, {"temperature": 0, "max_tokens": args.max_tokens})
+    await model.query(prompts[0])
+
+    async def timed(messages):
+        start = time.perf_counter()
+        response = await model.query(messages)
+        return time.perf_counter() - start, response.usage.completion_tokens
+
+    before = model.batcher.stats()
+    start = time.perf_counter()
+    calls = await asyncio.gather(*(timed(prompts[idx % len(prompts)]) for idx in range(args.requests)))
+    elapsed = time.perf_counter() - start
+    after = model.batcher.stats()
+
+    latencies = sorted(latency for latency, _ in calls)
+    return {
+        "batch_size": batch_size,
+        "requests_per_s": args.requests / elapsed,
+        "tokens_per_s": sum(tokens for _, tokens in calls) / elapsed,
+        "mean_batch": (after.requests - before.requests) / (after.batches - before.batches),
+        "p50_s": statistics.median(latencies),
+        "p95_s": latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))],
+        "seconds": elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", required=True, help="Hugging Face Hub name or local directory")
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 2, 4, 8, 16])
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--max-tokens", type=int, default=64)
+    parser.add_argument("--window", type=float, default=0.02, help="batch window (s)")
+    parser.add_argument("--dtype", default="float32")
+    parser.add_argument("--threads", type=int, help="torch threads")
+    parser.add_argument("--json", type=pathlib.Path, help="write the results to this file")
+    args = parser.parse_args()
+
+    prompts = bundled_prompts()
+    results = []
+    print(f"{'batch':>5} {'req/s':>7} {'tok/s':>8} {'mean batch':>10} {'p50 s':>7} {'p95 s':>7} {'seconds':>8}")
+    for batch_size in args.batch_sizes:
+        result = asyncio.run(run(args, batch_size, prompts))
+        results.append(result)
+        print(f"{batch_size:>5} {result['requests_per_s']:>7.2f} {result['tokens_per_s']:>8.1f} "
+              f"{result['mean_batch']:>10.1f} {result['p50_s']:>7.2f} {result['p95_s']:>7.2f} "
+              f"{result['seconds']:>8.2f}")
+
+    if args.json is not None:
+        args.json.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""Benchmarks the orchestration overhead of Node, setup_transmission_chain and the task layer.
+
+Every call goes to `fake_model.AsyncFakeModel`, so no network access or quota is needed and
+the numbers isolate our own overhead from API latency.
+
+Usage:
+    python benchmarks/bench_orchestration.py --depths 1 5 10 --widths 1 2 --simulations 10 100 1000
+    python benchmarks/bench_orchestration.py --tasks negativity --simulations 10000 --latency 0.05 --json out.json
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import pathlib
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
+
+from configs import FakeModelConfig
+from enums import TaskType
+from fake_model import AsyncFakeModel
+from node import Node
+from tasks import TaskFactory
+from utils import setup_transmission_chain
+
+# TaskType.TELEPHONE_GAME is the abstract base and has no concrete task
+TASK_KWARGS = {
+    TaskType.GENDER_STEREOTYPE_CONSISTENCY: {},
+    TaskType.NEGATIVITY: {},
+    TaskType.AMBIGUITY: {},
+    TaskType.SOCIAL: {},
+    TaskType.THREAT: {"study": "lancer"},
+    TaskType.MULTIPLEBIAS: {"study": "Muki"},
+}
+
+
+class TimedNode(Node):
+    """Node recording the time from its inputs being ready to its evaluation being done."""
+
+    latencies = []
+
+    async def start(self):
+        if len(self.inputs) != len(self.receive_input_from):
+            await self.input_event.wait()
+        start = time.perf_counter()
+        await super().start()
+        self.latencies.append(time.perf_counter() - start)
+        return True
+
+
+def chain_connections(depth, width):
+    """`width` parallel lines of `depth` transmissions each."""
+    return [[[i] for i in range(width)] for _ in range(depth)]
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return float("nan")
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+async def monitor(stop, interval, lags, threads):
+    """Samples event-loop lag (oversleep of `interval`) and the number of live threads."""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+        threads.append(threading.active_count())
+
+
+async def run_cell(task, depth, width, n_simulations):
+    TimedNode.latencies = []
+    lags, threads = [], []
+    stop = asyncio.Event()
+    monitor_task = asyncio.ensure_future(monitor(stop, 0.01, lags, threads))
+
+    start = time.perf_counter()
+    connections = chain_connections(depth, width)
+    simulations = [setup_transmission_chain(connections, TimedNode, task, idx) for idx in range(n_simulations)]
+    setup_time = time.perf_counter() - start
+
+    await asyncio.gather(*[node.start() for all_nodes in simulations for generation in all_nodes for node in generation])
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await monitor_task
+
+    n_nodes = len(TimedNode.latencies)
+    return {
+        "nodes": n_nodes,
+        "setup_s": setup_time,
+        "elapsed_s": elapsed,
+        "throughput_nodes_per_s": n_nodes / elapsed,
+        "node_latency_p50_ms": 1000 * percentile(TimedNode.latencies, 50),
+        "node_latency_p95_ms": 1000 * percentile(TimedNode.latencies, 95),
+        "node_latency_p99_ms": 1000 * percentile(TimedNode.latencies, 99),
+        "loop_lag_mean_ms": 1000 * statistics.mean(lags) if lags else 0.0,
+        "loop_lag_max_ms": 1000 * max(lags) if lags else 0.0,
+        "max_threads": max(threads) if threads else threading.active_count(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", nargs="+", default=[t.value for t in TASK_KWARGS],
+                        choices=[t.value for t in TASK_KWARGS])
+    parser.add_argument("--depths", nargs="+", type=int, default=[1, 5])
+    parser.add_argument("--widths", nargs="+", type=int, default=[1])
+    parser.add_argument("--simulations", nargs="+", type=int, default=[10, 100, 1000])
+    parser.add_argument("--latency", type=float, default=0.0, help="mean latency of a fake call (s)")
+    parser.add_argument("--latency-std", type=float, default=0.0)
+    parser.add_argument("--latency-distribution", default="lognormal")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--output-tokens", nargs=2, type=int, default=[50, 200])
+    parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc (it slows the run down)")
+    parser.add_argument("--json", type=pathlib.Path, help="write the results to this file")
+    args = parser.parse_args()
+
+    fake_config = FakeModelConfig(
+        latency_distribution=args.latency_distribution,
+        latency_mean=args.latency,
+        latency_std=args.latency_std,
+        output_tokens_min=args.output_tokens[0],
+        output_tokens_max=args.output_tokens[1],
+        error_rate=args.error_rate,
+    )
+
+    results = []
+    header = f"{'task':32} {'depth':>5} {'width':>5} {'sims':>6} {'nodes':>8} {'nodes/s':>10} " \
+             f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'lag ms':>8} {'threads':>7} {'peak MB':>8}"
+    print(header)
+    for task_name, depth, width, n_simulations in itertools.product(
+            args.tasks, args.depths, args.widths, args.simulations):
+        task_type = TaskType(task_name)
+        model = AsyncFakeModel(fake_config)
+        task = TaskFactory.create(task_type, model, model, **TASK_KWARGS[task_type])
+
+        if not args.no_memory:
+            tracemalloc.start()
+        result = asyncio.run(run_cell(task, depth, width, n_simulations))
+        peak_mb = float("nan")
+        if not args.no_memory:
+            peak_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+
+        result.update(task=task_name, depth=depth, width=width, simulations=n_simulations,
+                      peak_memory_mb=peak_mb, calls=model.calls, errors=model.errors)
+        results.append(result)
+        print(f"{task_name:32} {depth:>5} {width:>5} {n_simulations:>6} {result['nodes']:>8} "
+              f"{result['throughput_nodes_per_s']:>10.1f} {result['node_latency_p50_ms']:>8.2f} "
+              f"{result['node_latency_p95_ms']:>8.2f} {result['node_latency_p99_ms']:>8.2f} "
+              f"{result['loop_lag_max_ms']:>8.2f} {result['max_threads']:>7} {peak_mb:>8.1f}")
+
+    if args.json is not None:
+        args.json.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Measures prompt rendering and the share of prompt tokens served from a provider's prompt cache.
+
+Render cost: the compiled prompts of every task (see `prompt_generator.TaskPrompt.compile`)
+against the previous rendering, which ran a regex over the template and re-rendered the
+phrases and the original story on every call. Both produce the same messages.
+
+Cached share: chains run on `fake_model.AsyncFakeModel` with simulated prompt caching
+(`--cache-min-tokens`, in words) under a `tracing.Tracer`. The report gives, per task, the
+prompt and cached tokens the usage data reports, and their ratio.
+
+Usage:
+    python benchmarks/bench_prompts.py --renders 20000
+    python benchmarks/bench_prompts.py --cache-min-tokens 256 --simulations 50 --depth 5
+"""
+
+import argparse
+import asyncio
+import json
+import pathlib
+import re
+import sys
+import time
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
+
+from bench_orchestration import TASK_KWARGS, chain_connections
+from configs import FakeModelConfig
+from enums import OpenAIBackendRole
+from fake_model import AsyncFakeModel
+from node import Node
+from scheduler import run_simulations
+from tasks import TaskFactory
+from tracing import Tracer
+from utils import setup_transmission_chain
+
+SUMMARY = "A short summary of the story, as a node of the chain would write it. " * 8
+
+
+def legacy_format(template, **kwargs):
+    """`TextPrompt.format` before the templates were parsed once."""
+    default_kwargs = {key: '{' + f'{key}' + '}' for key in set(re.findall(r'{([^}]*)}', template))}
+    default_kwargs.update(kwargs)
+    return template.format(**kwargs)
+
+
+def legacy_messages(system_prompt, user_prompt, **kwargs):
+    return [
+        {"role": OpenAIBackendRole.SYSTEM.value, "content": legacy_format(system_prompt.str, **kwargs)},
+        {"role": OpenAIBackendRole.USER.value, "content": legacy_format(user_prompt.str, **kwargs)},
+    ]
+
+
+def renderers(task):
+    """(name, legacy render, compiled render) of the messages the task sends for every node."""
+    prompts = task.prompts
+    if not task.requires_evaluation:
+        statements = list(task.statements)
+        return [(
+            "execution",
+            lambda: legacy_messages(prompts.task_system_prompt, prompts.task_user_prompt, narrative=task.narrative,
+                                    statements="\n".join(statements), n=len(statements) - 1),
+            lambda: task.execution_messages([statements]),
+        )]
+    return [
+        (
+            "execution",
+            lambda: legacy_messages(prompts.task_system_prompt, prompts.task_user_prompt, input_story=SUMMARY),
+            lambda: task.execution_messages([SUMMARY]),
+        ),
+        (
+            "evaluation",
+            lambda: legacy_messages(prompts.eval_system_prompt, prompts.eval_user_prompt,
+                                    original_story=task._original_story, phrases=task._phrases, summary=SUMMARY),
+            lambda: task.evaluation_messages(SUMMARY),
+        ),
+    ]
+
+
+def time_calls(render, n):
+    start = time.perf_counter()
+    for _ in range(n):
+        render()
+    return (time.perf_counter() - start) / n
+
+
+async def run_chains(task, connections, n_simulations):
+    simulations = [setup_transmission_chain(connections, Node, task, idx) for idx in range(n_simulations)]
+    with Tracer() as tracer:
+        await run_simulations(simulations)
+    return tracer.summary()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", nargs="+", default=[task_type.value for task_type in TASK_KWARGS])
+    parser.add_argument("--renders", type=int, default=20000, help="renders timed per task and message kind")
+    parser.add_argument("--simulations", type=int, default=20)
+    parser.add_argument("--depth", type=int, default=5)
+    parser.add_argument("--width", type=int, default=1)
+    parser.add_argument("--cache-min-tokens", type=int, default=1024,
+                        help="shortest cached prefix, in words; OpenAI caches from 1024 tokens")
+    parser.add_argument("--json", type=pathlib.Path, help="write the results to this file")
+    args = parser.parse_args()
+
+    task_types = [task_type for task_type in TASK_KWARGS if task_type.value in args.tasks]
+    results = {"render": [], "cache": []}
+
+    print(f"{'task':30} {'messages':10} {'legacy us':>10} {'compiled us':>12} {'speedup':>8}")
+    for task_type in task_types:
+        task = TaskFactory.create(task_type, None, None, **TASK_KWARGS[task_type])
+        for name, legacy, compiled in renderers(task):
+            assert legacy() == compiled(), f"{task_type.value} {name} messages differ"
+            legacy_s, compiled_s = time_calls(legacy, args.renders), time_calls(compiled, args.renders)
+            results["render"].append({"task": task_type.value, "messages": name, "legacy_s": legacy_s,
+                                      "compiled_s": compiled_s, "speedup": legacy_s / compiled_s})
+            print(f"{task_type.value:30} {name:10} {legacy_s * 1e6:>10.1f} {compiled_s * 1e6:>12.1f} "
+                  f"{legacy_s / compiled_s:>7.1f}x")
+
+    print()
+    print(f"{'task':30} {'calls':>6} {'prompt tokens':>14} {'cached tokens':>14} {'cached share':>13}")
+    connections = chain_connections(args.depth, args.width)
+    for task_type in task_types:
+        model = AsyncFakeModel(FakeModelConfig(prompt_cache_min_tokens=args.cache_min_tokens))
+        task = TaskFactory.create(task_type, model, model, **TASK_KWARGS[task_type])
+        row = asyncio.run(run_chains(task, connections, args.simulations)).iloc[0]
+        result = {"task": task_type.value, "calls": int(row["calls"]), "prompt_tokens": int(row["prompt_tokens"]),
+                  "cached_tokens": int(row["cached_tokens"]), "cached_share": float(row["cached_share"])}
+        results["cache"].append(result)
+        print(f"{task_type.value:30} {result['calls']:>6} {result['prompt_tokens']:>14} {result['cached_tokens']:>14} "
+              f"{result['cached_share']:>13.1%}")
+
+    if args.json is not None:
+        args.json.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Compares the makespan of deep chains run with and without `scheduler.CallScheduler`.
+
+All calls go to `fake_model.AsyncFakeModel`, and concurrency is capped at `--max-concurrency`
+calls in flight: by a plain semaphore shared by execution and evaluation calls ("none"),
+or by the scheduler with each `EvaluationPolicy`. Two makespans are reported: until every
+chain is generated, and until every node is also evaluated.
+
+Usage:
+    python benchmarks/bench_scheduler.py --depth 10 --simulations 50 --max-concurrency 16 --latency 0.05
+"""
+
+import argparse
+import asyncio
+import json
+import pathlib
+import sys
+import time
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
+
+from bench_orchestration import chain_connections
+from configs import FakeModelConfig, SchedulerConfig
+from enums import EvaluationPolicy, TaskType
+from fake_model import AsyncFakeModel
+from node import Node
+from scheduler import CallScheduler, run_simulations
+from tasks import TaskFactory
+from utils import setup_transmission_chain
+
+
+class TimedNode(Node):
+    """Node recording when its output was sent downstream."""
+
+    def send_output(self):
+        self.sent_at = time.perf_counter()
+        super().send_output()
+
+
+class SemaphoreModel(AsyncFakeModel):
+    """AsyncFakeModel whose calls share one semaphore, i.e., the unscheduled baseline."""
+
+    def __init__(self, config, max_concurrency):
+        super().__init__(config)
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def query(self, messages, parameters=None, stream_stop=None):
+        async with self.semaphore:
+            return await super().query(messages, parameters, stream_stop)
+
+
+async def run(policy, args):
+    config = FakeModelConfig(latency_distribution=args.latency_distribution, latency_mean=args.latency,
+                             latency_std=args.latency_std)
+    if policy == "none":
+        model, scheduler = SemaphoreModel(config, args.max_concurrency), None
+    else:
+        model = AsyncFakeModel(config)
+        scheduler = CallScheduler(SchedulerConfig(max_concurrency=args.max_concurrency,
+                                                  evaluation_policy=EvaluationPolicy(policy)))
+    task = TaskFactory.create(TaskType(args.task), model, model)
+
+    connections = chain_connections(args.depth, args.width)
+    simulations = [setup_transmission_chain(connections, TimedNode, task, idx) for idx in range(args.simulations)]
+    start = time.perf_counter()
+    if scheduler is None:
+        await asyncio.gather(*[node.start() for all_nodes in simulations for generation in all_nodes for node in generation])
+    else:
+        await run_simulations(simulations, scheduler)
+    elapsed = time.perf_counter() - start
+
+    generated = max(node.sent_at for all_nodes in simulations for generation in all_nodes for node in generation) - start
+    return {"policy": policy, "generation_makespan_s": generated, "makespan_s": elapsed, "calls": model.calls}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--policies", nargs="+", default=["none"] + [p.value for p in EvaluationPolicy],
+                        choices=["none"] + [p.value for p in EvaluationPolicy])
+    parser.add_argument("--task", default=TaskType.NEGATIVITY.value)
+    parser.add_argument("--depth", type=int, default=10)
+    parser.add_argument("--width", type=int, default=1)
+    parser.add_argument("--simulations", type=int, default=50)
+    parser.add_argument("--max-concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.05, help="mean latency of a fake call (s)")
+    parser.add_argument("--latency-std", type=float, default=0.02)
+    parser.add_argument("--latency-distribution", default="lognormal")
+    parser.add_argument("--json", type=pathlib.Path, help="write the results to this file")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'policy':10} {'generated s':>12} {'makespan s':>11} {'calls':>7}")
+    for policy in args.policies:
+        result = asyncio.run(run(policy, args))
+        results.append(result)
+        print(f"{policy:10} {result['generation_makespan_s']:>12.2f} {result['makespan_s']:>11.2f} {result['calls']:>7}")
+
+    if args.json is not None:
+        args.json.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
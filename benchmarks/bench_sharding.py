@@ -0,0 +1,90 @@
+"""Compares a run on one event loop with `sharding.run_sharded` over several worker processes.
+
+The same simulations run on `fake_model.AsyncFakeModel` in this process
+(`sink.run_streaming`), then sharded over each number of `--workers`. With a low
+`--latency`, the run is bound by CPU work (rendering, parsing, the fake model), which one
+event loop cannot spread over cores. The report gives the wall time, throughput and
+speedup, and checks that every node is in the merged results exactly once.
+
+Usage:
+    python benchmarks/bench_sharding.py --simulations 2000 --workers 1 2 4 8
+    python benchmarks/bench_sharding.py --simulations 500 --depth 10 --latency 0.05
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import pathlib
+import sys
+import tempfile
+import time
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
+
+from bench_orchestration import chain_connections
+from configs import FakeModelConfig, ModelSpec, ShardConfig
+from enums import TaskType
+from fake_model import AsyncFakeModel
+from node import Node
+from scheduler import CallScheduler
+from sharding import run_sharded
+from sink import ResultSink, load_results, run_streaming
+from tasks import TaskFactory
+from utils import setup_transmission_chain
+
+
+async def run_inline(args, connections, output_path):
+    model = AsyncFakeModel(FakeModelConfig(latency_mean=args.latency))
+    task = TaskFactory.create(TaskType(args.task), model, model)
+    async with ResultSink(output_path) as sink:
+        await run_streaming(lambda idx: setup_transmission_chain(connections, Node, task, idx), args.simulations,
+                            sink, args.shard_size * args.shards_per_worker, CallScheduler())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--task", default=TaskType.NEGATIVITY.value)
+    parser.add_argument("--simulations", type=int, default=2000)
+    parser.add_argument("--depth", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.0, help="mean seconds per call")
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, 2, 4])
+    parser.add_argument("--shard-size", type=int, default=16)
+    parser.add_argument("--shards-per-worker", type=int, default=4)
+    parser.add_argument("--json", type=pathlib.Path, help="write the results to this file")
+    args = parser.parse_args()
+
+    connections = chain_connections(args.depth, 1)
+    n_nodes = args.simulations * (args.depth + 1)
+    spec = ModelSpec("async_fake", (FakeModelConfig(latency_mean=args.latency),))
+    results = []
+    print(f"cores: {os.cpu_count()}")
+    print(f"{'runner':10} {'workers':>8} {'seconds':>8} {'nodes/s':>9} {'speedup':>8} {'complete':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        baseline = None
+        for n_workers in [0] + args.workers:
+            output_path = pathlib.Path(tmp) / f"run-{n_workers}.jsonl"
+            start = time.perf_counter()
+            if n_workers == 0:
+                asyncio.run(run_inline(args, connections, output_path))
+            else:
+                config = ShardConfig(n_workers=n_workers, shard_size=args.shard_size,
+                                     shards_per_worker=args.shards_per_worker)
+                run_sharded(TaskType(args.task), connections, args.simulations, output_path, spec, spec, config=config)
+            elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+
+            data = load_results(output_path)
+            complete = len(data) == n_nodes and not data.duplicated(["sim_id", "generation", "position"]).any()
+            result = {"runner": "inline" if n_workers == 0 else "sharded", "workers": n_workers, "seconds": elapsed,
+                      "nodes_per_s": n_nodes / elapsed, "speedup": baseline / elapsed, "complete": bool(complete)}
+            results.append(result)
+            print(f"{result['runner']:10} {n_workers:>8} {elapsed:>8.2f} {result['nodes_per_s']:>9.0f} "
+                  f"{result['speedup']:>7.2f}x {str(result['complete']):>9}")
+
+    if args.json is not None:
+        args.json.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
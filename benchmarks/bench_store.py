@@ -0,0 +1,139 @@
+"""Compares queries on `results_store.ResultsStore` with reading the runs' `ResultSink` JSONL files.
+
+Synthetic runs (`--tasks` x `--models` x `--runs` runs of `--simulations` chains of
+`--depth` generations, with outputs of about `--words` words) are written once as JSONL
+files and once to a store in each format. Each backend then answers two queries: the
+texts of one generation of one task and model, and a count of nodes per task and model
+over all runs. The JSONL backend loads every file with `sink.load_results`, as a notebook
+would; the store reads the partitions and columns the query needs. The report gives the
+disk size, the write time and the time of each query.
+
+Usage:
+    python benchmarks/bench_store.py --simulations 1000 --depth 10
+    python benchmarks/bench_store.py --tasks 4 --models 3 --runs 2 --words 300
+"""
+
+import argparse
+import json
+import pathlib
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
+
+import pandas as pd
+
+from results_store import ResultsStore
+from sink import load_results
+
+VOCABULARY = ("the story of a girl who travels to her parents house and meets an old friend on the train "
+              "while the weather turns and the flight is delayed until the evening").split()
+
+
+def synthetic_runs(args):
+    """(task, model, run, records) of every run."""
+    rng = random.Random(0)
+    for task_idx in range(args.tasks):
+        for model_idx in range(args.models):
+            for run_idx in range(args.runs):
+                records = [{
+                    "sim_id": sim_id, "id": [generation, 0], "input_hash": f"{rng.getrandbits(64):016x}",
+                    "output": " ".join(rng.choices(VOCABULARY, k=args.words)),
+                    "evaluation": "\n".join(rng.choices(VOCABULARY, k=10)),
+                    "execute_s": rng.random(), "evaluate_s": rng.random(), "finished_at": time.time(),
+                } for sim_id in range(args.simulations) for generation in range(args.depth)]
+                yield f"task-{task_idx}", f"model-{model_idx}", f"run-{run_idx}", records
+
+
+def size_of(path):
+    return sum(f.stat().st_size for f in pathlib.Path(path).rglob("*") if f.is_file())
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, default=3)
+    parser.add_argument("--models", type=int, default=2)
+    parser.add_argument("--runs", type=int, default=2, help="runs per task and model")
+    parser.add_argument("--simulations", type=int, default=500)
+    parser.add_argument("--depth", type=int, default=5)
+    parser.add_argument("--words", type=int, default=150, help="words per output")
+    parser.add_argument("--json", type=pathlib.Path, help="write the results to this file")
+    args = parser.parse_args()
+
+    root = pathlib.Path(tempfile.mkdtemp(prefix="bench_store_"))
+    target = {"task": "task-0", "model": "model-0", "generation": args.depth // 2}
+    results = []
+    try:
+        runs = list(synthetic_runs(args))
+
+        def write_jsonl():
+            for task, model, run, records in runs:
+                with open(root / "jsonl" / f"{task}.{model}.{run}.jsonl", "w") as f:
+                    f.writelines(json.dumps(record) + "\n" for record in records)
+
+        def jsonl_texts():
+            frames = []
+            for path in sorted((root / "jsonl").glob("*.jsonl")):
+                task, model, run = path.stem.split(".")
+                frames.append(load_results(path).assign(task=task, model=model, run=run))
+            data = pd.concat(frames)
+            data = data[(data.task == target["task"]) & (data.model == target["model"])
+                        & (data.generation == target["generation"])]
+            return data["output"].tolist()
+
+        def jsonl_counts():
+            frames = [load_results(path).assign(key=path.stem.rsplit(".", 1)[0])
+                      for path in (root / "jsonl").glob("*.jsonl")]
+            return pd.concat(frames).groupby("key").size().to_dict()
+
+        (root / "jsonl").mkdir()
+        _, write_s = timed(write_jsonl)
+        texts, texts_s = timed(jsonl_texts)
+        _, counts_s = timed(jsonl_counts)
+        results.append({"backend": "jsonl", "mb": size_of(root / "jsonl") / 1e6, "write_s": write_s,
+                        "texts_s": texts_s, "counts_s": counts_s, "texts": len(texts)})
+
+        for fmt in ("arrow", "parquet"):
+            store = ResultsStore(root / fmt, fmt)
+
+            def write_store():
+                for task, model, run, records in runs:
+                    store.write_run(run, task, records, model)
+
+            def store_texts():
+                return store.texts(store.nodes(columns=["task", "model", "run", "output_offset", "output_length"],
+                                               **target))
+
+            def store_counts():
+                return store.nodes(columns=["task", "model"]).group_by(["task", "model"]).aggregate([([], "count_all")])
+
+            _, write_s = timed(write_store)
+            texts, texts_s = timed(store_texts)
+            _, counts_s = timed(store_counts)
+            results.append({"backend": fmt, "mb": size_of(root / fmt) / 1e6, "write_s": write_s,
+                            "texts_s": texts_s, "counts_s": counts_s, "texts": len(texts)})
+    finally:
+        shutil.rmtree(root)
+
+    nodes = args.tasks * args.models * args.runs * args.simulations * args.depth
+    print(f"{nodes} nodes in {args.tasks * args.models * args.runs} runs")
+    print(f"{'backend':8} {'MB':>8} {'write s':>8} {'texts s':>8} {'counts s':>9} {'texts':>7}")
+    for result in results:
+        print(f"{result['backend']:8} {result['mb']:>8.1f} {result['write_s']:>8.2f} {result['texts_s']:>8.3f} "
+              f"{result['counts_s']:>9.3f} {result['texts']:>7}")
+
+    if args.json is not None:
+        args.json.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Compares execution calls without streaming, streamed, and streamed with an early stop.
+
+Chains run on `fake_model.AsyncFakeModel`, which answers after `--latency` seconds and then
+decodes `--tokens-per-s` words per second. Streamed calls are collected into the same
+responses (`streaming.acollect_stream`); with the early stop, `ThreatTask` closes the stream
+once the expected statements arrived and the other tasks once the summary reached
+`--summary-words` (`task.set_summary_budget`). The report gives, per task and mode, the mean
+time an execution call held its slot (`api_s`), the mean time to first token and decoding
+rate of the streamed calls, the share of calls stopped early and the wall time.
+
+Usage:
+    python benchmarks/bench_streaming.py --simulations 20 --depth 5
+    python benchmarks/bench_streaming.py --tasks threat --tokens-per-s 30 --latency 0.5
+"""
+
+import argparse
+import asyncio
+import json
+import pathlib
+import statistics
+import sys
+import time
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
+
+from bench_orchestration import TASK_KWARGS, chain_connections
+from configs import FakeModelConfig
+from fake_model import AsyncFakeModel
+from node import Node
+from scheduler import run_simulations
+from tasks import TaskFactory
+from tracing import Tracer
+from utils import setup_transmission_chain
+
+MODES = ("plain", "stream", "stream+stop")
+
+
+async def run(args, task_type, mode):
+    config = FakeModelConfig(latency_mean=args.latency, latency_distribution="constant",
+                             tokens_per_s=args.tokens_per_s)
+    execute_model = AsyncFakeModel(config, {"stream": mode != "plain"})
+    evaluate_model = AsyncFakeModel(FakeModelConfig())
+    task = TaskFactory.create(task_type, execute_model, evaluate_model, **TASK_KWARGS[task_type])
+    if mode == "stream+stop":
+        task.set_summary_budget(args.summary_words)
+    elif task.execution_stop(None) is not None:
+        # `ThreatTask` stops after its statements whenever it streams; measure the stream without it
+        task.execution_stop = lambda input_story: None
+    simulations = [setup_transmission_chain(chain_connections(args.depth, 1), Node, task, idx)
+                   for idx in range(args.simulations)]
+
+    start = time.perf_counter()
+    with Tracer() as tracer:
+        await run_simulations(simulations)
+    elapsed = time.perf_counter() - start
+
+    spans = [span for span in tracer.spans if span.name == "llm.query" and span.parent.name == "node.process"]
+    streamed = [span for span in spans if "ttft_s" in span.attributes]
+    rates = [span.attributes["tokens_per_s"] for span in streamed if "tokens_per_s" in span.attributes]
+    return {
+        "task": task_type.value,
+        "mode": mode,
+        "calls": len(spans),
+        "api_s": statistics.fmean(span.attributes["api_s"] for span in spans),
+        "ttft_s": statistics.fmean(span.attributes["ttft_s"] for span in streamed) if streamed else None,
+        "tokens_per_s": statistics.fmean(rates) if rates else None,
+        "stopped_early": sum(span.attributes.get("stopped_early", False) for span in spans) / len(spans),
+        "seconds": elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", nargs="+", default=["negativity", "threat"])
+    parser.add_argument("--simulations", type=int, default=20)
+    parser.add_argument("--depth", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.3, help="seconds to first token")
+    parser.add_argument("--tokens-per-s", type=float, default=60.0)
+    parser.add_argument("--summary-words", type=int, default=60, help="summary budget of the early stop")
+    parser.add_argument("--json", type=pathlib.Path, help="write the results to this file")
+    args = parser.parse_args()
+
+    task_types = [task_type for task_type in TASK_KWARGS if task_type.value in args.tasks]
+    results = []
+    print(f"{'task':30} {'mode':12} {'calls':>6} {'api s':>7} {'ttft s':>7} {'tok/s':>7} {'stopped':>8} {'seconds':>8}")
+    for task_type in task_types:
+        for mode in MODES:
+            result = asyncio.run(run(args, task_type, mode))
+            results.append(result)
+            ttft = "-" if result["ttft_s"] is None else f"{result['ttft_s']:.2f}"
+            rate = "-" if result["tokens_per_s"] is None else f"{result['tokens_per_s']:.0f}"
+            print(f"{result['task']:30} {mode:12} {result['calls']:>6} {result['api_s']:>7.2f} {ttft:>7} {rate:>7} "
+                  f"{result['stopped_early']:>8.0%} {result['seconds']:>8.2f}")
+
+    if args.json is not None:
+        args.json.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Calibrates `cascade.EvaluationCascade` against the human codings in `study-data/coding`.
+
+For each coded study, the summaries in `study-data/output` are scored locally and compared
+with the coders' decisions. The thresholds that settle the most phrases with at least
+`--min-accuracy` agreement are reported, with the evaluator calls and prompt tokens left.
+
+Usage:
+    python benchmarks/calibrate_cascade.py --min-accuracy 0.95
+    python benchmarks/calibrate_cascade.py --study Negativity --table
+"""
+
+import argparse
+import json
+import pathlib
+import sys
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
+
+from cascade import calibrate
+from configs import CascadeConfig
+from enums import TaskType
+from tasks import TaskFactory
+from utils import read_summaries
+
+OUTPUT_DIR = pathlib.Path(__file__).resolve().parent.parent / "study-data" / "output"
+
+# study: (task type, task kwargs, summaries coded in `coding_data`)
+STUDIES = {
+    "Stereotype": (TaskType.GENDER_STEREOTYPE_CONSISTENCY, {}, "Stereotype consistency.docx"),
+    "Negativity": (TaskType.NEGATIVITY, {}, "Negativity.docx"),
+    "Ambiguity": (TaskType.AMBIGUITY, {}, "Negativity.docx"),
+    "Social": (TaskType.SOCIAL, {}, "Social.docx"),
+    "Muki": (TaskType.MULTIPLEBIAS, {"study": "Muki"}, "Multiple biases - Muki.docx"),
+    "TakaToro": (TaskType.MULTIPLEBIAS, {"study": "TakaToro"}, "Multiple biases - Taka and Toro.docx"),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--study", nargs="+", default=list(STUDIES), choices=list(STUDIES))
+    parser.add_argument("--min-accuracy", type=float, default=0.95)
+    parser.add_argument("--n-simulations", type=int, default=5, help="chains per output file")
+    parser.add_argument("--ngram-max", type=int, default=2)
+    parser.add_argument("--char-ngram", type=int, default=4)
+    parser.add_argument("--table", action="store_true", help="print every candidate, not only the best")
+    parser.add_argument("--json", type=pathlib.Path, help="write the results to this file")
+    args = parser.parse_args()
+
+    features = CascadeConfig(ngram_range=(1, args.ngram_max), char_ngram=args.char_ngram)
+    results = []
+    print(f"{'study':10} {'absent<=':>8} {'present>=':>9} {'settled':>8} {'accuracy':>9} {'calls':>6} {'tokens':>7}")
+    for study in args.study:
+        task_type, kwargs, output_file = STUDIES[study]
+        task = TaskFactory.create(task_type, None, None, **kwargs)
+        records = read_summaries(OUTPUT_DIR / output_file, args.n_simulations)
+        best, table = calibrate(task, records, args.min_accuracy, config=features)
+
+        rows = table if args.table else [row for row in table if row["absent_below"] == best.absent_below
+                                         and row["present_above"] == best.present_above]
+        for row in rows:
+            print(f"{study:10} {row['absent_below']:>8.2f} {row['present_above']:>9.2f} {row['settled']:>8.1%} "
+                  f"{row['accuracy']:>9.1%} {row['evaluator_calls']:>6.0%} {row['evaluator_tokens']:>7.1%}")
+        results.append({"study": study, "best": {"absent_below": best.absent_below,
+                                                 "present_above": best.present_above}, "table": table})
+
+    if args.json is not None:
+        args.json.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
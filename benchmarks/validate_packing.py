@@ -0,0 +1,108 @@
+"""Compares packed and unpacked evaluation of the authors' summaries in `study-data/output`.
+
+Each summary is scored twice, once per request and once packed with up to K-1 others, and the
+selected phrases are compared. Run it whenever the evaluator prompt or model changes to check
+that packing leaves the scoring unchanged.
+
+Usage:
+    python benchmarks/validate_packing.py --pack-sizes 2 5 15            # Azure GPT-4 evaluator
+    python benchmarks/validate_packing.py --backend fake --pack-sizes 5   # offline dry run
+"""
+
+import argparse
+import json
+import pathlib
+import statistics
+import sys
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT))
+
+from enums import TaskType, AzureOpenAIModelType
+from rate_limiter import estimate_tokens
+from tasks import TaskFactory
+
+N_SIMULATIONS = 5
+STUDIES = {
+    "study1": (TaskType.GENDER_STEREOTYPE_CONSISTENCY, {}, "Stereotype consistency.docx"),
+    "study2A": (TaskType.NEGATIVITY, {}, "Negativity.docx"),
+    "study2B": (TaskType.AMBIGUITY, {}, "Negativity.docx"),
+    "study3": (TaskType.SOCIAL, {}, "Social.docx"),
+    "study5_muki": (TaskType.MULTIPLEBIAS, {"study": "Muki"}, "Multiple biases - Muki.docx"),
+    "study5_takatoro": (TaskType.MULTIPLEBIAS, {"study": "TakaToro"}, "Multiple biases - Taka and Toro.docx"),
+}
+
+
+def selected(evaluation):
+    """The set of selected phrases (or proposition numbers) in an evaluation."""
+    if evaluation is None:
+        return set()
+    return {" ".join(line.split()) for line in evaluation.split("\n") if line.strip()}
+
+
+def jaccard(a, b):
+    return 1.0 if not a and not b else len(a & b) / len(a | b)
+
+
+def make_evaluator(backend):
+    if backend == "fake":
+        from fake_model import AsyncFakeModel
+        return AsyncFakeModel()
+    from openai_model import AsyncAzureOpenAIModel
+    return AsyncAzureOpenAIModel(AzureOpenAIModelType.GPT_4, {'temperature': 0.0, 'max_tokens': 500, 'seed': 0})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--studies", nargs="+", default=list(STUDIES), choices=list(STUDIES))
+    parser.add_argument("--pack-sizes", nargs="+", type=int, default=[5])
+    parser.add_argument("--backend", choices=["azure", "fake"], default="azure")
+    parser.add_argument("--json", type=pathlib.Path, help="write per-summary results to this file")
+    args = parser.parse_args()
+
+    llm_model_evaluate = make_evaluator(args.backend)
+    report = []
+    print(f"{'study':16} {'K':>3} {'exact':>6} {'jaccard':>8} {'phrase agr.':>11} {'requests':>9} {'prompt tok.':>12}")
+    for study in args.studies:
+        task_type, kwargs, output_file = STUDIES[study]
+        task = TaskFactory.create(task_type, None, llm_model_evaluate, **kwargs)
+        source = ROOT / "study-data/output" / output_file
+        n_phrases = len(task._phrases.split("\n"))
+
+        task.set_evaluation_packing(None)
+        unpacked = task.evaluate_many(source, n_simulations=N_SIMULATIONS)
+        summaries = unpacked["summary"].tolist()
+        unpacked_tokens = sum(estimate_tokens(task.evaluation_messages(s), 0) for s in summaries)
+        print(f"{study:16} {1:>3} {'':>6} {'':>8} {'':>11} {len(summaries):>9} {unpacked_tokens:>12}")
+
+        for pack_size in args.pack_sizes:
+            task.set_evaluation_packing(pack_size)
+            packed = task.evaluate_many(source, max_concurrency=max(16, pack_size), n_simulations=N_SIMULATIONS)
+
+            exact, jaccards, agreements = [], [], []
+            for a, b in zip(unpacked["evaluation"], packed["evaluation"]):
+                a, b = selected(a), selected(b)
+                exact.append(a == b)
+                jaccards.append(jaccard(a, b))
+                agreements.append(1 - len(a ^ b) / n_phrases)
+
+            packs = task.plan_evaluation_packs(summaries, pack_size)
+            packed_tokens = sum(estimate_tokens(task.packed_evaluation_messages(summaries[i:j]), 0) for i, j in packs)
+            print(f"{study:16} {pack_size:>3} {statistics.mean(exact):>6.2f} {statistics.mean(jaccards):>8.3f} "
+                  f"{statistics.mean(agreements):>11.3f} {len(packs):>9} {packed_tokens:>12}")
+
+            report.append({
+                "study": study, "pack_size": pack_size,
+                "exact_match": statistics.mean(exact), "jaccard": statistics.mean(jaccards),
+                "phrase_agreement": statistics.mean(agreements),
+                "requests": len(packs), "prompt_tokens": packed_tokens,
+                "unpacked_requests": len(summaries), "unpacked_prompt_tokens": unpacked_tokens,
+                "unpacked": unpacked["evaluation"].tolist(), "packed": packed["evaluation"].tolist(),
+            })
+
+    if args.json is not None:
+        args.json.write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
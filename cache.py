@@ -0,0 +1,192 @@
+"""Persistent content-addressed cache of API responses with coalescing of identical in-flight calls."""
+
+import asyncio
+import concurrent.futures
+import hashlib
+import json
+import pathlib
+import sqlite3
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from enums import CacheMode
+
+DEFAULT_CACHE_PATH = pathlib.Path.home() / ".cache" / "llm_transmission_chains" / "responses.sqlite"
+
+
+class ResponseCache:
+    """Stores serialized responses in SQLite, keyed by a hash of the request.
+
+    Entries are evicted least-recently-used once `max_entries` or `max_bytes` is exceeded.
+    Identical requests issued while the first one is still in flight wait for its result
+    instead of calling the API again.
+
+    Note: a hit returns the stored sample, so caching a model sampled at a non-zero
+    temperature without a `seed` collapses what would have been independent samples.
+
+    Args:
+        path (str or Path, optional): SQLite file holding the cache.
+        mode (CacheMode, optional, default: READ_THROUGH): See `enums.CacheMode`.
+        max_entries (int, optional, default: None): Maximum number of entries kept.
+        max_bytes (int, optional, default: 1GB): Maximum total size of stored responses.
+    """
+
+    def __init__(self, path: Optional[pathlib.Path]=None, mode: CacheMode=CacheMode.READ_THROUGH,
+                 max_entries: Optional[int]=None, max_bytes: Optional[int]=1 << 30):
+        self.path = pathlib.Path(path or DEFAULT_CACHE_PATH)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.mode = mode
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, concurrent.futures.Future] = {}
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+
+    @staticmethod
+    def make_key(model: str, messages: List[Dict[str, Any]], config: Dict[str, Any]) -> str:
+        """Hashes the model name, rendered messages and the config sent to the API."""
+        payload = json.dumps(
+            {"model": model, "messages": messages, "config": config},
+            sort_keys=True, ensure_ascii=False, default=str
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+            return row[0]
+
+    def put(self, key: str, value: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value.encode("utf-8")), now, now)
+            )
+            self._evict()
+
+    def _evict(self) -> None:
+        """Deletes least-recently-used entries until the limits hold. Caller holds the lock."""
+        if self.max_entries is not None:
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN "
+                "(SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+        if self.max_bytes is not None:
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_bytes:
+                excess = total - self.max_bytes
+                rows = self._conn.execute("SELECT key, size FROM responses ORDER BY accessed ASC")
+                stale = []
+                for key, size in rows:
+                    if excess <= 0:
+                        break
+                    stale.append((key,))
+                    excess -= size
+                self._conn.executemany("DELETE FROM responses WHERE key = ?", stale)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def _claim(self, key: str):
+        """Returns (future, owner): the owner makes the call, the others wait on the future."""
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = self._inflight[key] = concurrent.futures.Future()
+            return future, True
+
+    def _settle(self, key: str, future: concurrent.futures.Future, result: Any=None,
+                exc: Optional[BaseException]=None) -> None:
+        with self._lock:
+            self._inflight.pop(key, None)
+        if exc is not None:
+            future.set_exception(exc)
+        else:
+            future.set_result(result)
+
+    def call(self, key: str, fn: Callable[[], Any], dumps: Callable[[Any], str],
+             loads: Callable[[str], Any]) -> Any:
+        """Returns the cached response for `key`, or calls `fn` and stores its result."""
+        if self.mode is CacheMode.BYPASS:
+            return fn()
+        if self.mode is CacheMode.WRITE_ONLY:
+            result = fn()
+            self.put(key, dumps(result))
+            return result
+
+        cached = self.get(key)
+        if cached is not None:
+            self.hits += 1
+            return loads(cached)
+
+        future, owner = self._claim(key)
+        if not owner:
+            return future.result()
+
+        self.misses += 1
+        try:
+            result = fn()
+        except BaseException as exc:
+            self._settle(key, future, exc=exc)
+            raise
+        self.put(key, dumps(result))
+        self._settle(key, future, result)
+        return result
+
+    async def acall(self, key: str, fn: Callable[[], Awaitable[Any]], dumps: Callable[[Any], str],
+                    loads: Callable[[str], Any]) -> Any:
+        """Awaitable `call`."""
+        if self.mode is CacheMode.BYPASS:
+            return await fn()
+        if self.mode is CacheMode.WRITE_ONLY:
+            result = await fn()
+            self.put(key, dumps(result))
+            return result
+
+        cached = self.get(key)
+        if cached is not None:
+            self.hits += 1
+            return loads(cached)
+
+        future, owner = self._claim(key)
+        if not owner:
+            return await asyncio.wrap_future(future)
+
+        self.misses += 1
+        try:
+            result = await fn()
+        except BaseException as exc:
+            self._settle(key, future, exc=exc)
+            raise
+        self.put(key, dumps(result))
+        self._settle(key, future, result)
+        return result
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
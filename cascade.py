@@ -0,0 +1,235 @@
+"""Settles confident evaluations locally and sends only the uncertain phrases to the evaluator.
+
+`PhraseScorer` vectorises the phrases of a task once (word n-grams and character n-grams,
+weighted by TF-IDF) and scores every (summary, phrase) pair of a batch with one sparse
+product: the share of a phrase's weight whose n-grams occur in the summary. Phrases scoring
+below `CascadeConfig.absent_below` are settled as absent, those above `present_above` as
+present, and only the remainder is sent to the evaluation model. `calibrate` picks the
+thresholds against the human codings in `study-data/coding`.
+"""
+
+import asyncio
+import re
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy import sparse
+
+from configs import CascadeConfig
+from rate_limiter import estimate_tokens
+
+ABSENT = 0
+PRESENT = 1
+UNCERTAIN = -1
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    text = text.lower().replace("’", "").replace("'", "")
+    return WORD_PATTERN.findall(text)
+
+
+class PhraseScorer:
+    """TF-IDF weighted containment of phrases in summaries.
+
+    Args:
+        phrases (list(str)): texts to look for; their n-grams are the vocabulary and their
+            document frequencies the IDF weights.
+        ngram_range (tuple(int, int), optional, default: (1, 2)): word n-gram sizes.
+        char_ngram (int, optional, default: 4): size of the character n-grams taken within
+            words, which match inflections ("dried" and "dry"); 0 disables them.
+    """
+
+    def __init__(self, phrases: Sequence[str], ngram_range: Tuple[int, int]=(1, 2), char_ngram: int=4):
+        self.ngram_range = ngram_range
+        self.char_ngram = char_ngram
+        self.vocabulary: Dict[str, int] = {}
+        rows, cols = [], []
+        for row, phrase in enumerate(phrases):
+            for feature in set(self.features(phrase)):
+                rows.append(row)
+                cols.append(self.vocabulary.setdefault(feature, len(self.vocabulary)))
+
+        counts = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(phrases), len(self.vocabulary)))
+        document_frequency = np.asarray(counts.sum(axis=0)).ravel()
+        self.idf = np.log((1 + len(phrases)) / (1 + document_frequency)) + 1
+
+        # rows sum to one, so that a score is the share of the phrase's weight found in the summary
+        weights = counts.multiply(self.idf[np.newaxis, :]).tocsr()
+        totals = np.asarray(weights.sum(axis=1)).ravel()
+        self.phrase_weights = sparse.diags(1 / np.maximum(totals, 1e-12)) @ weights
+
+    def features(self, text: str) -> List[str]:
+        words = tokenize(text)
+        features = []
+        for n in range(self.ngram_range[0], self.ngram_range[1] + 1):
+            features += ["w:" + " ".join(words[i:i + n]) for i in range(len(words) - n + 1)]
+        if self.char_ngram:
+            n = self.char_ngram
+            for word in words:
+                word = f" {word} "
+                features += ["c:" + word[i:i + n] for i in range(len(word) - n + 1)]
+        return features
+
+    def transform(self, summaries: Sequence[str]) -> sparse.csr_matrix:
+        """Binary (summaries × vocabulary) occurrence matrix; n-grams of no phrase are dropped."""
+        rows, cols = [], []
+        for row, summary in enumerate(summaries):
+            for feature in set(self.features(summary)):
+                col = self.vocabulary.get(feature)
+                if col is not None:
+                    rows.append(row)
+                    cols.append(col)
+        return sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(summaries), len(self.vocabulary)))
+
+    def score(self, summaries: Sequence[str]) -> np.ndarray:
+        """(summaries × phrases) scores in [0, 1]."""
+        return (self.transform(summaries) @ self.phrase_weights.T).toarray()
+
+
+class EvaluationCascade:
+    """Evaluates summaries with `task`, asking its evaluation model only about uncertain phrases.
+
+    Settled phrases are reported as the evaluator would report them (`task.phrase_label`),
+    followed by the evaluator's response for the rest, so that evaluations are parsed as
+    before. When the evaluator reports more than presence (`task.phrase_presence_only` is
+    False, e.g., the tone of `AmbiguityTask`), only absent phrases are settled.
+
+    Args:
+        task (BaseTelephoneGameTask): provides the phrases and the evaluation model.
+        config (CascadeConfig, optional): thresholds and features, see `calibrate`.
+
+    Example:
+        task.set_evaluation_cascade(CascadeConfig(absent_below=0.15, present_above=0.9))
+        evaluation = await task.aevaluate(summary)
+        task.evaluation_cascade.stats
+    """
+
+    def __init__(self, task: Any, config: Optional[CascadeConfig]=None):
+        self.task = task
+        self.config = config or CascadeConfig()
+        self.phrases = list(task.evaluation_phrases)
+        self.scorer = PhraseScorer([task.phrase_text(phrase) for phrase in self.phrases],
+                                   self.config.ngram_range, self.config.char_ngram)
+        self.stats = {"summaries": 0, "evaluator_calls": 0, "phrases": 0, "phrases_sent": 0}
+
+    def settle(self, summaries: Sequence[str]) -> np.ndarray:
+        """(summaries × phrases) decisions: PRESENT, ABSENT or UNCERTAIN."""
+        return decide(self.scorer.score(summaries), self.config, self.task.phrase_presence_only)
+
+    def _split(self, decisions: np.ndarray) -> Tuple[List[str], List[str]]:
+        self.stats["summaries"] += 1
+        self.stats["phrases"] += len(self.phrases)
+        present = [self.task.phrase_label(self.phrases[i]) for i in np.flatnonzero(decisions == PRESENT)]
+        uncertain = [self.phrases[i] for i in np.flatnonzero(decisions == UNCERTAIN)]
+        if uncertain:
+            self.stats["evaluator_calls"] += 1
+            self.stats["phrases_sent"] += len(uncertain)
+        return present, uncertain
+
+    @staticmethod
+    def _merge(present: List[str], evaluation: Optional[str]) -> str:
+        return "\n".join(present + ([evaluation] if evaluation else []))
+
+    def evaluate(self, summary: str, decisions: Optional[np.ndarray]=None) -> str:
+        if decisions is None:
+            decisions = self.settle([summary])[0]
+        present, uncertain = self._split(decisions)
+        evaluation = self.task.evaluate(summary, phrases=uncertain) if uncertain else None
+        return self._merge(present, evaluation)
+
+    async def aevaluate(self, summary: str, decisions: Optional[np.ndarray]=None) -> str:
+        if decisions is None:
+            decisions = self.settle([summary])[0]
+        present, uncertain = self._split(decisions)
+        evaluation = await self.task.aevaluate_unpacked(summary, phrases=uncertain) if uncertain else None
+        return self._merge(present, evaluation)
+
+    async def aevaluate_many(self, summaries: Sequence[str], max_concurrency: int=16) -> List[str]:
+        """Scores all `summaries` at once, then evaluates the uncertain phrases concurrently."""
+        decisions = self.settle(summaries)
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def evaluate(summary, row):
+            async with semaphore:
+                return await self.aevaluate(summary, row)
+
+        return await asyncio.gather(*[evaluate(summary, row) for summary, row in zip(summaries, decisions)])
+
+
+def decide(scores: np.ndarray, config: CascadeConfig, settle_present: bool=True) -> np.ndarray:
+    decisions = np.full(scores.shape, UNCERTAIN, dtype=np.int8)
+    decisions[scores <= config.absent_below] = ABSENT
+    if settle_present:
+        decisions[scores >= config.present_above] = PRESENT
+    return decisions
+
+
+def human_codings(task: Any, records: Iterable[Tuple[int, int, str]]) -> np.ndarray:
+    """(records × phrases) booleans: whether the human coders found each phrase of
+    `task.evaluation_phrases` in the summary of each (sim_id, generation, summary) record."""
+    codings = task.task_data["codings"]
+    ids = task.evaluation_phrase_ids
+    return np.array([[codings[i][generation][sim_id] is not None for i in ids]
+                     for sim_id, generation, _ in records], dtype=bool)
+
+
+def calibrate(task: Any, records: Sequence[Tuple[int, int, str]], min_accuracy: float=0.95,
+              thresholds: Optional[Sequence[float]]=None,
+              config: Optional[CascadeConfig]=None) -> Tuple[CascadeConfig, List[Dict[str, float]]]:
+    """Picks the thresholds that settle the most phrases while agreeing with the human codings.
+
+    Args:
+        task (BaseTelephoneGameTask): a task with codings, i.e., not `ThreatTask`.
+        records (list): coded (sim_id, generation, summary) records, e.g.,
+            `utils.read_summaries("study-data/output/Negativity.docx", 5)`.
+        min_accuracy (float, optional, default: 0.95): agreement required on settled phrases.
+        thresholds (list(float), optional): candidate thresholds; defaults to steps of 0.05.
+        config (CascadeConfig, optional): features to calibrate, with its thresholds ignored.
+
+    Returns:
+        The best `CascadeConfig` (`config` if no candidate reaches `min_accuracy`) and one
+        row per candidate (absent_below, present_above), with the share of settled
+        phrases, their accuracy, and the share of evaluator calls and estimated evaluator
+        prompt tokens that remain.
+    """
+    config = config or CascadeConfig()
+    thresholds = np.round(np.arange(0, 1.0001, 0.05), 2) if thresholds is None else thresholds
+    cascade = EvaluationCascade(task, config)
+    summaries = [summary for _, _, summary in records]
+    scores = cascade.scorer.score(summaries)
+    truth = human_codings(task, records)
+
+    # prompt tokens of the evaluation messages as a function of the phrases they list (~4 chars per token)
+    phrase_tokens = np.array([(len(phrase) + 1) / 4 for phrase in cascade.phrases])
+    full_tokens = np.array([estimate_tokens(task.evaluation_messages(summary), 0) for summary in summaries])
+    fixed_tokens = full_tokens - phrase_tokens.sum()
+
+    table = []
+    for absent_below in thresholds:
+        for present_above in thresholds:
+            if present_above <= absent_below:
+                continue
+            candidate = CascadeConfig(absent_below=float(absent_below), present_above=float(present_above),
+                                      ngram_range=config.ngram_range, char_ngram=config.char_ngram)
+            decisions = decide(scores, candidate, task.phrase_presence_only)
+            settled = decisions != UNCERTAIN
+            correct = (decisions == truth.astype(np.int8)) & settled
+            calls = (~settled).any(axis=1)
+            tokens = np.where(calls, fixed_tokens + (~settled) @ phrase_tokens, 0)
+            table.append({
+                "absent_below": candidate.absent_below,
+                "present_above": candidate.present_above,
+                "settled": float(settled.mean()),
+                "accuracy": float(correct.sum() / max(settled.sum(), 1)),
+                "evaluator_calls": float(calls.mean()),
+                "evaluator_tokens": float(tokens.sum() / full_tokens.sum()),
+            })
+
+    eligible = [row for row in table if row["accuracy"] >= min_accuracy]
+    if not eligible:
+        return config, table
+    best = max(eligible, key=lambda row: (row["settled"], row["accuracy"]))
+    return CascadeConfig(absent_below=best["absent_below"], present_above=best["present_above"],
+                         ngram_range=config.ngram_range, char_ngram=config.char_ngram), table
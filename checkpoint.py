@@ -0,0 +1,178 @@
+"""Durable checkpoints of node outputs and evaluations, to resume interrupted runs.
+
+Every output and evaluation is written to SQLite as soon as its call returns, keyed by run
+ID, `sim_id` and node `id`. `resume_run` rebuilds the chains, pre-fills the completed
+nodes and only issues the calls that are still missing.
+"""
+
+import asyncio
+import json
+import pathlib
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from scheduler import run_simulations
+from utils import setup_transmission_chain
+
+DEFAULT_CHECKPOINT_PATH = pathlib.Path.home() / ".cache" / "llm_transmission_chains" / "checkpoints.sqlite"
+
+
+class Checkpoint:
+    """Stores the outputs and evaluations of the nodes of one run.
+
+    Args:
+        run_id (str): identifies the run; reuse it to resume.
+        path (str or Path, optional): SQLite file holding the checkpoints of all runs.
+    """
+
+    def __init__(self, run_id: str, path: Optional[pathlib.Path]=None):
+        self.run_id = run_id
+        self.path = pathlib.Path(path or DEFAULT_CHECKPOINT_PATH)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.saved = 0
+        self.restored = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # a crash can lose the last transactions but never corrupts the file
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS runs (run_id TEXT PRIMARY KEY, metadata TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS nodes ("
+            "run_id TEXT NOT NULL, sim_id INTEGER NOT NULL, generation INTEGER NOT NULL, position INTEGER NOT NULL, "
+            "output TEXT, evaluation TEXT, updated REAL NOT NULL, "
+            "PRIMARY KEY (run_id, sim_id, generation, position))"
+        )
+
+    def metadata(self) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT metadata FROM runs WHERE run_id = ?", (self.run_id,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def check_metadata(self, metadata: Dict[str, Any]) -> None:
+        """Records `metadata` for a new run, or checks that it matches the run being resumed."""
+        stored = self.metadata()
+        if stored is None:
+            with self._lock:
+                self._conn.execute("INSERT INTO runs VALUES (?, ?, ?)", (self.run_id, json.dumps(metadata), time.time()))
+        elif stored != json.loads(json.dumps(metadata)):
+            raise ValueError(f"Run {self.run_id!r} was checkpointed with {stored}, not {metadata}.")
+
+    def save(self, node: Any) -> None:
+        """Writes the output and evaluation of `node`; `None` never overwrites a stored value."""
+        self.save_result(node.sim_id, node.id, node.output, node.evaluation)
+
+    def save_result(self, sim_id: int, node_id: Tuple[int, int], output: Any, evaluation: Any) -> None:
+        """`save` for nodes that are not `Node` objects, e.g., those of a `graph.ChainGraph`."""
+        output = None if output is None else json.dumps(output, ensure_ascii=False)
+        evaluation = None if evaluation is None else json.dumps(evaluation, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO nodes VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (run_id, sim_id, generation, position) DO UPDATE SET "
+                "output = COALESCE(excluded.output, output), "
+                "evaluation = COALESCE(excluded.evaluation, evaluation), updated = excluded.updated",
+                (self.run_id, sim_id, node_id[0], node_id[1], output, evaluation, time.time())
+            )
+            self.saved += 1
+
+    def load(self) -> Dict[Tuple[int, Tuple[int, int]], Tuple[Any, Any]]:
+        """{(sim_id, node id): (output, evaluation)} of every checkpointed node of the run."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT sim_id, generation, position, output, evaluation FROM nodes WHERE run_id = ?", (self.run_id,)
+            ).fetchall()
+        return {
+            (sim_id, (generation, position)): (
+                None if output is None else json.loads(output),
+                None if evaluation is None else json.loads(evaluation)
+            )
+            for sim_id, generation, position, output, evaluation in rows
+        }
+
+    def restore(self, simulations: List[List[List[Any]]]) -> int:
+        """Pre-fills the nodes of `simulations` from the checkpoint and attaches it to them.
+
+        Restored outputs are forwarded downstream, so that nodes after them start right away.
+        Returns the number of restored outputs.
+        """
+        stored = self.load()
+        restored = 0
+        for all_nodes in simulations:
+            for generation in all_nodes:
+                for node in generation:
+                    node.checkpoint = self
+                    output, evaluation = stored.get((node.sim_id, tuple(node.id)), (None, None))
+                    if output is None:
+                        continue
+                    node.output, node.evaluation = output, evaluation
+                    node.send_output()
+                    restored += 1
+        self.restored += restored
+        return restored
+
+    def clear(self) -> None:
+        """Deletes the checkpoints of the run."""
+        with self._lock:
+            self._conn.execute("DELETE FROM nodes WHERE run_id = ?", (self.run_id,))
+            self._conn.execute("DELETE FROM runs WHERE run_id = ?", (self.run_id,))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM nodes WHERE run_id = ?", (self.run_id,)).fetchone()[0]
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def _model_name(model: Any) -> Optional[str]:
+    if model is None:
+        return None
+    model_type = getattr(model, "model_type", None)
+    if model_type is not None:
+        return model_type.value
+    return getattr(model, "model_name", type(model).__name__)
+
+
+def run_metadata(connections: List[List[List[int]]], task: Any, n_simulations: int) -> Dict[str, Any]:
+    """What a resumed run must share with the checkpointed one: the chains, the task and its inputs, and the models.
+
+    The task's input files tell its studies apart, e.g. `MultipleBiasTask(study="Muki")`
+    from `study="TakaToro"`, and its `seed` fixes the statement order of `ThreatTask`.
+    """
+    return {
+        "connections": connections,
+        "n_simulations": n_simulations,
+        "task": type(task).__name__,
+        "task_data": [source.name for source in task.task_data_sources()],
+        "seed": getattr(task, "seed", None),
+        "execute_model": _model_name(getattr(task, "llm_model_execute", None)),
+        "evaluate_model": _model_name(getattr(task, "llm_model_evaluate", None)),
+    }
+
+
+async def resume_run(checkpoint: Checkpoint, connections: List[List[List[int]]], NODE_CLS: Any, task: Any,
+                     n_simulations: int, scheduler: Optional[Any]=None) -> List[List[List[Any]]]:
+    """Runs (or resumes) `n_simulations` chains, checkpointing every call.
+
+    The first call with a run ID starts the run; calling it again with the same arguments
+    after an interruption only issues the calls that are missing from the checkpoint.
+
+    Example:
+        checkpoint = Checkpoint("study2A-gpt4-2024-05-01")
+        simulations = await resume_run(checkpoint, connections, Node, task, n_simulations=100)
+    """
+    checkpoint.check_metadata(run_metadata(connections, task, n_simulations))
+    simulations = [setup_transmission_chain(connections, NODE_CLS, task, idx) for idx in range(n_simulations)]
+    checkpoint.restore(simulations)
+
+    if scheduler is None:
+        await asyncio.gather(*[node.start() for all_nodes in simulations for generation in all_nodes for node in generation])
+    else:
+        await run_simulations(simulations, scheduler)
+    return simulations
@@ -1,5 +1,6 @@
-from typing import Any, Optional, Sequence, Dict, Union, List
+from typing import Any, Optional, Sequence, Dict, Union, List, Tuple
 from dataclasses import dataclass, field, asdict
+from enums import EvaluationPolicy
 
 @dataclass(frozen=True)
 class OpenAIChatConfig:
@@ -26,7 +27,8 @@ class OpenAIChatConfig:
         stream (bool, optional, default: False) If set, partial message deltas will
             be sent, like in ChatGPT. Tokens will be sent as data-only server-sent 
             events as they become available, with the stream terminated by a 
-            data: [DONE] message.
+            data: [DONE] message. The models collect the deltas into the same
+            response as without streaming, see `streaming.collect_stream`.
 
         stop (str or list, optional, default: []) Up to 4 sequences where the
             API will stop generating further tokens.
@@ -126,4 +128,342 @@ class OpenAIChatConfig:
 OPENAI_API_PARAMS = {param for param in asdict(OpenAIChatConfig()).keys()}
 # OPENAI_API_PARAMS_WITH_FUNCTIONS = {
 #     param for param in asdict(ToolUsingOpenAIConfig()).keys()
-# }
\ No newline at end of file
+# }
+
+@dataclass(frozen=True)
+class RateLimitConfig:
+    """Defines the budgets shared by all models that target the same deployment.
+
+    Args:
+        requests_per_minute (int, optional, default: None): Maximum number of requests
+            started per minute. `None` means no request budget.
+
+        tokens_per_minute (int, optional, default: None): Maximum number of tokens
+            (prompt + completion) per minute. `None` means no token budget.
+
+        max_concurrency (int, optional, default: None): Upper bound on the number of
+            requests in flight. `None` means unbounded until the deployment pushes back.
+
+        min_concurrency (int, optional, default: 1): Lower bound the adaptive limit
+            never shrinks below.
+
+        additive_increase (float, optional, default: 1.0): How much the concurrency
+            limit grows per window of successful calls.
+
+        multiplicative_decrease (float, optional, default: 0.5): Factor applied to
+            the concurrency limit on a 429 or a latency spike.
+
+        latency_spike_factor (float, optional, default: 3.0): A call slower than this
+            multiple of the moving average latency counts as a spike.
+
+        default_completion_tokens (int, optional, default: 512): Completion tokens
+            assumed when a request does not set `max_tokens`.
+    """
+
+    requests_per_minute: Optional[int] = None
+    tokens_per_minute: Optional[int] = None
+    max_concurrency: Optional[int] = None
+    min_concurrency: int = 1
+    additive_increase: float = 1.0
+    multiplicative_decrease: float = 0.5
+    latency_spike_factor: float = 3.0
+    default_completion_tokens: int = 512
+
+
+@dataclass(frozen=True)
+class RetryConfig:
+    """Defines how `failsafe_query` retries failed calls.
+
+    Args:
+        max_retries (int, optional, default: 5): Retries after the first attempt before
+            the last error is raised.
+
+        initial_backoff (float, optional, default: 1.0): Upper bound of the first
+            backoff, in seconds. Delays are drawn uniformly below the bound (full jitter).
+
+        backoff_multiplier (float, optional, default: 2.0): Growth of the bound per retry.
+
+        max_backoff (float, optional, default: 60.0): Cap on the bound, in seconds.
+
+        timeout (float, optional, default: 120.0): Timeout of a single attempt, in seconds.
+
+        failure_threshold (int, optional, default: 5): Consecutive retryable failures
+            after which the deployment's circuit opens and calls fail fast.
+
+        reset_timeout (float, optional, default: 30.0): Seconds an open circuit waits
+            before letting a trial call through.
+    """
+
+    max_retries: int = 5
+    initial_backoff: float = 1.0
+    backoff_multiplier: float = 2.0
+    max_backoff: float = 60.0
+    timeout: Optional[float] = 120.0
+    failure_threshold: int = 5
+    reset_timeout: float = 30.0
+
+
+@dataclass(frozen=True)
+class HTTPPoolConfig:
+    """Defines the connection pool shared by all models that target the same endpoint.
+
+    Args:
+        max_connections (int, optional, default: None): Connections open at once. `None`
+            uses the `max_concurrency` of the first model's `RateLimitConfig`, or 100 if
+            that is unbounded too. Requests beyond it wait for a free connection.
+
+        max_keepalive_connections (int, optional, default: None): Idle connections kept
+            open for reuse. `None` keeps all of them, so that a burst after a quiet period
+            does not pay new TLS handshakes.
+
+        keepalive_expiry (float, optional, default: 30.0): Seconds an idle connection is
+            kept open.
+
+        http2 (bool, optional, default: False): Negotiates HTTP/2, which multiplexes the
+            requests over fewer connections. Requires the `h2` package.
+    """
+
+    max_connections: Optional[int] = None
+    max_keepalive_connections: Optional[int] = None
+    keepalive_expiry: Optional[float] = 30.0
+    http2: bool = False
+
+
+@dataclass(frozen=True)
+class FakeModelConfig:
+    """Defines the synthetic behaviour of `fake_model.FakeModel`.
+
+    Args:
+        latency_distribution (str, optional, default: "lognormal"): One of "constant",
+            "uniform", "exponential" or "lognormal".
+
+        latency_mean (float, optional, default: 0.0): Mean latency of a call, in seconds.
+
+        latency_std (float, optional, default: 0.0): Standard deviation of the latency
+            ("uniform" and "lognormal" only).
+
+        output_tokens_min (int, optional, default: 50): Minimum number of words in a response.
+
+        output_tokens_max (int, optional, default: 200): Maximum number of words in a response.
+
+        error_rate (float, optional, default: 0.0): Probability that a call raises a
+            retryable `FakeAPIError`.
+
+        seed (int, optional, default: 0): Seeds latencies and errors. Response text only
+            depends on the request, so identical requests get identical responses.
+
+        prompt_cache_min_tokens (int, optional, default: None): Simulates provider-side
+            prompt caching: prompts sharing a prefix of at least this many tokens (words)
+            with an earlier request report it in `usage.prompt_tokens_details.cached_tokens`.
+            OpenAI caches prefixes from 1024 tokens. `None` disables it.
+
+        prompt_cache_block_tokens (int, optional, default: 128): Granularity of cached
+            prefixes beyond `prompt_cache_min_tokens`.
+
+        tokens_per_s (float, optional, default: None): Simulates decoding: after the sampled
+            latency (the time to first token), tokens (words) follow at this rate, streamed
+            with `stream=True`. `None` returns the whole response after the latency.
+    """
+
+    latency_distribution: str = "lognormal"
+    latency_mean: float = 0.0
+    latency_std: float = 0.0
+    output_tokens_min: int = 50
+    output_tokens_max: int = 200
+    error_rate: float = 0.0
+    seed: int = 0
+    prompt_cache_min_tokens: Optional[int] = None
+    prompt_cache_block_tokens: int = 128
+    tokens_per_s: Optional[float] = None
+
+
+@dataclass(frozen=True)
+class LocalModelConfig:
+    """Defines the model `local_model.LocalModel` runs on this machine and how calls are batched.
+
+    Args:
+        model (str): Name on the Hugging Face Hub or local directory of a causal language
+            model, e.g., "HuggingFaceTB/SmolLM2-360M-Instruct". Chat models format the
+            messages with their chat template.
+
+        dtype (str, optional, default: "float32"): Torch dtype of the weights, e.g.,
+            "bfloat16" on CPUs that support it.
+
+        num_threads (int, optional, default: None): Torch intra-op threads. `None` keeps
+            Torch's default, one per physical core.
+
+        max_batch_size (int, optional, default: 8): Calls run in one batched forward pass.
+
+        batch_window_s (float, optional, default: 0.02): Seconds the batcher waits for more
+            calls once one arrives, unless the batch fills up sooner. Longer windows form
+            larger batches at the cost of latency.
+
+        max_new_tokens (int, optional, default: 256): Tokens generated per choice when the
+            request has no `max_tokens`.
+
+        seed (int, optional, default: 0): Seeds sampling, so that runs are reproducible for
+            the same batches.
+    """
+
+    model: str
+    dtype: str = "float32"
+    num_threads: Optional[int] = None
+    max_batch_size: int = 8
+    batch_window_s: float = 0.02
+    max_new_tokens: int = 256
+    seed: int = 0
+
+
+@dataclass(frozen=True)
+class SchedulerConfig:
+    """Defines how `scheduler.CallScheduler` shares concurrency between execution and evaluation calls.
+
+    Args:
+        max_concurrency (int, optional, default: 16): Calls in flight across both kinds.
+
+        max_execute (int, optional, default: None): Execution calls in flight. Defaults to
+            `max_concurrency`.
+
+        max_evaluate (int, optional, default: None): Evaluation calls in flight. Defaults to
+            `max_concurrency`; a lower value keeps slots free for executions that become
+            ready while evaluations fill the spare capacity.
+
+        evaluation_policy (EvaluationPolicy, optional, default: BACKFILL): See
+            `enums.EvaluationPolicy`.
+    """
+
+    max_concurrency: int = 16
+    max_execute: Optional[int] = None
+    max_evaluate: Optional[int] = None
+    evaluation_policy: EvaluationPolicy = EvaluationPolicy.BACKFILL
+
+
+@dataclass(frozen=True)
+class CascadeConfig:
+    """Defines when `cascade.EvaluationCascade` settles a phrase without the evaluation model.
+
+    Args:
+        absent_below (float, optional, default: 0.15): Phrases scoring at most this are
+            settled as absent from the summary.
+
+        present_above (float, optional, default: 0.9): Phrases scoring at least this are
+            settled as present.
+
+        ngram_range (tuple(int, int), optional, default: (1, 2)): Word n-gram sizes.
+
+        char_ngram (int, optional, default: 4): Size of the character n-grams taken within
+            words; 0 disables them.
+
+    Scores are the TF-IDF weighted share of a phrase's n-grams found in the summary. Use
+    `cascade.calibrate` to choose the thresholds for a task.
+    """
+
+    absent_below: float = 0.15
+    present_above: float = 0.9
+    ngram_range: Tuple[int, int] = (1, 2)
+    char_ngram: int = 4
+
+
+@dataclass(frozen=True)
+class ModelSpec:
+    """Describes a model backend so that every worker process of `sharding.run_sharded` can
+    create its own client with `registry.create_model(backend, *args, **kwargs)`.
+
+    Args:
+        backend (str): Key in `registry.model_registry`, e.g., "async_azure" or "async_fake".
+
+        args (tuple, optional, default: ()): Positional arguments of the backend, e.g.,
+            `(AzureOpenAIModelType.GPT_4, {"temperature": 1})`.
+
+        kwargs (dict, optional, default: {}): Keyword arguments of the backend, e.g.,
+            `{"rate_limit_config": RateLimitConfig(requests_per_minute=600)}`.
+    """
+
+    backend: str
+    args: Tuple[Any, ...] = ()
+    kwargs: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass(frozen=True)
+class ShardConfig:
+    """Defines how `sharding.run_sharded` spreads simulations over worker processes.
+
+    Args:
+        n_workers (int, optional, default: None): Worker processes on this host. `None`
+            uses `os.cpu_count()`.
+
+        shard_size (int, optional, default: 16): Simulations per unit of work.
+
+        shards_per_worker (int, optional, default: 4): Shards a worker runs at the same
+            time, so that it stays busy while its last simulations finish. A worker holds
+            at most `shard_size * shards_per_worker` simulations in memory.
+
+        total_workers (int, optional, default: None): Workers on all hosts. Each gets
+            `1 / total_workers` of every budget of the models' `RateLimitConfig`, so that
+            the limits hold for the whole run. `None` means `n_workers`.
+
+        queue_path (str, optional, default: None): SQLite work queue on a filesystem shared
+            by several hosts. `None` uses a queue local to this host.
+
+        lease_timeout (float, optional, default: None): Seconds after which a shard that
+            was claimed but not completed, e.g., by a host that died, is handed out again
+            (SQLite queue only). Must exceed the time a shard takes. `None` never does.
+
+        scheduler (SchedulerConfig, optional, default: None): Budgets of the
+            `scheduler.CallScheduler` of each worker. `None` uses its defaults.
+    """
+
+    n_workers: Optional[int] = None
+    shard_size: int = 16
+    shards_per_worker: int = 4
+    total_workers: Optional[int] = None
+    queue_path: Optional[str] = None
+    lease_timeout: Optional[float] = None
+    scheduler: Optional[SchedulerConfig] = None
+
+
+@dataclass(frozen=True)
+class SweepConfig:
+    """Defines how `sweep.run_sweep` runs the cells of a parameter sweep.
+
+    Args:
+        output_dir (str): Directory of the results: one JSONL file of `sink.ResultSink`
+            records per cell, named by the cell's ID, and the `sweep.json` manifest.
+
+        backend (str, optional, default: "async_azure"): Key in `registry.model_registry`
+            of the models of every cell, e.g., "async_openai" or "async_fake".
+
+        max_active (int, optional, default: 64): Simulations of a cell in memory at the
+            same time, see `sink.run_streaming`.
+
+        max_cells (int, optional, default: None): Cells running at the same time. `None`
+            runs all of them at once; their calls are bounded by `scheduler` either way.
+
+        scheduler (SchedulerConfig, optional, default: None): Budgets of the one
+            `scheduler.CallScheduler` shared by all cells, i.e., the sweep's global
+            concurrency limits. `None` uses its defaults.
+
+        rate_limit (RateLimitConfig, optional, default: None): Budgets of every deployment
+            of the sweep, shared by the models of all cells that target it.
+
+        retry (RetryConfig, optional, default: None): Retries of every model.
+
+        http_pool (HTTPPoolConfig, optional, default: None): Connections of every endpoint.
+
+        fake_model (FakeModelConfig, optional, default: None): Behaviour of the models of
+            the "fake" and "async_fake" backends.
+
+        local_model (LocalModelConfig, optional, default: None): Batching of the models of
+            the "local" and "async_local" backends; its `model` is replaced by each cell's.
+    """
+
+    output_dir: str
+    backend: str = "async_azure"
+    max_active: int = 64
+    max_cells: Optional[int] = None
+    scheduler: Optional[SchedulerConfig] = None
+    rate_limit: Optional[RateLimitConfig] = None
+    retry: Optional[RetryConfig] = None
+    http_pool: Optional[HTTPPoolConfig] = None
+    fake_model: Optional[FakeModelConfig] = None
+    local_model: Optional[LocalModelConfig] = None
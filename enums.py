@@ -92,3 +92,35 @@ class TaskType(Enum):
     SOCIAL = "social"
     THREAT = "threat"
     MULTIPLEBIAS = "multiple_bias"
+
+
+class ErrorClass(Enum):
+    """How `failsafe_query` treats an error raised by an API call."""
+    RETRYABLE = "retryable"
+    FATAL = "fatal"
+
+
+class CacheMode(Enum):
+    """How `ResponseCache` is used by a model.
+
+    READ_THROUGH: serve hits from the cache, store misses.
+    WRITE_ONLY: always query the API, store responses (e.g., to refresh the cache).
+    BYPASS: neither read nor write the cache.
+    """
+    READ_THROUGH = "read_through"
+    WRITE_ONLY = "write_only"
+    BYPASS = "bypass"
+
+
+class EvaluationPolicy(Enum):
+    """When `scheduler.CallScheduler` runs evaluation calls relative to execution calls.
+
+    FIFO: evaluations and executions share the slots in arrival order.
+    BACKFILL: evaluations only take slots that no waiting execution can take, i.e., free
+        slots beyond `max_execute` are theirs.
+    DEFERRED: evaluations are held until `release_evaluations`, e.g., until all chains are
+        generated, so that they can be packed or run without delaying any chain.
+    """
+    FIFO = "fifo"
+    BACKFILL = "backfill"
+    DEFERRED = "deferred"
@@ -0,0 +1,267 @@
+"""An offline `BaseAPIModel` returning synthetic responses, for benchmarks and tests."""
+
+import asyncio
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional
+
+from openai.types.chat import ChatCompletion, ChatCompletionChunk, ChatCompletionMessage
+from openai.types.chat.chat_completion import Choice
+from openai.types.chat.chat_completion_chunk import Choice as ChunkChoice, ChoiceDelta
+from openai.types.completion_usage import CompletionUsage, PromptTokensDetails
+
+from base_model import BaseAPIModel
+from configs import FakeModelConfig, RetryConfig
+from messages import OpenAIMessage
+from retry import CircuitBreaker, retry_call, aretry_call
+from streaming import acollect_stream, collect_stream
+import tracing
+
+
+class FakeAPIError(Exception):
+    """A transient API error; classified as retryable through its status code."""
+
+    def __init__(self, status_code: int=503):
+        super().__init__(f"Fake API error {status_code}.")
+        self.status_code = status_code
+
+
+class FakeModel(BaseAPIModel):
+    """Returns synthetic completions after a sampled latency, without network access.
+
+    The response text is built from words of the last message and only depends on the
+    request, so identical requests get identical responses. Latencies and errors are
+    drawn from a RNG seeded with `config.seed`.
+    """
+
+    model_name = "fake"
+
+    def __init__(self, config: Optional[FakeModelConfig]=None, model_config_dict: Optional[Dict[str, Any]]=None,
+                 retry_config: Optional[RetryConfig]=None):
+        self.config = config or FakeModelConfig()
+        self.model_config_dict = model_config_dict or {}
+        self._check_parameters_validity(self.config)
+        self.retry_config = retry_config or RetryConfig(initial_backoff=0.0, timeout=None)
+        self.circuit_breaker = CircuitBreaker(self.retry_config)
+        self.calls = 0
+        self.errors = 0
+        self._setup_client()
+
+    def _setup_client(self) -> None:
+        """Sets up the RNG standing in for the API."""
+        self._lock = threading.Lock()
+        self._rng = random.Random(self.config.seed)
+        # digests of the prompt prefixes seen so far, see `_cached_tokens`
+        self._prompt_prefixes = set()
+
+    def _check_api_keys_validity(self) -> None:
+        """No keys are needed offline."""
+        pass
+
+    def _check_parameters_validity(self, config: FakeModelConfig) -> None:
+        """Checks if the parameters are valid."""
+        if config.latency_distribution not in ("constant", "uniform", "exponential", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {config.latency_distribution}")
+        if not 0 <= config.error_rate <= 1:
+            raise ValueError(f"error_rate must be in [0, 1], got {config.error_rate}")
+        if not 0 < config.output_tokens_min <= config.output_tokens_max:
+            raise ValueError("Expected 0 < output_tokens_min <= output_tokens_max.")
+        if config.prompt_cache_min_tokens is not None and (config.prompt_cache_min_tokens <= 0
+                                                           or config.prompt_cache_block_tokens <= 0):
+            raise ValueError("prompt_cache_min_tokens and prompt_cache_block_tokens must be positive.")
+        if config.tokens_per_s is not None and config.tokens_per_s <= 0:
+            raise ValueError(f"tokens_per_s must be positive, got {config.tokens_per_s}")
+
+    def _sample_latency(self) -> float:
+        config = self.config
+        mean, std = config.latency_mean, config.latency_std
+        if mean <= 0:
+            return 0.0
+        if config.latency_distribution == "constant":
+            return mean
+        if config.latency_distribution == "uniform":
+            half_width = math.sqrt(3) * std
+            return max(0.0, self._rng.uniform(mean - half_width, mean + half_width))
+        if config.latency_distribution == "exponential":
+            return self._rng.expovariate(1 / mean)
+        sigma2 = math.log(1 + (std / mean) ** 2)
+        return self._rng.lognormvariate(math.log(mean) - sigma2 / 2, math.sqrt(sigma2))
+
+    def _next_call(self):
+        """Returns (latency, fails) for the next call."""
+        with self._lock:
+            self.calls += 1
+            latency = self._sample_latency()
+            fails = self._rng.random() < self.config.error_rate
+            if fails:
+                self.errors += 1
+            return latency, fails
+
+    def _cached_tokens(self, tokens: List[str]) -> int:
+        """Length of the longest prefix of `tokens` sent before, at the lengths a provider caches
+        (`prompt_cache_min_tokens`, then every `prompt_cache_block_tokens`); records the prefixes."""
+        min_tokens, block = self.config.prompt_cache_min_tokens, self.config.prompt_cache_block_tokens
+        digest = hashlib.sha256()
+        cached, start = 0, 0
+        with self._lock:
+            for end in range(min_tokens, len(tokens) + 1, block):
+                digest.update(" ".join(tokens[start:end]).encode("utf-8") + b" ")
+                start = end
+                prefix = digest.digest()
+                if prefix in self._prompt_prefixes:
+                    cached = end
+                else:
+                    self._prompt_prefixes.add(prefix)
+        return cached
+
+    def format_response(self, messages: List[OpenAIMessage], parameters: Optional[Dict[str, Any]]=None) -> ChatCompletion:
+        """Builds the synthetic response to `messages`."""
+        digest = hashlib.sha256(json.dumps(messages, sort_keys=True).encode("utf-8")).hexdigest()
+        words = str(messages[-1].get("content") or "").split() or ["lorem", "ipsum"]
+        n = (parameters or {}).get("n", self.model_config_dict.get("n", 1))
+        contents, completion_tokens = [], 0
+        for i in range(n):
+            # the first choice is what a request with n=1 returns; the others are further samples
+            rng = random.Random(digest if i == 0 else f"{digest}:{i}")
+            n_words = rng.randint(self.config.output_tokens_min, self.config.output_tokens_max)
+            chosen = [words[rng.randrange(len(words))] for _ in range(n_words)]
+            contents.append("\n".join(" ".join(chosen[j:j + 12]) for j in range(0, n_words, 12)))
+            completion_tokens += n_words
+
+        tokens = [token for message in messages for token in str(message.get("content") or "").split()]
+        prompt_tokens = len(tokens)
+        details = None
+        if self.config.prompt_cache_min_tokens is not None:
+            details = PromptTokensDetails.model_construct(cached_tokens=self._cached_tokens(tokens))
+        # model_construct skips validation, which would otherwise dominate the cost of a fake call
+        return ChatCompletion.model_construct(
+            id=f"fake-{digest[:12]}",
+            object="chat.completion",
+            created=int(time.time()),
+            model=self.model_name,
+            choices=[Choice.model_construct(index=i, finish_reason="stop",
+                                            message=ChatCompletionMessage.model_construct(role="assistant", content=content))
+                     for i, content in enumerate(contents)],
+            usage=CompletionUsage.model_construct(
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                total_tokens=prompt_tokens + completion_tokens,
+                prompt_tokens_details=details
+            ),
+        )
+
+    def _streams(self, parameters: Optional[Dict[str, Any]]) -> bool:
+        return bool((parameters or {}).get("stream", self.model_config_dict.get("stream", False)))
+
+    def _decoding_time(self, response: ChatCompletion) -> float:
+        """Seconds to generate the longest choice at `tokens_per_s`; choices are generated in parallel."""
+        if self.config.tokens_per_s is None:
+            return 0.0
+        return max(len(choice.message.content.split()) for choice in response.choices) / self.config.tokens_per_s
+
+    def _stream_steps(self, response: ChatCompletion) -> List[List[ChatCompletionChunk]]:
+        """`response` as the API streams it: a delta per word and choice at each step, then the
+        finish reasons and the usage."""
+        tokens = [re.findall(r"\s*\S+", choice.message.content or "") for choice in response.choices]
+
+        def chunk(choices, usage=None):
+            return ChatCompletionChunk.model_construct(id=response.id, object="chat.completion.chunk",
+                                                       created=response.created, model=response.model,
+                                                       choices=choices, usage=usage)
+
+        steps = []
+        for position in range(max(map(len, tokens), default=0)):
+            steps.append([chunk([ChunkChoice.model_construct(
+                index=i, finish_reason=None,
+                delta=ChoiceDelta.model_construct(role="assistant" if position == 0 else None, content=choice_tokens[position])
+            )]) for i, choice_tokens in enumerate(tokens) if position < len(choice_tokens)])
+        steps.append([chunk([ChunkChoice.model_construct(index=i, finish_reason="stop", delta=ChoiceDelta.model_construct())
+                             for i in range(len(tokens))]),
+                      chunk([], response.usage)])
+        return steps
+
+    def _step_time(self, i: int, n_steps: int) -> float:
+        """Seconds from the first token to step `i` of `_stream_steps`; the last step ends the stream at once."""
+        if self.config.tokens_per_s is None:
+            return 0.0
+        return min(i, n_steps - 2) / self.config.tokens_per_s
+
+    def _stream(self, response: ChatCompletion, latency: float) -> Iterator[ChatCompletionChunk]:
+        """Yields the chunks of `response`, the first after `latency` and the next ones at `tokens_per_s`."""
+        steps = self._stream_steps(response)
+        # deadlines rather than a sleep per step, so that oversleeping does not add up
+        start = time.perf_counter() + latency
+        for i, step in enumerate(steps):
+            time.sleep(max(0.0, start + self._step_time(i, len(steps)) - time.perf_counter()))
+            yield from step
+
+    def query(self, messages: List[OpenAIMessage], parameters: Optional[Dict[str, Any]]=None,
+              stream_stop: Optional[Callable[[str], Optional[int]]]=None) -> ChatCompletion:
+        """Blocks for a sampled latency and returns a synthetic completion, streamed with `stream=True`."""
+        with tracing.span("llm.query", model=self.model_name):
+            latency, fails = self._next_call()
+            if fails:
+                time.sleep(latency)
+                tracing.annotate(api_s=latency)
+                raise FakeAPIError()
+            response = self.format_response(messages, parameters)
+            if self._streams(parameters):
+                sent = time.perf_counter()
+                response = collect_stream(self._stream(response, latency), stream_stop, sent)
+                tracing.annotate(api_s=time.perf_counter() - sent)
+            else:
+                latency += self._decoding_time(response)
+                time.sleep(latency)
+                tracing.annotate(api_s=latency)
+            tracing.record_usage(response)
+            return response
+
+    def failsafe_query(self, messages: List[OpenAIMessage], parameters: Optional[Dict[str, Any]]=None,
+                       stream_stop: Optional[Callable[[str], Optional[int]]]=None) -> ChatCompletion:
+        """Retries query in case the fake API fails."""
+        return retry_call(lambda: self.query(messages, parameters, stream_stop), self.retry_config, self.circuit_breaker)
+
+
+class AsyncFakeModel(FakeModel):
+    """FakeModel whose `query` is a coroutine, like `openai_model.AsyncOpenAIModel`."""
+
+    async def _astream(self, response: ChatCompletion, latency: float) -> AsyncIterator[ChatCompletionChunk]:
+        """Awaitable `_stream`."""
+        steps = self._stream_steps(response)
+        start = time.perf_counter() + latency
+        for i, step in enumerate(steps):
+            await asyncio.sleep(max(0.0, start + self._step_time(i, len(steps)) - time.perf_counter()))
+            for chunk in step:
+                yield chunk
+
+    async def query(self, messages: List[OpenAIMessage], parameters: Optional[Dict[str, Any]]=None,
+                    stream_stop: Optional[Callable[[str], Optional[int]]]=None) -> ChatCompletion:
+        """Sleeps on the event loop for a sampled latency and returns a synthetic completion."""
+        with tracing.span("llm.query", model=self.model_name):
+            latency, fails = self._next_call()
+            if fails:
+                await asyncio.sleep(latency)
+                tracing.annotate(api_s=latency)
+                raise FakeAPIError()
+            response = self.format_response(messages, parameters)
+            if self._streams(parameters):
+                sent = time.perf_counter()
+                response = await acollect_stream(self._astream(response, latency), stream_stop, sent)
+                tracing.annotate(api_s=time.perf_counter() - sent)
+            else:
+                latency += self._decoding_time(response)
+                await asyncio.sleep(latency)
+                tracing.annotate(api_s=latency)
+            tracing.record_usage(response)
+            return response
+
+    async def failsafe_query(self, messages: List[OpenAIMessage], parameters: Optional[Dict[str, Any]]=None,
+                             stream_stop: Optional[Callable[[str], Optional[int]]]=None) -> ChatCompletion:
+        """Retries query in case the fake API fails."""
+        return await aretry_call(lambda: self.query(messages, parameters, stream_stop), self.retry_config,
+                                 self.circuit_breaker)
@@ -0,0 +1,99 @@
+"""Serves concurrent execution calls with identical messages from one request with `n` choices.
+
+Every simulation's first generation summarizes the same original story, so its execution
+messages are the same in all simulations. `ExecutionFanOut` groups such calls, sends one
+request with `n` set to the size of the group and hands each choice to a different call.
+"""
+
+import asyncio
+import copy
+from typing import Any, Dict, List, Set, Tuple
+
+# OpenAI and Azure OpenAI reject requests with a larger `n`
+MAX_N = 128
+
+
+def messages_key(messages: List[Dict[str, Any]]) -> Tuple[Tuple[Any, Any], ...]:
+    return tuple((message.get("role"), message.get("content")) for message in messages)
+
+
+def split_choices(response: Any) -> List[Any]:
+    """One shallow copy of `response` per choice, holding only that choice, so that
+    `parse_execution_response` reads it from `choices[0]` as usual."""
+    views = []
+    for choice in response.choices:
+        view = copy.copy(response)
+        view.choices = [choice]
+        views.append(view)
+    return views
+
+
+class ExecutionFanOut:
+    """Collects concurrent `aexecute` calls and serves those with identical messages from one request.
+
+    A group is sent once `max_n` calls with the same messages are waiting or `window`
+    seconds after the first one arrived, whichever comes first. Only calls waiting at the
+    same time are grouped, so groups are at most as large as the scheduler's concurrency.
+
+    Args:
+        task (BaseTelephoneGameTask): sends the requests, see `aquery_choices`.
+        max_n (int, optional, default: MAX_N): most choices requested at once.
+        window (float, optional, default: 0.05): seconds a group waits for more calls.
+    """
+
+    def __init__(self, task: Any, max_n: int=MAX_N, window: float=0.05):
+        if max_n < 1:
+            raise ValueError(f"max_n must be positive, got {max_n}")
+        self.task = task
+        self.max_n = max_n
+        self.window = window
+        self._pending: Dict[Tuple, Tuple[List[Dict[str, Any]], List[asyncio.Future]]] = {}
+        self._timers: Dict[Tuple, asyncio.TimerHandle] = {}
+        # the loop only keeps weak references to tasks, so the requests in flight are held here
+        self._tasks: Set[asyncio.Task] = set()
+        self.stats = {"calls": 0, "requests": 0}
+
+    async def execute(self, messages: List[Dict[str, Any]]) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        key = messages_key(messages)
+        _, futures = self._pending.setdefault(key, (messages, []))
+        futures.append(future)
+        self.stats["calls"] += 1
+        if len(futures) >= self.max_n:
+            self._flush(key)
+        elif key not in self._timers:
+            self._timers[key] = loop.call_later(self.window, self._flush, key)
+        return await future
+
+    def _flush(self, key: Tuple) -> None:
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        pending = self._pending.pop(key, None)
+        if pending is not None:
+            task = asyncio.ensure_future(self._run(*pending))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, messages: List[Dict[str, Any]], futures: List[asyncio.Future]) -> None:
+        # a response with fewer choices than requested is completed by further requests
+        while futures:
+            self.stats["requests"] += 1
+            try:
+                responses = await self.task.aquery_choices(messages, len(futures))
+            except Exception as e:
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            if not responses:
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(ValueError("The response has no choices."))
+                return
+
+            for future, response in zip(futures, responses):
+                if not future.done():
+                    future.set_result(response)
+            futures = futures[len(responses):]
@@ -0,0 +1,278 @@
+"""Array-backed transmission chains for runs with hundreds of thousands of nodes.
+
+`ChainGraph` stores the wiring of one simulation once, as CSR int arrays, and the state of
+every node of every simulation in flat columns indexed by `sim_id * nodes_per_simulation +
+local index`. `TopologicalExecutor` runs it with a fixed pool of workers that take ready
+nodes from in-degree counters, instead of one coroutine and one `asyncio.Event` per node.
+"""
+
+import asyncio
+import bisect
+import collections
+import heapq
+import itertools
+import time
+from array import array
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from configs import SchedulerConfig
+from enums import EvaluationPolicy
+from scheduler import EXECUTE, EVALUATE
+from sink import input_hash
+import tracing
+
+EXECUTED = 1
+EVALUATED = 2
+
+
+class ChainGraph:
+    """The nodes of `n_simulations` chains wired by `connections`.
+
+    Args:
+        connections (list(list)): outgoing connections per generation, in the format of
+            `utils.setup_transmission_chain`, which also appends the last generation.
+        n_simulations (int, optional, default: 1): number of chains.
+    """
+
+    def __init__(self, connections: List[List[List[int]]], n_simulations: int=1):
+        last_nodes = set(node for out_node_list in connections[-1] for node in out_node_list)
+        widths = [len(generation) for generation in connections] + [len(last_nodes)]
+        self.generation_offsets = array("l", itertools.accumulate([0] + widths))
+        self.nodes_per_simulation = self.generation_offsets[-1]
+        self.n_simulations = n_simulations
+
+        # CSR wiring of one simulation, in local indices
+        self.indptr = array("l", [0])
+        self.indices = array("l")
+        predecessors = [[] for _ in range(self.nodes_per_simulation)]
+        for gen_id, generation in enumerate(connections):
+            for node_id, outgoing in enumerate(generation):
+                source = self.generation_offsets[gen_id] + node_id
+                for out_id in outgoing:
+                    target = self.generation_offsets[gen_id + 1] + out_id
+                    self.indices.append(target)
+                    predecessors[target].append(source)
+                self.indptr.append(len(self.indices))
+        for _ in range(widths[-1]):
+            self.indptr.append(len(self.indices))
+
+        self.in_indptr = array("l", itertools.accumulate([0] + [len(sources) for sources in predecessors]))
+        self.in_indices = array("l", [source for sources in predecessors for source in sources])
+
+        # executions on the longest path to the end of the chain, see `Node.critical_path_length`
+        self.critical_path = array("l", [1] * self.nodes_per_simulation)
+        for local in reversed(range(self.nodes_per_simulation)):
+            for target in self.indices[self.indptr[local]:self.indptr[local + 1]]:
+                self.critical_path[local] = max(self.critical_path[local], 1 + self.critical_path[target])
+
+        # per-node state of all simulations
+        n_nodes = len(self)
+        self.outputs: List[Any] = [None] * n_nodes
+        self.evaluations: List[Any] = [None] * n_nodes
+        self.state = bytearray(n_nodes)
+        in_degree = array("l", [len(sources) for sources in predecessors])
+        self.missing_inputs = in_degree * n_simulations
+
+    def __len__(self) -> int:
+        return self.nodes_per_simulation * self.n_simulations
+
+    def index(self, sim_id: int, node_id: Tuple[int, int]) -> int:
+        return sim_id * self.nodes_per_simulation + self.generation_offsets[node_id[0]] + node_id[1]
+
+    def node_id(self, idx: int) -> Tuple[int, Tuple[int, int]]:
+        """(sim_id, (generation, position)) of node `idx`."""
+        sim_id, local = divmod(idx, self.nodes_per_simulation)
+        generation = bisect.bisect_right(self.generation_offsets, local) - 1
+        return sim_id, (generation, local - self.generation_offsets[generation])
+
+    def successors(self, idx: int) -> List[int]:
+        base, local = divmod(idx, self.nodes_per_simulation)
+        base *= self.nodes_per_simulation
+        return [base + target for target in self.indices[self.indptr[local]:self.indptr[local + 1]]]
+
+    def predecessors(self, idx: int) -> List[int]:
+        base, local = divmod(idx, self.nodes_per_simulation)
+        base *= self.nodes_per_simulation
+        return [base + source for source in self.in_indices[self.in_indptr[local]:self.in_indptr[local + 1]]]
+
+    def inputs(self, idx: int) -> List[Any]:
+        """Outputs of the predecessors of `idx`, i.e., `Node.inputs`."""
+        return [self.outputs[source] for source in self.predecessors(idx)]
+
+    def priority(self, idx: int) -> int:
+        return self.critical_path[idx % self.nodes_per_simulation]
+
+    def restore(self, stored: Dict[Tuple[int, Tuple[int, int]], Tuple[Any, Any]]) -> int:
+        """Pre-fills outputs and evaluations, e.g., from `checkpoint.Checkpoint.load`; returns the number restored."""
+        restored = 0
+        for (sim_id, node_id), (output, evaluation) in stored.items():
+            if sim_id >= self.n_simulations or output is None:
+                continue
+            idx = self.index(sim_id, node_id)
+            self.outputs[idx], self.evaluations[idx] = output, evaluation
+            self.state[idx] = EXECUTED | (EVALUATED if evaluation is not None else 0)
+            for target in self.successors(idx):
+                self.missing_inputs[target] -= 1
+            restored += 1
+        return restored
+
+    def results(self) -> Iterator[Tuple[int, int, int, Any, Any]]:
+        """Yields (sim_id, generation, position, output, evaluation) for every node."""
+        for idx in range(len(self)):
+            sim_id, (generation, position) = self.node_id(idx)
+            yield sim_id, generation, position, self.outputs[idx], self.evaluations[idx]
+
+
+class TopologicalExecutor:
+    """Runs every node of a `ChainGraph` with `config.max_concurrency` workers.
+
+    Ready executions are taken longest-remaining-chain first and evaluations follow
+    `config.evaluation_policy`, as with `scheduler.CallScheduler`.
+
+    Args:
+        graph (ChainGraph): the chains to run; results are written to its columns.
+        task (BaseTelephoneGameTask): executes and evaluates the nodes.
+        config (SchedulerConfig, optional): concurrency budgets and evaluation policy.
+        sink (sink.ResultSink, optional): receives a record per evaluated node. The text of
+            a node is then released once its successors and its evaluation have used it.
+        checkpoint (checkpoint.Checkpoint, optional): saves every output and evaluation.
+
+    Example:
+        graph = ChainGraph(connections, n_simulations=100000)
+        await TopologicalExecutor(graph, task, SchedulerConfig(max_concurrency=64)).run()
+    """
+
+    def __init__(self, graph: ChainGraph, task: Any, config: Optional[SchedulerConfig]=None,
+                 sink: Optional[Any]=None, checkpoint: Optional[Any]=None):
+        self.graph = graph
+        self.task = task
+        self.config = config or SchedulerConfig()
+        self.limits = {
+            EXECUTE: self.config.max_execute or self.config.max_concurrency,
+            EVALUATE: self.config.max_evaluate or self.config.max_concurrency,
+        }
+        self.sink = sink
+        self.checkpoint = checkpoint
+
+    def _push_execute(self, idx: int) -> None:
+        # FIFO ignores priorities so that it reproduces the arrival order
+        key = 0 if self.config.evaluation_policy is EvaluationPolicy.FIFO else -self.graph.priority(idx)
+        heapq.heappush(self._executions, (key, next(self._seq), idx))
+
+    def _next(self) -> Tuple[Optional[str], int]:
+        executions, evaluations = self._executions, self._evaluations
+        can_execute = bool(executions) and self._running[EXECUTE] < self.limits[EXECUTE]
+        can_evaluate = bool(evaluations) and self._running[EVALUATE] < self.limits[EVALUATE] and \
+            (self.config.evaluation_policy is not EvaluationPolicy.DEFERRED or self._unexecuted == 0)
+        if can_execute and can_evaluate and self.config.evaluation_policy is EvaluationPolicy.FIFO:
+            can_execute = executions[0][1] < evaluations[0][0]
+        if can_execute:
+            return EXECUTE, heapq.heappop(executions)[-1]
+        # under BACKFILL, executions block evaluations only while they can take the slot
+        if can_evaluate:
+            return EVALUATE, evaluations.popleft()[-1]
+        return None, -1
+
+    def _release(self, idx: int) -> None:
+        """Drops the text of `idx` once it is on disk and nothing needs it anymore."""
+        self._references[idx] -= 1
+        if self._references[idx] == 0 and self.sink is not None:
+            self.graph.outputs[idx] = self.graph.evaluations[idx] = None
+
+    async def _execute(self, idx: int) -> None:
+        graph = self.graph
+        sim_id, node_id = graph.node_id(idx)
+        inputs = graph.inputs(idx)
+        start = time.perf_counter()
+        with tracing.span("node.process", sim_id=sim_id, generation=node_id[0], position=node_id[1],
+                          task=type(self.task).__name__):
+            graph.outputs[idx] = await self.task.aexecute(inputs, sim_id=sim_id, node_id=node_id)
+        graph.state[idx] |= EXECUTED
+        self._unexecuted -= 1
+        if self.sink is not None:
+            self._records[idx] = {"input_hash": input_hash(inputs), "execute_s": time.perf_counter() - start}
+        if self.checkpoint is not None:
+            self.checkpoint.save_result(sim_id, node_id, graph.outputs[idx], None)
+
+        for target in graph.successors(idx):
+            graph.missing_inputs[target] -= 1
+            if graph.missing_inputs[target] == 0:
+                self._push_execute(target)
+        for source in graph.predecessors(idx):
+            self._release(source)
+        self._evaluations.append((next(self._seq), idx))
+
+    async def _evaluate(self, idx: int) -> None:
+        graph = self.graph
+        start = time.perf_counter()
+        sim_id, node_id = graph.node_id(idx)
+        with tracing.span("node.evaluate", sim_id=sim_id, generation=node_id[0], position=node_id[1],
+                          task=type(self.task).__name__):
+            graph.evaluations[idx] = await self.task.aevaluate(graph.outputs[idx])
+        graph.state[idx] |= EVALUATED
+        if self.checkpoint is not None:
+            self.checkpoint.save_result(sim_id, node_id, None, graph.evaluations[idx])
+        if self.sink is not None:
+            record = self._records.pop(idx, {"input_hash": None, "execute_s": None})
+            await self.sink.put_record({
+                "sim_id": sim_id, "id": list(node_id), "input_hash": record["input_hash"],
+                "output": graph.outputs[idx], "evaluation": graph.evaluations[idx],
+                "execute_s": record["execute_s"], "evaluate_s": time.perf_counter() - start,
+                "finished_at": time.time()
+            })
+        self._release(idx)
+        self._unfinished -= 1
+
+    async def _worker(self) -> None:
+        while self._unfinished > 0 and self._error is None:
+            kind, idx = self._next()
+            if kind is None:
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+
+            self._running[kind] += 1
+            try:
+                await (self._execute(idx) if kind == EXECUTE else self._evaluate(idx))
+            except Exception as e:
+                self._error = e
+            finally:
+                self._running[kind] -= 1
+                # new ready nodes, a free budget or the end of the run
+                self._wake.set()
+
+    async def run(self) -> ChainGraph:
+        """Runs the nodes that are not executed or evaluated yet; raises the first error."""
+        graph = self.graph
+        self._seq = itertools.count()
+        self._executions: List[Tuple[int, int, int]] = []
+        self._evaluations = collections.deque()
+        self._running = {EXECUTE: 0, EVALUATE: 0}
+        self._records: Dict[int, Dict[str, Any]] = {}
+        self._error: Optional[BaseException] = None
+        self._wake = asyncio.Event()
+
+        # a node's output is used by its successors and its own evaluation
+        out_degree = array("l", [graph.indptr[i + 1] - graph.indptr[i] for i in range(graph.nodes_per_simulation)])
+        self._references = array("l", [degree + 1 for degree in out_degree]) * graph.n_simulations
+
+        self._unexecuted = self._unfinished = 0
+        for idx, state in enumerate(graph.state):
+            if not state & EXECUTED:
+                self._unexecuted += 1
+                if graph.missing_inputs[idx] == 0:
+                    self._push_execute(idx)
+            elif not state & EVALUATED:
+                self._evaluations.append((next(self._seq), idx))
+            else:
+                for source in graph.predecessors(idx):
+                    self._references[source] -= 1
+            if state != EXECUTED | EVALUATED:
+                self._unfinished += 1
+            else:
+                self._references[idx] -= 1
+
+        await asyncio.gather(*[self._worker() for _ in range(self.config.max_concurrency)])
+        if self._error is not None:
+            raise self._error
+        return graph
@@ -0,0 +1,312 @@
+"""Process-wide HTTP connection pools shared by all OpenAI models that target the same endpoint.
+
+A pool is one client of the model's `client_cls` (e.g. `AzureOpenAI`) over a metered
+transport, keyed by the client class, endpoint and credentials. Models borrow the client
+from `get_client` on every call rather than own one, so that an executor and an evaluator
+model, or the models of several tasks, reuse each other's keep-alive connections instead of
+opening their own. Async clients are bound to the event loop they run on, so an async pool
+keeps one client per loop; all of them share the pool's limits and counters.
+"""
+
+import asyncio
+import hashlib
+import inspect
+import logging
+import threading
+import time
+import weakref
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from openai import DefaultAsyncHttpxClient, DefaultHttpxClient
+
+from configs import HTTPPoolConfig
+
+try:
+    # openai>=3 ships its transport as `httpx2`
+    import httpx2 as httpx
+except ImportError:
+    import httpx
+
+logger = logging.getLogger(__name__)
+
+# httpx's own default, used when neither the pool nor the rate limiter bounds the connections
+DEFAULT_MAX_CONNECTIONS = 100
+
+_CONNECT_EVENTS = ("connection.connect_tcp.complete", "connection.connect_unix_socket.complete")
+_SEND_EVENTS = ("http11.send_request_headers.started", "http2.send_request_headers.started")
+
+
+@dataclass(frozen=True)
+class HTTPPoolStats:
+    """A snapshot of the connections of an `HTTPPool`."""
+    max_connections: int
+    open: int
+    idle: int
+    total_requests: int
+    total_opened: int
+    total_reused: int
+    total_waited: int
+    wait_time: float
+
+
+class _Exchange:
+    """Follows one request through the connection pool's trace events."""
+
+    __slots__ = ("meter", "start", "waited", "connected", "sent")
+
+    def __init__(self, meter: "_Meter", waited: bool):
+        self.meter = meter
+        self.start = time.monotonic()
+        self.waited = waited
+        self.connected = False
+        self.sent = False
+
+    def on_event(self, name: str) -> None:
+        if name in _CONNECT_EVENTS:
+            self.connected = True
+            self.meter.count(opened=1)
+        elif name in _SEND_EVENTS and not self.sent:
+            self.sent = True
+            # a request waits for a connection until it either opens one or sends on one
+            wait_time = time.monotonic() - self.start if self.waited else 0.0
+            self.meter.count(reused=0 if self.connected else 1, wait_time=wait_time)
+
+
+class _Meter:
+    """Counts the requests of a pool, the connections they opened and those they waited for."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.opened = 0
+        self.reused = 0
+        self.waited = 0
+        self.wait_time = 0.0
+
+    def count(self, opened: int=0, reused: int=0, wait_time: float=0.0) -> None:
+        with self._lock:
+            self.opened += opened
+            self.reused += reused
+            self.wait_time += wait_time
+
+    def begin(self, connection_pool: Any, max_connections: int) -> _Exchange:
+        """Starts following a request; it waits if every connection is busy and no new one may be opened."""
+        connections = connection_pool.connections
+        waited = len(connections) >= max_connections and not any(c.is_available() for c in connections)
+        with self._lock:
+            self.requests += 1
+            self.waited += waited
+        return _Exchange(self, waited)
+
+
+class _MeteredTransport(httpx.HTTPTransport):
+
+    def __init__(self, meter: _Meter, max_connections: int, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.meter = meter
+        self.max_connections = max_connections
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        exchange = self.meter.begin(self._pool, self.max_connections)
+        trace = request.extensions.get("trace")
+
+        def on_event(name: str, info: Dict[str, Any]) -> None:
+            exchange.on_event(name)
+            if trace is not None:
+                trace(name, info)
+
+        request.extensions = {**request.extensions, "trace": on_event}
+        return super().handle_request(request)
+
+
+class _AsyncMeteredTransport(httpx.AsyncHTTPTransport):
+
+    def __init__(self, meter: _Meter, max_connections: int, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.meter = meter
+        self.max_connections = max_connections
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        exchange = self.meter.begin(self._pool, self.max_connections)
+        trace = request.extensions.get("trace")
+
+        async def on_event(name: str, info: Dict[str, Any]) -> None:
+            exchange.on_event(name)
+            if trace is not None:
+                await trace(name, info)
+
+        request.extensions = {**request.extensions, "trace": on_event}
+        return await super().handle_async_request(request)
+
+
+class HTTPPool:
+    """Clients of `client_cls` for one endpoint, all over metered transports with the same limits.
+
+    Args:
+        client_cls (type): `OpenAI`, `AzureOpenAI` or one of their async variants.
+        client_kwargs (Dict[str, Any]): Endpoint and credentials passed to `client_cls`.
+        config (HTTPPoolConfig, optional): Limits of the pool.
+        max_connections (int, optional): Used when `config.max_connections` is `None`,
+            e.g. the `max_concurrency` of the models' rate limiter.
+    """
+
+    def __init__(self, client_cls: type, client_kwargs: Dict[str, Any],
+                 config: Optional[HTTPPoolConfig]=None, max_connections: Optional[int]=None):
+        self.client_cls = client_cls
+        self.client_kwargs = client_kwargs
+        self.config = config or HTTPPoolConfig()
+        self.max_connections = self.config.max_connections or max_connections or DEFAULT_MAX_CONNECTIONS
+        self.limits = httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.config.max_keepalive_connections or self.max_connections,
+            keepalive_expiry=self.config.keepalive_expiry)
+        self.asynchronous = inspect.iscoroutinefunction(client_cls.close)
+        self.meter = _Meter()
+        self.ignored = set()
+        self._lock = threading.Lock()
+        # (client, transport) of a sync pool, and of an async pool per event loop
+        self._client: Optional[Tuple[Any, Any]] = None
+        self._loop_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Tuple[Any, Any]]" = \
+            weakref.WeakKeyDictionary()
+
+    def _create_client(self) -> Tuple[Any, Any]:
+        transport_kwargs = {"meter": self.meter, "max_connections": self.max_connections,
+                            "limits": self.limits, "http2": self.config.http2}
+        if self.asynchronous:
+            transport = _AsyncMeteredTransport(**transport_kwargs)
+            http_client = DefaultAsyncHttpxClient(transport=transport)
+        else:
+            transport = _MeteredTransport(**transport_kwargs)
+            http_client = DefaultHttpxClient(transport=transport)
+        # retries are handled by `failsafe_query` so that each attempt goes through the rate limiter
+        return self.client_cls(max_retries=0, http_client=http_client, **self.client_kwargs), transport
+
+    def client(self) -> Any:
+        """Returns the client, or for async pools the client of the running event loop."""
+        with self._lock:
+            if not self.asynchronous:
+                if self._client is None:
+                    self._client = self._create_client()
+                return self._client[0]
+
+            # raises outside of a running loop, where an async client could not send anyway
+            loop = asyncio.get_running_loop()
+            entry = self._loop_clients.get(loop)
+            if entry is None:
+                # the connections of a closed loop cannot be used or closed any more
+                for closed in [other for other in self._loop_clients if other.is_closed()]:
+                    del self._loop_clients[closed]
+                entry = self._loop_clients[loop] = self._create_client()
+            return entry[0]
+
+    def stats(self) -> HTTPPoolStats:
+        with self._lock:
+            entries = [self._client] + [entry for loop, entry in self._loop_clients.items() if not loop.is_closed()]
+            connections = [c for entry in entries if entry is not None for c in entry[1]._pool.connections]
+        meter = self.meter
+        return HTTPPoolStats(
+            max_connections=self.max_connections,
+            open=sum(c.is_connected() for c in connections),
+            idle=sum(c.is_connected() and c.is_idle() for c in connections),
+            total_requests=meter.requests,
+            total_opened=meter.opened,
+            total_reused=meter.reused,
+            total_waited=meter.waited,
+            wait_time=meter.wait_time,
+        )
+
+    def close(self) -> None:
+        """Closes the sync client, and the async clients whose event loop is not running.
+
+        Async clients of a running loop are left to `aclose`; their connections are
+        dropped with the pool.
+        """
+        with self._lock:
+            entry, self._client = self._client, None
+            loop_clients = list(self._loop_clients.items())
+            self._loop_clients = weakref.WeakKeyDictionary()
+        if entry is not None:
+            entry[0].close()
+        for loop, (client, _) in loop_clients:
+            if not loop.is_closed() and not loop.is_running():
+                loop.run_until_complete(client.close())
+
+    async def aclose(self) -> None:
+        """Closes the async client of the running event loop, then the others with `close`."""
+        with self._lock:
+            entry = self._loop_clients.pop(asyncio.get_running_loop(), None)
+        if entry is not None:
+            await entry[0].close()
+        self.close()
+
+    @property
+    def label(self) -> str:
+        """The endpoint, client class and a fingerprint of the API key, for reports."""
+        endpoint = self.client_kwargs.get("azure_endpoint") or self.client_kwargs.get("base_url") or "default"
+        api_key = str(self.client_kwargs.get("api_key"))
+        return f"{endpoint} ({self.client_cls.__name__}, key {hashlib.sha256(api_key.encode()).hexdigest()[:8]})"
+
+
+def _pool_key(client_cls: type, client_kwargs: Dict[str, Any]) -> Tuple:
+    return (client_cls,) + tuple(sorted((key, str(value)) for key, value in client_kwargs.items()))
+
+
+_pools: Dict[Tuple, HTTPPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(client_cls: type, client_kwargs: Dict[str, Any], config: Optional[HTTPPoolConfig]=None,
+             max_connections: Optional[int]=None) -> HTTPPool:
+    """Returns the process-wide pool for the endpoint and credentials in `client_kwargs`, creating it on first use.
+
+    The first caller sizes the pool; a later `config` or `max_connections` that asks for
+    another size only logs a warning, since the pool's connections are already shared.
+    Call `close_http_pools` to start over with new limits.
+    """
+    key = _pool_key(client_cls, client_kwargs)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = HTTPPool(client_cls, client_kwargs, config, max_connections)
+            return pool
+    wanted = (config.max_connections if config is not None else None) or max_connections
+    if (config is not None and config != pool.config) or (wanted is not None and wanted > pool.max_connections):
+        # models borrow on every call, so each mismatch is reported once
+        ignored = config or f"max_connections={max_connections}"
+        if ignored not in pool.ignored:
+            pool.ignored.add(ignored)
+            logger.warning("The HTTP pool of %s already exists with %d connections; %s is ignored.",
+                           pool.label, pool.max_connections, ignored)
+    return pool
+
+
+def get_client(client_cls: type, client_kwargs: Dict[str, Any], config: Optional[HTTPPoolConfig]=None,
+               max_connections: Optional[int]=None) -> Any:
+    """Returns the client of the shared pool, see `get_pool` and `HTTPPool.client`."""
+    return get_pool(client_cls, client_kwargs, config, max_connections).client()
+
+
+def http_pool_stats() -> Dict[str, HTTPPoolStats]:
+    """Returns the connections and counters of every pool, keyed by `HTTPPool.label`."""
+    with _pools_lock:
+        pools = list(_pools.values())
+    return {pool.label: pool.stats() for pool in pools}
+
+
+def close_http_pools() -> None:
+    """Closes every pool; models open new ones on their next call. See `HTTPPool.close`."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+async def aclose_http_pools() -> None:
+    """Closes every pool, including the async clients of the running event loop."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        await pool.aclose()
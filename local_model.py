@@ -0,0 +1,446 @@
+"""A `BaseAPIModel` running an open-weights language model on the CPU, with calls batched across nodes.
+
+`LocalModel` / `AsyncLocalModel` answer `query` with the same `ChatCompletion` as the API
+models, without network access or quota. Their calls go to a `DynamicBatcher`, shared by
+all models of the same weights and batch settings: a worker thread takes the first waiting
+call, collects the calls that arrive within `LocalModelConfig.batch_window_s` (up to
+`max_batch_size`) and generates them in one batched forward pass with `transformers`.
+Concurrent nodes therefore share passes over the weights instead of running one after another.
+
+Calls with different sampling parameters (`max_tokens`, `temperature`, `top_p`, `n`) are
+generated in separate passes; `stop` sequences and the `stream_stop` of a task end each
+sequence of a batch on its own. Tasks only pass `stream_stop` to models with `stream=True`,
+which the local models accept for that purpose. `temperature=0` decodes greedily. Other
+`OpenAIChatConfig` fields are accepted and ignored. `llama.cpp` bindings are not used, as
+they generate one sequence per call.
+"""
+
+import asyncio
+import concurrent.futures
+import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from openai.types.chat import ChatCompletion, ChatCompletionMessage
+from openai.types.chat.chat_completion import Choice
+from openai.types.completion_usage import CompletionUsage
+
+from base_model import BaseAPIModel
+from configs import LocalModelConfig, OPENAI_API_PARAMS, RetryConfig
+from messages import OpenAIMessage
+from retry import CircuitBreaker, aretry_call, retry_call
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# request parameters that apply to a whole forward pass, so calls only share one if they agree
+BATCH_PARAMS = ("max_tokens", "temperature", "top_p", "n")
+
+Stop = Callable[[str], Optional[int]]
+
+
+@dataclass(frozen=True)
+class BatcherStats:
+    """Counters of a `DynamicBatcher`."""
+    max_batch_size: int
+    queued: int
+    requests: int
+    batches: int
+    mean_batch_size: float
+    busy_s: float
+
+
+@dataclass(frozen=True)
+class Generation:
+    """The choices generated for one call: (text, finish_reason) each, and the token counts."""
+    choices: List[Tuple[str, str]]
+    prompt_tokens: int
+    completion_tokens: int
+
+
+def stop_at_sequences(sequences: Sequence[str]) -> Stop:
+    """A stop condition cutting the text before the first of `sequences`, like the API's `stop`."""
+    def stop(text: str) -> Optional[int]:
+        cuts = [cut for cut in (text.find(sequence) for sequence in sequences) if cut >= 0]
+        return min(cuts) if cuts else None
+    return stop
+
+
+def _first_stop(stops: Sequence[Stop]) -> Optional[Stop]:
+    """One condition cutting where the earliest of `stops` does."""
+    if len(stops) <= 1:
+        return stops[0] if stops else None
+
+    def stop(text: str) -> Optional[int]:
+        cuts = [cut for cut in (stop(text) for stop in stops) if cut is not None]
+        return min(cuts) if cuts else None
+    return stop
+
+
+class TransformersEngine:
+    """Generates the completions of a batch of chats with a `transformers` causal language model.
+
+    Args:
+        config (LocalModelConfig): the model and its dtype and threads.
+        check_every (int, optional, default: 8): tokens between checks of the stop
+            conditions, which decode the text generated so far.
+    """
+
+    def __init__(self, config: LocalModelConfig, check_every: int=8):
+        import torch
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+
+        self.torch = torch
+        self.check_every = check_every
+        # seed and threads are process-wide torch settings, applied by the first config only
+        self.num_threads = config.num_threads
+        self.seed = config.seed
+        self.ignored: Set[str] = set()
+        if config.num_threads is not None:
+            torch.set_num_threads(config.num_threads)
+        torch.manual_seed(config.seed)
+        # decoder-only models continue the last token of each row, so prompts are padded on the left
+        self.tokenizer = AutoTokenizer.from_pretrained(config.model, padding_side="left")
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.model = AutoModelForCausalLM.from_pretrained(config.model, dtype=getattr(torch, config.dtype))
+        self.model.eval()
+        eos = self.model.generation_config.eos_token_id
+        self.eos_token_ids = set(eos if isinstance(eos, list) else [] if eos is None else [eos])
+
+    def prompt(self, messages: List[OpenAIMessage]) -> str:
+        """The text of `messages`, in the chat template of the model if it has one."""
+        if self.tokenizer.chat_template:
+            return self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        return "".join(f"{message['content']}\n\n" for message in messages)
+
+    def _stopping_criteria(self, prompt_length: int, stops: List[Optional[Stop]]) -> Any:
+        from transformers import StoppingCriteria, StoppingCriteriaList
+
+        engine = self
+
+        class TextStop(StoppingCriteria):
+            """Ends each row once its stop condition holds on the text generated so far."""
+
+            def __init__(self):
+                self.done = engine.torch.zeros(len(stops), dtype=engine.torch.bool)
+
+            def __call__(self, input_ids, scores, **kwargs):
+                if (input_ids.shape[1] - prompt_length) % engine.check_every == 0:
+                    for row, stop in enumerate(stops):
+                        if stop is not None and not self.done[row]:
+                            text = engine.tokenizer.decode(input_ids[row, prompt_length:], skip_special_tokens=True)
+                            self.done[row] = stop(text) is not None
+                return self.done.clone()
+
+        return StoppingCriteriaList([TextStop()])
+
+    def generate(self, chats: List[List[OpenAIMessage]], max_tokens: int, temperature: float, top_p: float, n: int,
+                 stops: List[Optional[Stop]]) -> List[Generation]:
+        """Generates `n` choices for each chat in one batched call of `model.generate`."""
+        torch = self.torch
+        inputs = self.tokenizer([self.prompt(messages) for messages in chats], return_tensors="pt", padding=True)
+        prompt_length = inputs["input_ids"].shape[1]
+        # the `n` choices of a chat are consecutive rows of the output
+        row_stops = [stop for stop in stops for _ in range(n)]
+        kwargs = {"max_new_tokens": max_tokens, "num_return_sequences": n, "do_sample": temperature > 0,
+                  "pad_token_id": self.tokenizer.pad_token_id}
+        if temperature > 0:
+            kwargs.update(temperature=temperature, top_p=top_p)
+        else:
+            kwargs.update(temperature=None, top_p=None, top_k=None)
+        if any(stop is not None for stop in row_stops):
+            kwargs["stopping_criteria"] = self._stopping_criteria(prompt_length, row_stops)
+
+        with torch.inference_mode():
+            output = self.model.generate(**inputs, **kwargs)
+
+        generations = []
+        prompt_tokens = inputs["attention_mask"].sum(dim=1).tolist()
+        rows = output[:, prompt_length:].tolist()
+        for idx in range(len(chats)):
+            choices, completion_tokens = [], 0
+            for row in range(idx * n, (idx + 1) * n):
+                tokens = rows[row]
+                # a row that ended early is padded up to the longest one
+                length = next((i for i, token in enumerate(tokens) if token in self.eos_token_ids), None)
+                finish_reason = "length" if length is None else "stop"
+                tokens = tokens[:length]
+                text = self.tokenizer.decode(tokens, skip_special_tokens=True)
+                cut = row_stops[row](text) if row_stops[row] is not None else None
+                if cut is not None:
+                    text, finish_reason = text[:cut], "stop"
+                if row_stops[row] is not None and finish_reason == "length" and len(tokens) < max_tokens:
+                    # stopped by the stopping criteria before the condition was checked on the final text
+                    finish_reason = "stop"
+                choices.append((text, finish_reason))
+                completion_tokens += len(tokens)
+            generations.append(Generation(choices, prompt_tokens[idx], completion_tokens))
+        return generations
+
+
+class _Call:
+
+    __slots__ = ("messages", "params", "stop", "future", "submitted")
+
+    def __init__(self, messages: List[OpenAIMessage], params: Tuple, stop: Optional[Stop]):
+        self.messages = messages
+        self.params = params
+        self.stop = stop
+        self.future: concurrent.futures.Future = concurrent.futures.Future()
+        self.submitted = time.perf_counter()
+
+
+class DynamicBatcher:
+    """Runs the calls submitted from any thread or event loop in batches, on one worker thread.
+
+    Args:
+        engine (TransformersEngine): generates the batches.
+        max_batch_size (int): calls per forward pass.
+        batch_window_s (float): seconds to wait for more calls once one arrived.
+    """
+
+    def __init__(self, engine: Any, max_batch_size: int, batch_window_s: float):
+        self.engine = engine
+        self.max_batch_size = max_batch_size
+        self.batch_window_s = batch_window_s
+        self._queue: "queue.Queue[Optional[_Call]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.batches = 0
+        self.busy_s = 0.0
+        self._thread = threading.Thread(target=self._run, name="local-model-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, messages: List[OpenAIMessage], params: Tuple, stop: Optional[Stop]=None
+               ) -> concurrent.futures.Future:
+        """Queues a call; the future resolves to (`Generation`, batch size, seconds queued)."""
+        call = _Call(messages, params, stop)
+        self._queue.put(call)
+        return call.future
+
+    def _collect(self) -> Optional[List[_Call]]:
+        """The next calls to run: the first waiting one and those arriving within the window."""
+        first = self._queue.get()
+        if first is None:
+            return None
+        calls = [first]
+        deadline = time.perf_counter() + self.batch_window_s
+        while len(calls) < self.max_batch_size:
+            try:
+                call = self._queue.get(timeout=max(0.0, deadline - time.perf_counter()))
+            except queue.Empty:
+                break
+            if call is None:
+                # finish the calls collected so far, then stop
+                self._queue.put(None)
+                break
+            calls.append(call)
+        return calls
+
+    def _run(self) -> None:
+        while True:
+            calls = self._collect()
+            if calls is None:
+                return
+            groups: Dict[Tuple, List[_Call]] = {}
+            for call in calls:
+                groups.setdefault(call.params, []).append(call)
+            for params, group in groups.items():
+                # cancelled calls are dropped; the others can no longer be cancelled
+                live = [call for call in group if call.future.set_running_or_notify_cancel()]
+                if not live:
+                    continue
+                start = time.perf_counter()
+                try:
+                    generations = self.engine.generate([call.messages for call in live], *params,
+                                                       [call.stop for call in live])
+                except Exception as e:
+                    for call in live:
+                        call.future.set_exception(e)
+                    continue
+                with self._lock:
+                    self.requests += len(live)
+                    self.batches += 1
+                    self.busy_s += time.perf_counter() - start
+                for call, generation in zip(live, generations):
+                    call.future.set_result((generation, len(live), start - call.submitted))
+
+    def close(self) -> None:
+        """Stops the worker once the queued calls are done."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def stats(self) -> BatcherStats:
+        with self._lock:
+            return BatcherStats(
+                max_batch_size=self.max_batch_size,
+                queued=self._queue.qsize(),
+                requests=self.requests,
+                batches=self.batches,
+                mean_batch_size=self.requests / self.batches if self.batches else 0.0,
+                busy_s=self.busy_s,
+            )
+
+
+_engines: Dict[Tuple[str, str], TransformersEngine] = {}
+_batchers: Dict[Tuple[str, str, int, float], DynamicBatcher] = {}
+_batchers_lock = threading.Lock()
+
+
+def get_batcher(config: LocalModelConfig) -> DynamicBatcher:
+    """Returns the process-wide batcher of `config`'s weights and batch settings, loading the weights on first use.
+
+    Models of the same weights share the loaded engine, and those with the same batch
+    settings also share the batcher, so that their calls are batched together. The seed
+    and threads of the engine are those of the first config; another `seed` or
+    `num_threads` only logs a warning, since Torch applies them to the whole process.
+    Call `close_local_models` to start over with new settings.
+    """
+    key = (config.model, config.dtype, config.max_batch_size, config.batch_window_s)
+    with _batchers_lock:
+        engine = _engines.get(key[:2])
+        if engine is None:
+            engine = _engines[key[:2]] = TransformersEngine(config)
+        elif (config.seed, config.num_threads) != (engine.seed, engine.num_threads):
+            # each mismatch is reported once
+            ignored = f"seed={config.seed}, num_threads={config.num_threads}"
+            if ignored not in engine.ignored:
+                engine.ignored.add(ignored)
+                logger.warning("The local model %s is already loaded with seed=%d, num_threads=%s; %s is ignored.",
+                               config.model, engine.seed, engine.num_threads, ignored)
+        batcher = _batchers.get(key)
+        if batcher is None:
+            batcher = _batchers[key] = DynamicBatcher(engine, config.max_batch_size, config.batch_window_s)
+    return batcher
+
+
+def local_model_stats() -> Dict[str, BatcherStats]:
+    """Returns the counters of every batcher, keyed by "<model> (batch <max_batch_size>)"."""
+    with _batchers_lock:
+        batchers = dict(_batchers)
+    return {f"{model} (batch {max_batch_size})": batcher.stats()
+            for (model, _, max_batch_size, _), batcher in batchers.items()}
+
+
+def close_local_models() -> None:
+    """Stops every batcher and drops the loaded weights; models load them again on their next call."""
+    with _batchers_lock:
+        batchers = list(_batchers.values())
+        _batchers.clear()
+        _engines.clear()
+    for batcher in batchers:
+        batcher.close()
+
+
+class LocalModel(BaseAPIModel):
+    """Generates completions with an open-weights model on this machine; `query` blocks until its batch is done.
+
+    Args:
+        config (LocalModelConfig): the model and how its calls are batched.
+        model_config_dict (dict, optional): request parameters, as for `OpenAIModel`.
+        retry_config (RetryConfig, optional): local errors are fatal, so this only matters
+            for the circuit breaker.
+    """
+
+    def __init__(self, config: LocalModelConfig, model_config_dict: Optional[Dict[str, Any]]=None,
+                 retry_config: Optional[RetryConfig]=None):
+        self.config = config
+        self.model_config_dict = model_config_dict or {}
+        self._check_api_keys_validity()
+        self._check_parameters_validity(self.model_config_dict)
+        self.retry_config = retry_config or RetryConfig(initial_backoff=0.0, timeout=None)
+        self.circuit_breaker = CircuitBreaker(self.retry_config)
+        self._setup_client()
+
+    @property
+    def model_name(self) -> str:
+        return self.config.model
+
+    def _setup_client(self) -> None:
+        """Gets the shared batcher, which loads the weights on first use."""
+        self.batcher = get_batcher(self.config)
+
+    def _check_api_keys_validity(self) -> None:
+        """No keys are needed locally."""
+        pass
+
+    def _check_parameters_validity(self, model_config_dict: Dict[str, Any]) -> None:
+        """Checks if the parameters are valid."""
+        unknown = set(model_config_dict) - OPENAI_API_PARAMS
+        if unknown:
+            raise ValueError(f"Unknown request parameters: {sorted(unknown)}")
+        if model_config_dict.get("n", 1) < 1:
+            raise ValueError(f"n must be at least 1, got {model_config_dict['n']}")
+        if model_config_dict.get("temperature", 1) < 0:
+            raise ValueError(f"temperature must be non-negative, got {model_config_dict['temperature']}")
+
+    def _request(self, parameters: Optional[Dict[str, Any]], stream_stop: Optional[Stop]
+                 ) -> Tuple[Tuple, Optional[Stop]]:
+        """The batch parameters (see `BATCH_PARAMS`) and the stop condition of a call."""
+        request = {**self.model_config_dict, **(parameters or {})}
+        params = (int(request.get("max_tokens") or self.config.max_new_tokens),
+                  float(request.get("temperature", 1.0)), float(request.get("top_p", 1.0)), int(request.get("n", 1)))
+        stops = [stream_stop] if stream_stop is not None else []
+        sequences = request.get("stop")
+        if sequences:
+            stops.append(stop_at_sequences([sequences] if isinstance(sequences, str) else sequences))
+        return params, _first_stop(stops)
+
+    def format_response(self, generation: Generation) -> ChatCompletion:
+        """The `ChatCompletion` of a generation, as the API returns it."""
+        return ChatCompletion.model_construct(
+            id=f"local-{time.time_ns():x}",
+            object="chat.completion",
+            created=int(time.time()),
+            model=self.model_name,
+            choices=[Choice.model_construct(index=i, finish_reason=finish_reason,
+                                            message=ChatCompletionMessage.model_construct(role="assistant", content=text))
+                     for i, (text, finish_reason) in enumerate(generation.choices)],
+            usage=CompletionUsage.model_construct(
+                prompt_tokens=generation.prompt_tokens,
+                completion_tokens=generation.completion_tokens,
+                total_tokens=generation.prompt_tokens + generation.completion_tokens,
+            ),
+        )
+
+    def _respond(self, result: Tuple[Generation, int, float], submitted: float) -> ChatCompletion:
+        generation, batch_size, batch_wait_s = result
+        tracing.annotate(api_s=time.perf_counter() - submitted, batch_size=batch_size, batch_wait_s=batch_wait_s)
+        response = self.format_response(generation)
+        tracing.record_usage(response)
+        return response
+
+    def query(self, messages: List[OpenAIMessage], parameters: Optional[Dict[str, Any]]=None,
+              stream_stop: Optional[Stop]=None) -> ChatCompletion:
+        """Blocks until the batch of the call is generated."""
+        with tracing.span("llm.query", model=self.model_name):
+            submitted = time.perf_counter()
+            future = self.batcher.submit(messages, *self._request(parameters, stream_stop))
+            return self._respond(future.result(), submitted)
+
+    def failsafe_query(self, messages: List[OpenAIMessage], parameters: Optional[Dict[str, Any]]=None,
+                       stream_stop: Optional[Stop]=None) -> ChatCompletion:
+        """Retries query in case generation fails with a retryable error."""
+        return retry_call(lambda: self.query(messages, parameters, stream_stop), self.retry_config, self.circuit_breaker)
+
+
+class AsyncLocalModel(LocalModel):
+    """LocalModel whose `query` is a coroutine, so that nodes wait for their batch without a thread each."""
+
+    async def query(self, messages: List[OpenAIMessage], parameters: Optional[Dict[str, Any]]=None,
+                    stream_stop: Optional[Stop]=None) -> ChatCompletion:
+        """Awaits the batch of the call."""
+        with tracing.span("llm.query", model=self.model_name):
+            submitted = time.perf_counter()
+            future = self.batcher.submit(messages, *self._request(parameters, stream_stop))
+            return self._respond(await asyncio.wrap_future(future), submitted)
+
+    async def failsafe_query(self, messages: List[OpenAIMessage], parameters: Optional[Dict[str, Any]]=None,
+                             stream_stop: Optional[Stop]=None) -> ChatCompletion:
+        """Retries query in case generation fails with a retryable error."""
+        return await aretry_call(lambda: self.query(messages, parameters, stream_stop), self.retry_config,
+                                 self.circuit_breaker)
@@ -1,15 +1,21 @@
 from dataclasses import dataclass
+from typing import Any, Dict, TYPE_CHECKING
 from enums import OpenAIBackendRole
 
-from openai.types.chat.chat_completion_message_param import ChatCompletionMessageParam
-from openai.types.chat.chat_completion_system_message_param import ChatCompletionSystemMessageParam
-from openai.types.chat.chat_completion_user_message_param import ChatCompletionUserMessageParam
-from openai.types.chat.chat_completion_assistant_message_param import ChatCompletionAssistantMessageParam
+if TYPE_CHECKING:
+    from openai.types.chat.chat_completion_message_param import ChatCompletionMessageParam
+    from openai.types.chat.chat_completion_system_message_param import ChatCompletionSystemMessageParam
+    from openai.types.chat.chat_completion_user_message_param import ChatCompletionUserMessageParam
+    from openai.types.chat.chat_completion_assistant_message_param import ChatCompletionAssistantMessageParam
 
-OpenAIMessage = ChatCompletionMessageParam
-OpenAISystemMessage = ChatCompletionSystemMessageParam
-OpenAIUserMessage = ChatCompletionUserMessageParam
-OpenAIAssistantMessage = ChatCompletionAssistantMessageParam
+    OpenAIMessage = ChatCompletionMessageParam
+    OpenAISystemMessage = ChatCompletionSystemMessageParam
+    OpenAIUserMessage = ChatCompletionUserMessageParam
+    OpenAIAssistantMessage = ChatCompletionAssistantMessageParam
+else:
+    # the message params are TypedDicts, i.e., plain dicts at runtime; importing them would load
+    # the whole openai SDK into every process that only renders prompts
+    OpenAIMessage = OpenAISystemMessage = OpenAIUserMessage = OpenAIAssistantMessage = Dict[str, Any]
 
 
 @dataclass
@@ -1,38 +1,106 @@
 import asyncio 
+import logging
+import time
+
+import tracing
+
+logger = logging.getLogger(__name__)
 
 class Node:
-    def __init__(self, id, task, send_output_to=[], receive_input_from=[], sim_id=0):
+    __slots__ = ("sim_id", "id", "inputs", "output", "evaluation", "send_output_to", "receive_input_from", "task",
+                 "input_event", "scheduler", "sink", "checkpoint", "released", "timings", "_critical_path_length")
+
+    def __init__(self, id, task, send_output_to=None, receive_input_from=None, sim_id=0, scheduler=None):
         self.sim_id = sim_id
         self.id = id
         self.inputs = []
         self.output = None
         self.evaluation = None
-        self.send_output_to = send_output_to
-        self.receive_input_from = receive_input_from
+        self.send_output_to = [] if send_output_to is None else send_output_to
+        self.receive_input_from = [] if receive_input_from is None else receive_input_from
         self.task = task
         self.input_event = asyncio.Event()
+        # optional scheduler.CallScheduler sharing concurrency between the calls of all nodes
+        self.scheduler = scheduler
+        # optional sink.ResultSink the node's record is written to once it is evaluated
+        self.sink = None
+        # optional checkpoint.Checkpoint every output and evaluation is saved to
+        self.checkpoint = None
+        self.released = False
+        self.timings = {}
+        self._critical_path_length = None
+
+    def critical_path_length(self):
+        """Number of executions on the longest path from this node to the end of its chain."""
+        if self._critical_path_length is None:
+            self._critical_path_length = 1 + max((node.critical_path_length() for node in self.send_output_to), default=0)
+        return self._critical_path_length
 
     async def process(self):
-        self.output = await asyncio.to_thread(self.task.execute, self.inputs)
+        call = lambda: self.task.aexecute(self.inputs, sim_id=self.sim_id, node_id=self.id)
+        start = time.perf_counter()
+        with tracing.span("node.process"):
+            if self.scheduler is None:
+                self.output = await call()
+            else:
+                # nodes with the longest chain ahead of them go first
+                self.output = await self.scheduler.execute(call, priority=self.critical_path_length())
+        self.timings["execute_s"] = time.perf_counter() - start
+        if self.checkpoint is not None:
+            self.checkpoint.save(self)
         self.send_output()
-        print("Processed", self.send_output_to)
+        logger.debug("Processed %s %s -> %s", self.sim_id, self.id, [node.id for node in self.send_output_to])
 
     async def evaluate(self):
-        self.evaluation = await asyncio.to_thread(self.task.evaluate, self.output)
-        print("Evaluated: ", self.sim_id, self.id)
+        call = lambda: self.task.aevaluate(self.output)
+        start = time.perf_counter()
+        with tracing.span("node.evaluate"):
+            if self.scheduler is None or not getattr(self.task, "requires_evaluation", True):
+                self.evaluation = await call()
+            else:
+                self.evaluation = await self.scheduler.evaluate(call)
+        self.timings["evaluate_s"] = time.perf_counter() - start
+        if self.checkpoint is not None:
+            self.checkpoint.save(self)
+        logger.debug("Evaluated %s %s", self.sim_id, self.id)
+
+    async def finish(self):
+        """Evaluates the output if needed and hands the node to its sink."""
+        if self.evaluation is None:
+            await self.evaluate()
+        if self.sink is not None:
+            await self.sink.put(self)
 
     async def start(self):
-        if len(self.inputs) != len(self.receive_input_from):
-            # wait for the inputs to be available
-            await self.input_event.wait()
+        if self.released:
+            return True
 
-        if self.output is None:
-            await self.process()
+        with tracing.span("node", sim_id=self.sim_id, generation=self.id[0], position=self.id[1],
+                          task=type(self.task).__name__):
+            if len(self.inputs) != len(self.receive_input_from):
+                # wait for the inputs to be available
+                start = time.perf_counter()
+                await self.input_event.wait()
+                self.timings["wait_inputs_s"] = time.perf_counter() - start
+                tracing.annotate(wait_inputs_s=self.timings["wait_inputs_s"])
 
-        if self.evaluation is None:
-            await self.evaluate()
+            if self.output is None:
+                await self.process()
+
+            if self.scheduler is not None and self.scheduler.defers_evaluations:
+                # awaited by `scheduler.join`, without holding up this node
+                self.scheduler.defer(self.finish)
+            else:
+                await self.finish()
         return True
 
+    def release(self):
+        """Drops the node's text once it is recorded; downstream nodes already hold the output."""
+        self.inputs = []
+        self.output = None
+        self.evaluation = None
+        self.released = True
+
     def receive_input(self, input):
         self.inputs.append(input)
         if len(self.inputs) == len(self.receive_input_from):
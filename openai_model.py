@@ -1,31 +1,68 @@
+import logging
 import os
-from openai import OpenAI, AzureOpenAI
-from typing import Dict, Any, List, Union, Optional
+import time
+from openai import OpenAI, AzureOpenAI, AsyncOpenAI, AsyncAzureOpenAI
+from openai.types.chat import ChatCompletion
+from typing import Callable, Dict, Any, List, Union, Optional
 from messages import OpenAIMessage
 from base_model import BaseAPIModel
 from enums import OpenAIModelType, AzureOpenAIModelType
-from configs import OpenAIChatConfig
+from configs import HTTPPoolConfig, OpenAIChatConfig, RateLimitConfig, RetryConfig
+from http_pool import get_client
+from rate_limiter import estimate_tokens, get_rate_limiter
+from retry import get_circuit_breaker, retry_call, aretry_call
+from cache import ResponseCache
+from streaming import STREAM_OPTIONS, acollect_stream, collect_stream
+import tracing
+
+logger = logging.getLogger(__name__)
 
 
 class OpenAIModel(BaseAPIModel):
-    
+
+    client_cls = OpenAI
+
     def __init__(self, model_type: Union[OpenAIModelType, AzureOpenAIModelType],
-                  model_config_dict: Dict[str, Any]):
+                  model_config_dict: Dict[str, Any],
+                  rate_limit_config: Optional[RateLimitConfig]=None,
+                  retry_config: Optional[RetryConfig]=None,
+                  cache: Optional[ResponseCache]=None,
+                  http_pool_config: Optional[HTTPPoolConfig]=None):
         self._check_api_keys_validity()
         self._check_parameters_validity(model_config_dict)
 
+        self.http_pool_config = http_pool_config
         self._setup_client()
         self.model_type = model_type
         self.model_config_dict = model_config_dict
 
+        # all models targeting the same deployment share one limiter
+        self.deployment = f"{self.url}/{self.model_type.value}"
+        self.rate_limiter = get_rate_limiter(self.deployment, rate_limit_config)
+        self.retry_config = retry_config or RetryConfig()
+        self.circuit_breaker = get_circuit_breaker(self.deployment, retry_config)
+        self.cache = cache
+
+    def _client_kwargs(self) -> Dict[str, Any]:
+        """Returns the arguments used to construct the client."""
+        self.url = os.getenv("OPENAI_ENDPOINT")
+        self.key = os.getenv("OPENAI_API_KEY")
+        return {"api_key": self.key, "base_url": self.url}
+
     def _setup_client(self) -> None:
-        """Sets up the client to query the API."""
-        self.url = os.getenv("AZURE_OPENAI_ENDPOINT")
-        self.key = os.getenv("OPENAI_ENDPOINT")
-        self.client = OpenAI(
-            api_key=self.key,
-            azure_endpoint=self.url,
-        )
+        """Sets up the arguments of the client borrowed from the endpoint's pool, see `client`."""
+        self._client_args = self._client_kwargs()
+
+    @property
+    def client(self):
+        """The client of the process-wide connection pool of this endpoint and credentials.
+
+        Borrowed on every call, so that all models of the endpoint share keep-alive
+        connections. The pool is sized on first use to `http_pool_config.max_connections`,
+        or else to the deployment's `max_concurrency`.
+        """
+        return get_client(self.client_cls, self._client_args, self.http_pool_config,
+                          self.rate_limiter.config.max_concurrency)
 
     def _check_api_keys_validity(self) -> None:
         """Checks if the URL and token are present."""
@@ -37,53 +74,128 @@ class OpenAIModel(BaseAPIModel):
     def _check_parameters_validity(self, parameters: Dict[str, Any]) -> None:
         """Checks if the parameters are valid."""
         try:
-            OpenAIChatConfig(parameters)
-        except ValueError as e:
-            print("Validation error:", e)
+            OpenAIChatConfig(**parameters)
+        except (TypeError, ValueError) as e:
+            logger.warning("Validation error: %s", e)
 
-    def query(self, messages: List[OpenAIMessage], parameters: Optional[Dict[str, Any]]=None):
-        """Queries the LLM using arguments given.
-        
-        Args:
-            messages (List[OpenAIMessage]): List of messages in the chat history.
-        """
-        
+    def _get_model_config(self, parameters: Optional[Dict[str, Any]]=None) -> Dict[str, Any]:
+        """Returns the model config with `parameters` overriding the defaults for this call."""
         if parameters is not None and len(parameters) != 0:
             self._check_parameters_validity(parameters)
-            model_config = self.model_config_dict.update(parameters)
-        else:
-            model_config = self.model_config_dict
+            return {**self.model_config_dict, **parameters}
+        return self.model_config_dict
 
-        response = self.client.chat.completions.create(
-            messages=messages,
-            model=self.model_type.value,
-            **model_config 
-        )
+    def _estimate_tokens(self, messages: List[OpenAIMessage], model_config: Dict[str, Any]) -> int:
+        """Estimates the tokens charged to the rate limiter for this call."""
+        return estimate_tokens(messages, model_config.get("max_tokens"),
+                               self.rate_limiter.config.default_completion_tokens, model_config.get("n") or 1)
+
+    def _cache_key(self, messages: List[OpenAIMessage], model_config: Dict[str, Any],
+                   stream_stop: Optional[Callable[[str], Optional[int]]]=None) -> str:
+        """Keys the cache on the model type, rendered messages, the config sent to the API and the stop condition."""
+        if stream_stop is not None and model_config.get("stream"):
+            # only a streamed response depends on the stop condition; stop conditions are
+            # frozen dataclasses, whose repr names their parameters
+            model_config = {**model_config, "stream_stop": repr(stream_stop)}
+        return ResponseCache.make_key(self.model_type.value, messages, model_config)
+
+    @staticmethod
+    def _request_options(model_config: Dict[str, Any], timeout: Optional[float]) -> Dict[str, Any]:
+        """Arguments of the API call besides the model config."""
+        request_options = {} if timeout is None else {"timeout": timeout}
+        if model_config.get("stream") and "stream_options" not in model_config:
+            request_options["stream_options"] = STREAM_OPTIONS
+        return request_options
+
+    @staticmethod
+    def _dump_response(response: ChatCompletion) -> str:
+        return response.model_dump_json()
+
+    @staticmethod
+    def _load_response(value: str) -> ChatCompletion:
+        return ChatCompletion.model_validate_json(value)
+
+    def _create(self, messages: List[OpenAIMessage], model_config: Dict[str, Any],
+                timeout: Optional[float]=None, stream_stop: Optional[Callable[[str], Optional[int]]]=None):
+        """Calls the API once, holding a rate limiter slot until the response, or the stream, is complete."""
+        request_options = self._request_options(model_config, timeout)
+
+        start = time.perf_counter()
+        with self.rate_limiter.limit(self._estimate_tokens(messages, model_config)) as lease:
+            sent = time.perf_counter()
+            tracing.annotate(cache_hit=False, rate_limit_wait_s=sent - start)
+            response = self.client.chat.completions.create(
+                messages=messages,
+                model=self.model_type.value,
+                **model_config,
+                **request_options
+            )
+            if model_config.get("stream"):
+                response = collect_stream(response, stream_stop, sent)
+            tracing.annotate(api_s=time.perf_counter() - sent)
+            tracing.record_usage(response)
+            lease.record_usage(response)
 
         return response
 
+    def query(self, messages: List[OpenAIMessage], parameters: Optional[Dict[str, Any]]=None,
+              timeout: Optional[float]=None, stream_stop: Optional[Callable[[str], Optional[int]]]=None):
+        """Queries the LLM using arguments given.
+
+        Args:
+            messages (List[OpenAIMessage]): List of messages in the chat history.
+            parameters (Dict[str, Any], optional): Overrides `model_config_dict` for this call.
+            timeout (float, optional): Timeout of the request in seconds.
+            stream_stop (callable, optional): With `stream=True`, closes the stream once it
+                returns the length of the text to keep, see `streaming.StopAfterLines`.
+        """
+        model_config = self._get_model_config(parameters)
+        with tracing.span("llm.query", model=self.model_type.value, deployment=self.deployment):
+            if self.cache is None:
+                return self._create(messages, model_config, timeout, stream_stop)
+
+            # `_create` resets `cache_hit` on a miss
+            tracing.annotate(cache_hit=True)
+            return self.cache.call(
+                self._cache_key(messages, model_config, stream_stop),
+                lambda: self._create(messages, model_config, timeout, stream_stop),
+                self._dump_response, self._load_response
+            )
+
     def format_response(self, *args: Any, **kwargs: Any):
         """Cleans up response after the API call."""
-        pass 
-
-    def failsafe_query(self, *args: Any, **kwargs: Any):
-        """Retries query in case API fails."""
         pass
 
+    def failsafe_query(self, messages: List[OpenAIMessage], parameters: Optional[Dict[str, Any]]=None,
+                       stream_stop: Optional[Callable[[str], Optional[int]]]=None):
+        """Retries query in case API fails.
+
+        Retryable errors (timeouts, connection errors, 408/409/429/5xx) are retried with
+        jittered exponential backoff, waiting at least as long as the server's `Retry-After`.
+        Fatal errors are raised immediately. While the deployment's circuit is open, attempts
+        wait for it to let a trial call through, and `CircuitOpenError` is raised once the
+        retries are exhausted.
+        """
+        return retry_call(
+            lambda: self.query(messages, parameters, timeout=self.retry_config.timeout, stream_stop=stream_stop),
+            self.retry_config, self.circuit_breaker)
+
 
 class AzureOpenAIModel(OpenAIModel):
     """Initializes OpenAIModel with parameters specific to Azure."""
-    
-    def _setup_client(self):
-        """Sets up the client to query the API."""
+
+    client_cls = AzureOpenAI
+
+    def _client_kwargs(self) -> Dict[str, Any]:
+        """Returns the arguments used to construct the client."""
         self.url = os.getenv("AZURE_OPENAI_ENDPOINT")
         self.key = os.getenv("AZURE_OPENAI_API_KEY")
         api_version = os.getenv("OPENAI_API_VERSION")
-        self.client = AzureOpenAI(
-            api_key = self.key,
-            azure_endpoint = self.url,
-            api_version = api_version
-        )
+        return {
+            "api_key": self.key,
+            "azure_endpoint": self.url,
+            "api_version": api_version
+        }
 
     def _check_api_keys_validity(self):
         """Checks if the URL and token are present."""
@@ -91,3 +203,73 @@ class AzureOpenAIModel(OpenAIModel):
             "AZURE_OPENAI_API_KEY not found in the environment.")
         assert "AZURE_OPENAI_ENDPOINT" in os.environ, KeyError(
             "AZURE_OPENAI_ENDPOINT not found in the environment.")
+
+
+class AsyncOpenAIModel(OpenAIModel):
+    """OpenAIModel whose `query` is a coroutine backed by `AsyncOpenAI`.
+
+    Awaiting `query` does not hold a thread, so the number of requests in flight is
+    only bounded by the caller (e.g., the number of nodes started at once).
+    """
+
+    client_cls = AsyncOpenAI
+
+    async def _create(self, messages: List[OpenAIMessage], model_config: Dict[str, Any],
+                      timeout: Optional[float]=None, stream_stop: Optional[Callable[[str], Optional[int]]]=None):
+        """Calls the API once, holding a rate limiter slot until the response, or the stream, is complete."""
+        request_options = self._request_options(model_config, timeout)
+
+        start = time.perf_counter()
+        async with self.rate_limiter.alimit(self._estimate_tokens(messages, model_config)) as lease:
+            sent = time.perf_counter()
+            tracing.annotate(cache_hit=False, rate_limit_wait_s=sent - start)
+            response = await self.client.chat.completions.create(
+                messages=messages,
+                model=self.model_type.value,
+                **model_config,
+                **request_options
+            )
+            if model_config.get("stream"):
+                response = await acollect_stream(response, stream_stop, sent)
+            tracing.annotate(api_s=time.perf_counter() - sent)
+            tracing.record_usage(response)
+            lease.record_usage(response)
+
+        return response
+
+    async def query(self, messages: List[OpenAIMessage], parameters: Optional[Dict[str, Any]]=None,
+                    timeout: Optional[float]=None, stream_stop: Optional[Callable[[str], Optional[int]]]=None):
+        """Queries the LLM using arguments given.
+
+        Args:
+            messages (List[OpenAIMessage]): List of messages in the chat history.
+            parameters (Dict[str, Any], optional): Overrides `model_config_dict` for this call.
+            timeout (float, optional): Timeout of the request in seconds.
+            stream_stop (callable, optional): With `stream=True`, closes the stream once it
+                returns the length of the text to keep, see `streaming.StopAfterLines`.
+        """
+        model_config = self._get_model_config(parameters)
+        with tracing.span("llm.query", model=self.model_type.value, deployment=self.deployment):
+            if self.cache is None:
+                return await self._create(messages, model_config, timeout, stream_stop)
+
+            # `_create` resets `cache_hit` on a miss
+            tracing.annotate(cache_hit=True)
+            return await self.cache.acall(
+                self._cache_key(messages, model_config, stream_stop),
+                lambda: self._create(messages, model_config, timeout, stream_stop),
+                self._dump_response, self._load_response
+            )
+
+    async def failsafe_query(self, messages: List[OpenAIMessage], parameters: Optional[Dict[str, Any]]=None,
+                             stream_stop: Optional[Callable[[str], Optional[int]]]=None):
+        """Retries query in case API fails. See `OpenAIModel.failsafe_query`."""
+        return await aretry_call(
+            lambda: self.query(messages, parameters, timeout=self.retry_config.timeout, stream_stop=stream_stop),
+            self.retry_config, self.circuit_breaker)
+
+
+class AsyncAzureOpenAIModel(AsyncOpenAIModel, AzureOpenAIModel):
+    """Initializes AsyncOpenAIModel with parameters specific to Azure."""
+
+    client_cls = AsyncAzureOpenAI
@@ -0,0 +1,107 @@
+"""Packs several summaries into one evaluation request and splits the response back per summary."""
+
+import asyncio
+import re
+from typing import Any, List, Optional, Set, Tuple
+
+from rate_limiter import estimate_tokens
+
+LABEL_PATTERN = re.compile(r"^\s*<?\s*SUMMARY_(\d+)\s*>?\s*:?\s*(.*)$")
+
+
+def split_packed_response(text: str, n_summaries: int) -> List[Optional[str]]:
+    """Splits a packed evaluation into one evaluation per summary.
+
+    Lines following a `<SUMMARY_i>` label belong to summary i until the next label.
+    Summaries whose label is missing from the response get `None`.
+    """
+    sections: List[Optional[List[str]]] = [None] * n_summaries
+    current = None
+    for line in text.split("\n"):
+        match = LABEL_PATTERN.match(line)
+        if match is not None:
+            idx = int(match.group(1)) - 1
+            current = idx if 0 <= idx < n_summaries else None
+            if current is not None:
+                sections[current] = sections[current] or []
+                if match.group(2).strip():
+                    sections[current].append(match.group(2))
+            continue
+
+        if current is not None and line.strip():
+            sections[current].append(line)
+
+    return [None if lines is None else "\n".join(lines) for lines in sections]
+
+
+def plan_packs(summaries: List[str], pack_size: int, base_messages: List[Any], token_limit: Optional[int],
+               completion_tokens_per_summary: int) -> List[Tuple[int, int]]:
+    """Splits `summaries` into [start, end) ranges of at most `pack_size` that fit in `token_limit`.
+
+    `base_messages` are the packed messages without any summary; their tokens are paid once per pack.
+    """
+    base_tokens = estimate_tokens(base_messages, 0)
+    packs, start, tokens = [], 0, base_tokens
+    for idx, summary in enumerate(summaries):
+        summary_tokens = estimate_tokens([{"content": f"<SUMMARY_{idx + 1}>: {summary}"}], completion_tokens_per_summary)
+        full = idx - start >= pack_size
+        too_long = token_limit is not None and idx > start and tokens + summary_tokens > token_limit
+        if full or too_long:
+            packs.append((start, idx))
+            start, tokens = idx, base_tokens
+        tokens += summary_tokens
+    if start < len(summaries):
+        packs.append((start, len(summaries)))
+    return packs
+
+
+class EvaluationPacker:
+    """Collects concurrent `aevaluate` calls and sends them as packed requests.
+
+    A pack is sent once `pack_size` summaries are waiting or `window` seconds after the
+    first one arrived, whichever comes first.
+    """
+
+    def __init__(self, task: Any, pack_size: int, window: float=0.05):
+        if pack_size < 1:
+            raise ValueError(f"pack_size must be positive, got {pack_size}")
+        self.task = task
+        self.pack_size = pack_size
+        self.window = window
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # the loop only keeps weak references to tasks, so the packs in flight are held here
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def evaluate(self, summary: str) -> str:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((summary, future))
+        if len(self._pending) >= self.pack_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, []
+        if pending:
+            task = asyncio.ensure_future(self._run(pending))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, pending: List[Tuple[str, asyncio.Future]]) -> None:
+        try:
+            evaluations = await self.task.aevaluate_packed([summary for summary, _ in pending])
+        except Exception as e:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), evaluation in zip(pending, evaluations):
+            if not future.done():
+                future.set_result(evaluation)
@@ -1,46 +1,66 @@
 from dataclasses import dataclass
 from enums import TaskType, OpenAIBackendRole
 from messages import OpenAIMessage
-from typing import Set, List, Any, Optional, Dict
-import re
+from typing import Set, List, Any, Optional, Dict, Tuple
+from string import Formatter
 from abc import ABC
 
 class TaskPromptFactory:
 
     @staticmethod
     def create(task_type: TaskType):
-        if not isinstance(task_type, TaskType):
+        if not isinstance(task_type, (TaskType, str)):
             raise ValueError("Invalid task type.")
 
-        if task_type is TaskType.GENDER_STEREOTYPE_CONSISTENCY:
-            return GenderStereotypeConsistencyTaskPrompt()
-        elif task_type is TaskType.NEGATIVITY:
-            return NegativityTaskPrompt()
-        elif task_type is TaskType.AMBIGUITY:
-            return AmbguityResolutionTaskPrompt()
-        elif task_type is TaskType.SOCIAL:
-            return SocialTaskPrompt()
-        elif task_type is TaskType.THREAT:
-            return ThreatTaskPrompt()
-        elif task_type is TaskType.MULTIPLEBIAS:
-            return MultipleBiasTaskPrompt()
-        else:
-            raise ValueError(f"Task Prompt not recognized: {task_type.name}")
+        # imported here since the registry refers back to this module
+        from registry import prompt_registry
+        return prompt_registry.create(task_type)
 
 
 class TextPrompt:
     
     def __init__(self, string):
         self.str = string 
+        # parsed once: (literal text, name of the field after it or None)
+        self._segments: List[Tuple[str, Optional[str]]] = []
+        # whether every field is a plain `{name}`, which `format` renders without `str.format`
+        self._simple = True
+        for literal, field, spec, conversion in Formatter().parse(string):
+            self._segments.append((literal, field))
+            if field is not None and (spec or conversion or not field.isidentifier()):
+                self._simple = False
+        self._key_words = {field for _, field in self._segments if field is not None}
 
     @property
     def key_words(self) -> Set[str]:
-        return set(re.findall(r'{([^}]*)}', self.str))
+        return self._key_words
     
-    def format(self, **kwargs) -> 'TextPrompt':
-        default_kwargs = {key: '{' + f'{key}' + '}' for key in self.key_words}
-        default_kwargs.update(kwargs)
-        return self.str.format(**kwargs)
+    def format(self, **kwargs) -> str:
+        """Fills in the fields in `kwargs`; the others are kept as `{key}`."""
+        if not self._key_words:
+            return self.str
+        if not self._simple:
+            default_kwargs = {key: '{' + f'{key}' + '}' for key in self.key_words}
+            default_kwargs.update(kwargs)
+            return self.str.format(**default_kwargs)
+        return "".join(
+            literal + ("" if field is None else str(kwargs[field]) if field in kwargs else "{" + field + "}")
+            for literal, field in self._segments
+        )
+
+    def partial(self, **kwargs) -> 'TextPrompt':
+        """The prompt with the fields in `kwargs` rendered in; formatting it later gives the
+        same text as formatting this prompt with all the fields at once."""
+        if not self._simple or not self._key_words & kwargs.keys():
+            return self
+
+        def escape(text):
+            return text.replace("{", "{{").replace("}", "}}")
+
+        return TextPrompt("".join(
+            escape(literal) + ("" if field is None else escape(str(kwargs[field])) if field in kwargs else "{" + field + "}")
+            for literal, field in self._segments
+        ))
 
 @dataclass
 class ChatPrompt:
@@ -59,14 +79,33 @@ class ChatPrompt:
             }
         ]
 
+    def partial(self, **kwargs) -> 'ChatPrompt':
+        return ChatPrompt(system_prompt=self.system_prompt.partial(**kwargs),
+                          user_prompt=self.user_prompt.partial(**kwargs))
+
 
 class TaskPrompt(ABC):
+    """The execution and evaluation prompts of a task.
+
+    Fields that are constant for a task (e.g., the phrases and the original story) are
+    rendered once by `compile`. The messages keep the constant part first (system prompt,
+    then the constant head of the user prompt) and the variable part last, so that the
+    prefix of every request is byte-identical and hits provider-side prompt caching.
+    """
 
     task_system_prompt: TextPrompt
     task_user_prompt: TextPrompt
     eval_system_prompt: TextPrompt
     eval_user_prompt: TextPrompt
 
+    # appended to the evaluation system prompt when several summaries are evaluated in one request
+    packed_eval_instruction = TextPrompt("""
+You will be given several summaries, labelled <SUMMARY_1>, <SUMMARY_2>, and so on, instead of a single <SUMMARY>.
+Evaluate each summary independently of the others, following the instructions above.
+For each summary, in order, output its label alone on a line (e.g., <SUMMARY_1>), followed by your output for that summary.
+Output every label, even when nothing is selected for that summary.
+""")
+
     def __init__(self):
 
         self.execution_prompt = ChatPrompt(
@@ -79,12 +118,56 @@ class TaskPrompt(ABC):
             user_prompt=self.eval_user_prompt
         )
 
+        self.packed_eval_system_prompt = TextPrompt(self.eval_system_prompt.str + "\n" + self.packed_eval_instruction.str)
+
+        # set by `compile`
+        self.static_kwargs: Optional[Dict[str, str]] = None
+        self._compiled: Dict[str, Any] = {}
+
+    def compile(self, **static_kwargs: str) -> None:
+        """Renders the fields that are constant for the task once.
+
+        Later calls that pass no static field, or the same value, only fill in the others;
+        a different value (e.g., a subset of the phrases) renders the full prompt.
+        """
+        self.static_kwargs = static_kwargs
+        self._compiled = {
+            "execution": self.execution_prompt.partial(**static_kwargs),
+            "evaluation": self.evaluation_prompt.partial(**static_kwargs),
+            "packed_evaluation": self.packed_eval_system_prompt.partial(**static_kwargs),
+        }
+
+    def _select(self, name: str, prompt: Any, kwargs: Dict[str, Any]) -> Tuple[Any, Dict[str, Any]]:
+        """The compiled prompt if `kwargs` agrees with the static fields, else `prompt` with all fields."""
+        static = self.static_kwargs
+        if static is None:
+            return prompt, kwargs
+        if all(kwargs[key] == value for key, value in static.items() if key in kwargs):
+            return self._compiled[name], kwargs
+        return prompt, {**static, **kwargs}
 
     def get_execution_messages(self, **kwargs: Optional[Dict[str, str]]) -> List[OpenAIMessage]:
-        return self.execution_prompt.get_messages(**kwargs)
+        prompt, kwargs = self._select("execution", self.execution_prompt, kwargs)
+        return prompt.get_messages(**kwargs)
 
     def get_evaluation_messages(self, **kwargs: Optional[Dict[str, str]]) -> List[OpenAIMessage]:
-        return self.evaluation_prompt.get_messages(**kwargs)
+        prompt, kwargs = self._select("evaluation", self.evaluation_prompt, kwargs)
+        return prompt.get_messages(**kwargs)
+
+    def get_packed_evaluation_messages(self, summaries: List[str], **kwargs: Optional[Dict[str, str]]) -> List[OpenAIMessage]:
+        """Messages evaluating all `summaries` in one request; the phrases are sent once."""
+        system_prompt, kwargs = self._select("packed_evaluation", self.packed_eval_system_prompt, kwargs)
+        user_prompt = "\n\n".join(f"<SUMMARY_{idx + 1}>: {summary}" for idx, summary in enumerate(summaries))
+        return [
+            {
+                "role" : OpenAIBackendRole.SYSTEM.value,
+                "content": system_prompt.format(**kwargs)
+            },
+            {
+                "role": OpenAIBackendRole.USER.value,
+                "content": user_prompt
+            }
+        ]
 
 
 class BaseTelephoneGamePrompt(TaskPrompt):
@@ -0,0 +1,324 @@
+"""Request- and token-rate limiting shared by all models that target the same deployment."""
+
+import asyncio
+import math
+import threading
+import time
+from contextlib import contextmanager, asynccontextmanager
+from dataclasses import dataclass, replace
+from typing import Any, Dict, Iterator, AsyncIterator, List, Optional
+
+from configs import RateLimitConfig
+from retry import get_retry_after
+
+
+def estimate_tokens(messages: List[Dict[str, Any]], max_tokens: Optional[int],
+                    default_completion_tokens: int = 512, n: int = 1) -> int:
+    """Estimates the tokens a request will consume: prompt (~4 chars per token) plus `n` completions."""
+    chars = sum(len(str(message.get("content") or "")) for message in messages)
+    prompt_tokens = math.ceil(chars / 4) + 4 * len(messages)
+    completion_tokens = max_tokens if max_tokens is not None else default_completion_tokens
+    return prompt_tokens + n * completion_tokens
+
+
+class _TokenBucket:
+    """A bucket holding up to `per_minute` units, refilled continuously."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.available = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Returns seconds until `amount` can be consumed (0 if it can be consumed now)."""
+        self._refill(now)
+        # a request larger than the whole budget is let through once the bucket is full
+        amount = min(amount, self.capacity)
+        if self.available >= amount:
+            return 0.0
+        return (amount - self.available) / self.rate
+
+    def consume(self, amount: float) -> None:
+        self.available -= amount
+
+    def refund(self, amount: float) -> None:
+        """Returns `amount` to the bucket; negative values charge it (may go into debt)."""
+        self.available = min(self.capacity, self.available + amount)
+
+
+@dataclass(frozen=True)
+class RateLimiterStats:
+    """A snapshot of the state of a `RateLimiter`."""
+    in_flight: int
+    concurrency_limit: float
+    requests_available: Optional[float]
+    tokens_available: Optional[float]
+    total_requests: int
+    total_rate_limited: int
+    total_latency_spikes: int
+    total_tokens: int
+    mean_latency: Optional[float]
+    paused_for: float
+
+
+class RateLimitLease:
+    """Handed out for each admitted request; reconciles the token estimate with actual usage."""
+
+    def __init__(self, estimated_tokens: int):
+        self.estimated_tokens = estimated_tokens
+        self.actual_tokens: Optional[int] = None
+        self.start = time.monotonic()
+
+    def record_usage(self, response: Any) -> None:
+        """Records `response.usage.total_tokens` if the response carries usage data."""
+        usage = getattr(response, "usage", None)
+        total_tokens = getattr(usage, "total_tokens", None)
+        if total_tokens is not None:
+            self.actual_tokens = total_tokens
+
+
+class RateLimiter:
+    """Enforces requests-per-minute and tokens-per-minute budgets with an AIMD concurrency limit.
+
+    The concurrency limit shrinks multiplicatively on 429s and latency spikes, and grows
+    additively (about `additive_increase` per `limit` successful calls) back to
+    `max_concurrency`. State is guarded by a thread lock so blocking models running
+    in threads and async models on the event loop share the same budget.
+    """
+
+    poll_interval = 0.05
+    ewma_alpha = 0.1
+    warmup_calls = 10
+
+    def __init__(self, config: Optional[RateLimitConfig] = None):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.total_requests = 0
+        self.total_rate_limited = 0
+        self.total_latency_spikes = 0
+        self.total_tokens = 0
+        self._mean_latency: Optional[float] = None
+        self._latency_samples = 0
+        self._last_decrease = 0.0
+        self._paused_until = 0.0
+        self.configure(config or RateLimitConfig())
+
+    def configure(self, config: RateLimitConfig) -> None:
+        """Applies a new config; budgets restart full."""
+        with self._lock:
+            self.config = config
+            self._requests = _TokenBucket(config.requests_per_minute) if config.requests_per_minute else None
+            self._tokens = _TokenBucket(config.tokens_per_minute) if config.tokens_per_minute else None
+            self.concurrency_limit = float(config.max_concurrency) if config.max_concurrency else math.inf
+
+    def _try_acquire(self, tokens: int) -> float:
+        """Admits a request and returns 0, or returns the seconds to wait before retrying."""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+
+            limit = max(self.config.min_concurrency, self.concurrency_limit)
+            if self.in_flight >= (math.floor(limit) if math.isfinite(limit) else limit):
+                return self.poll_interval
+
+            wait = 0.0
+            if self._requests is not None:
+                wait = max(wait, self._requests.wait_time(1, now))
+            if self._tokens is not None:
+                wait = max(wait, self._tokens.wait_time(tokens, now))
+            if wait > 0:
+                return wait
+
+            if self._requests is not None:
+                self._requests.consume(1)
+            if self._tokens is not None:
+                self._tokens.consume(tokens)
+            self.in_flight += 1
+            self.total_requests += 1
+            return 0.0
+
+    def acquire(self, tokens: int) -> RateLimitLease:
+        """Blocks until the request is admitted."""
+        while True:
+            wait = self._try_acquire(tokens)
+            if wait == 0:
+                return RateLimitLease(tokens)
+            time.sleep(wait)
+
+    async def aacquire(self, tokens: int) -> RateLimitLease:
+        """Waits on the event loop until the request is admitted."""
+        while True:
+            wait = self._try_acquire(tokens)
+            if wait == 0:
+                return RateLimitLease(tokens)
+            await asyncio.sleep(wait)
+
+    def release(self, lease: RateLimitLease, rate_limited: bool = False,
+                retry_after: Optional[float] = None, failed: bool = False) -> None:
+        """Releases the slot held by `lease` and adapts the concurrency limit.
+
+        `failed` releases the slot of a call that errored for reasons other than rate
+        limiting; such calls neither grow the limit nor feed the latency average.
+        """
+        with self._lock:
+            now = time.monotonic()
+            latency = now - lease.start
+            in_flight = self.in_flight
+            self.in_flight -= 1
+
+            tokens = lease.actual_tokens if lease.actual_tokens is not None else lease.estimated_tokens
+            self.total_tokens += tokens
+            if self._tokens is not None and lease.actual_tokens is not None:
+                self._tokens.refund(lease.estimated_tokens - lease.actual_tokens)
+
+            if rate_limited:
+                self.total_rate_limited += 1
+                if retry_after is not None:
+                    self._paused_until = max(self._paused_until, now + retry_after)
+                self._decrease(now, in_flight)
+                return
+
+            if failed:
+                return
+
+            spike = (
+                self._mean_latency is not None
+                and self._latency_samples >= self.warmup_calls
+                and latency > self.config.latency_spike_factor * self._mean_latency
+            )
+            if self._mean_latency is None:
+                self._mean_latency = latency
+            else:
+                self._mean_latency += self.ewma_alpha * (latency - self._mean_latency)
+            self._latency_samples += 1
+
+            if spike:
+                self.total_latency_spikes += 1
+                self._decrease(now, in_flight)
+            elif math.isfinite(self.concurrency_limit):
+                ceiling = self.config.max_concurrency or math.inf
+                self.concurrency_limit = min(
+                    ceiling, self.concurrency_limit + self.config.additive_increase / self.concurrency_limit)
+
+    def _decrease(self, now: float, in_flight: int) -> None:
+        """Shrinks the concurrency limit, at most once per mean latency so one burst counts once."""
+        cooldown = self._mean_latency or 0.0
+        if now - self._last_decrease < cooldown:
+            return
+        self._last_decrease = now
+        current = min(self.concurrency_limit, in_flight)
+        self.concurrency_limit = max(
+            float(self.config.min_concurrency), current * self.config.multiplicative_decrease)
+
+    @staticmethod
+    def _is_rate_limit_error(exc: BaseException) -> bool:
+        return getattr(exc, "status_code", None) == 429
+
+    @contextmanager
+    def limit(self, tokens: int) -> Iterator[RateLimitLease]:
+        """Holds a slot for the duration of a blocking call."""
+        lease = self.acquire(tokens)
+        try:
+            yield lease
+        except BaseException as exc:
+            rate_limited = self._is_rate_limit_error(exc)
+            retry_after = None
+            if rate_limited:
+                try:
+                    retry_after = get_retry_after(exc)
+                except Exception:
+                    # a bad header must neither hide the rate limit error nor keep the slot
+                    pass
+            self.release(lease, rate_limited, retry_after, failed=not rate_limited)
+            raise
+        else:
+            self.release(lease)
+
+    @asynccontextmanager
+    async def alimit(self, tokens: int) -> AsyncIterator[RateLimitLease]:
+        """Holds a slot for the duration of an awaited call."""
+        lease = await self.aacquire(tokens)
+        try:
+            yield lease
+        except BaseException as exc:
+            rate_limited = self._is_rate_limit_error(exc)
+            retry_after = None
+            if rate_limited:
+                try:
+                    retry_after = get_retry_after(exc)
+                except Exception:
+                    # a bad header must neither hide the rate limit error nor keep the slot
+                    pass
+            self.release(lease, rate_limited, retry_after, failed=not rate_limited)
+            raise
+        else:
+            self.release(lease)
+
+    def stats(self) -> RateLimiterStats:
+        """Returns a snapshot of the live state of the limiter."""
+        with self._lock:
+            now = time.monotonic()
+            requests_available = tokens_available = None
+            if self._requests is not None:
+                self._requests.wait_time(0, now)
+                requests_available = self._requests.available
+            if self._tokens is not None:
+                self._tokens.wait_time(0, now)
+                tokens_available = self._tokens.available
+            return RateLimiterStats(
+                in_flight=self.in_flight,
+                concurrency_limit=self.concurrency_limit,
+                requests_available=requests_available,
+                tokens_available=tokens_available,
+                total_requests=self.total_requests,
+                total_rate_limited=self.total_rate_limited,
+                total_latency_spikes=self.total_latency_spikes,
+                total_tokens=self.total_tokens,
+                mean_latency=self._mean_latency,
+                paused_for=max(0.0, self._paused_until - now),
+            )
+
+
+def split_rate_limit(config: RateLimitConfig, n_shares: int) -> RateLimitConfig:
+    """`config` with every budget divided among `n_shares` processes, e.g., the workers of
+    `sharding.run_sharded`, so that together they stay within the original budgets."""
+    def share(budget: Optional[int]) -> Optional[int]:
+        return None if budget is None else max(1, budget // n_shares)
+
+    max_concurrency = share(config.max_concurrency)
+    min_concurrency = config.min_concurrency if max_concurrency is None else min(config.min_concurrency, max_concurrency)
+    return replace(config, requests_per_minute=share(config.requests_per_minute),
+                   tokens_per_minute=share(config.tokens_per_minute), max_concurrency=max_concurrency,
+                   min_concurrency=min_concurrency)
+
+
+_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(deployment: str, config: Optional[RateLimitConfig] = None) -> RateLimiter:
+    """Returns the process-wide limiter for `deployment`, creating it on first use.
+
+    Passing a `config` for an existing deployment reconfigures the shared limiter.
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(deployment)
+        if limiter is None:
+            limiter = _limiters[deployment] = RateLimiter(config)
+            return limiter
+    if config is not None and config != limiter.config:
+        limiter.configure(config)
+    return limiter
+
+
+def rate_limiter_stats() -> Dict[str, RateLimiterStats]:
+    """Returns live stats of every limiter, keyed by deployment."""
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {deployment: limiter.stats() for deployment, limiter in limiters.items()}
@@ -0,0 +1,141 @@
+"""Lazy registries of the task classes, prompt classes and model backends.
+
+Entries are `"module:attribute"` strings that are imported on first use, so a process
+only pays for the modules of the tasks and backends it actually creates.
+
+Other packages can add studies without editing this repository, either by calling
+`register` on import or through an entry point in the `llm_transmission_chains.tasks`,
+`llm_transmission_chains.prompts` or `llm_transmission_chains.models` group, e.g.,
+
+    # setup.py of the plugin
+    entry_points={"llm_transmission_chains.tasks": ["my_study = my_plugin.tasks:MyStudyTask"]}
+
+Keys are `TaskType`s or their string values; plugins that do not extend `TaskType`
+register plain strings.
+"""
+
+import importlib
+from enum import Enum
+from typing import Any, Dict, List, Optional, Union
+
+from enums import TaskType
+
+Key = Union[Enum, str]
+ENTRY_POINT_PREFIX = "llm_transmission_chains."
+
+
+def import_object(path: str) -> Any:
+    """Imports `"module:attribute"` (or `"module.attribute"`)."""
+    module_name, sep, attribute = path.partition(":")
+    if not sep:
+        module_name, _, attribute = path.rpartition(".")
+    obj = importlib.import_module(module_name)
+    for name in attribute.split("."):
+        obj = getattr(obj, name)
+    return obj
+
+
+class Registry:
+    """Maps keys to objects that are imported on first lookup.
+
+    Args:
+        kind (str): name of the registry, also the suffix of its entry point group.
+    """
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self._entries: Dict[str, Any] = {}
+        self._resolved: Dict[str, Any] = {}
+        self._plugins_loaded = False
+
+    @staticmethod
+    def _normalize(key: Key) -> str:
+        return key.value if isinstance(key, Enum) else key
+
+    def register(self, key: Key, target: Optional[Any]=None, override: bool=False) -> Any:
+        """Registers `target`, an object or a `"module:attribute"` path, under `key`.
+
+        Without `target`, returns a decorator registering the decorated class.
+        """
+        if target is None:
+            def decorator(cls):
+                self.register(key, cls, override)
+                return cls
+            return decorator
+
+        name = self._normalize(key)
+        if name in self._entries and not override:
+            raise ValueError(f"{name!r} is already registered in the {self.kind} registry.")
+        self._entries[name] = target
+        self._resolved.pop(name, None)
+        return target
+
+    def _load_plugins(self) -> None:
+        """Registers the entry points of the plugin group, once."""
+        self._plugins_loaded = True
+        from importlib.metadata import entry_points
+        for entry_point in entry_points(group=ENTRY_POINT_PREFIX + self.kind):
+            self._entries.setdefault(entry_point.name, entry_point.value)
+
+    def get(self, key: Key) -> Any:
+        """Returns the object registered under `key`, importing it if needed."""
+        name = self._normalize(key)
+        if name in self._resolved:
+            return self._resolved[name]
+
+        if name not in self._entries and not self._plugins_loaded:
+            self._load_plugins()
+        if name not in self._entries:
+            raise ValueError(f"Nothing registered as {name!r} in the {self.kind} registry.")
+
+        target = self._entries[name]
+        obj = import_object(target) if isinstance(target, str) else target
+        self._resolved[name] = obj
+        return obj
+
+    def create(self, key: Key, *args: Any, **kwargs: Any) -> Any:
+        return self.get(key)(*args, **kwargs)
+
+    def keys(self) -> List[str]:
+        if not self._plugins_loaded:
+            self._load_plugins()
+        return list(self._entries)
+
+    def __contains__(self, key: Key) -> bool:
+        return self._normalize(key) in self.keys()
+
+
+task_registry = Registry("tasks")
+task_registry.register(TaskType.GENDER_STEREOTYPE_CONSISTENCY, "tasks:GenderStereotypeConsistencyTask")
+task_registry.register(TaskType.NEGATIVITY, "tasks:NegativityTask")
+task_registry.register(TaskType.AMBIGUITY, "tasks:AmbiguityTask")
+task_registry.register(TaskType.SOCIAL, "tasks:SocialTask")
+task_registry.register(TaskType.THREAT, "tasks:ThreatTask")
+task_registry.register(TaskType.MULTIPLEBIAS, "tasks:MultipleBiasTask")
+
+prompt_registry = Registry("prompts")
+prompt_registry.register(TaskType.GENDER_STEREOTYPE_CONSISTENCY, "prompt_generator:GenderStereotypeConsistencyTaskPrompt")
+prompt_registry.register(TaskType.NEGATIVITY, "prompt_generator:NegativityTaskPrompt")
+prompt_registry.register(TaskType.AMBIGUITY, "prompt_generator:AmbguityResolutionTaskPrompt")
+prompt_registry.register(TaskType.SOCIAL, "prompt_generator:SocialTaskPrompt")
+prompt_registry.register(TaskType.THREAT, "prompt_generator:ThreatTaskPrompt")
+prompt_registry.register(TaskType.MULTIPLEBIAS, "prompt_generator:MultipleBiasTaskPrompt")
+
+model_registry = Registry("models")
+model_registry.register("openai", "openai_model:OpenAIModel")
+model_registry.register("azure", "openai_model:AzureOpenAIModel")
+model_registry.register("async_openai", "openai_model:AsyncOpenAIModel")
+model_registry.register("async_azure", "openai_model:AsyncAzureOpenAIModel")
+model_registry.register("fake", "fake_model:FakeModel")
+model_registry.register("async_fake", "fake_model:AsyncFakeModel")
+model_registry.register("local", "local_model:LocalModel")
+model_registry.register("async_local", "local_model:AsyncLocalModel")
+
+
+def create_task(task_type: Key, *args: Any, **kwargs: Any) -> Any:
+    return task_registry.create(task_type, *args, **kwargs)
+
+
+def create_model(backend: str, *args: Any, **kwargs: Any) -> Any:
+    """Creates a model backend by name, e.g., `create_model("async_azure", AzureOpenAIModelType.GPT_4, {...})`."""
+    return model_registry.create(backend, *args, **kwargs)
@@ -0,0 +1,412 @@
+"""Columnar store of runs, partitioned by task and model, read through memory maps.
+
+A `ResultsStore` keeps three tables, each a directory of Arrow IPC (or Parquet) files
+partitioned Hive-style by task and execution model, with one file per run:
+
+    nodes/task=negativity/model=gpt-4/<run>.arrow      run, study, sim_id, generation, position, text offsets, timings
+    retention/task=negativity/model=gpt-4/<run>.arrow  the phrases each node retains, by annotator (evaluator or human)
+    calls/task=negativity/model=gpt-4/<run>.arrow      the `llm.query` spans of a `tracing.Tracer`
+    texts/task=negativity/model=gpt-4/<run>.utf8       outputs and evaluations, addressed by the offsets in `nodes`
+
+Queries read the files through memory maps and only touch the columns and partitions they
+need: `store.nodes(task="negativity", model="gpt-4", generation=[0, 1])` reads neither the
+other tasks' files nor any text, and an uncompressed Arrow file is used in place, without a
+copy. `store.texts(nodes)` then decodes the outputs of the selected nodes only. Parquet
+files (`format="parquet"`) are smaller but decoded on every read.
+
+`import_study_data` imports the authors' summaries (`study-data/output`) and, for the coded
+studies, the human codings (`study-data/coding`, through the compiled `task_data`).
+
+Example:
+    store = ResultsStore("results/store")
+    store.write_run("negativity-t1", TaskType.NEGATIVITY, load_results("results.jsonl"), "gpt-4",
+                    task=task, tracer=tracer)
+    matrix = store.evaluation_matrix(task, run="negativity-t1")
+    data = matrix.retention_proportions()
+"""
+
+import json
+import os
+import pathlib
+import urllib.parse
+from typing import Any, Dict, Iterable, List, Optional, TYPE_CHECKING, Tuple, Union
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs
+import pyarrow.parquet as pq
+
+from annotations import EvaluationMatrix
+from enums import TaskType
+from tasks import TaskFactory
+from tracing import METRICS
+from utils import read_summaries, read_threat_chains
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+    from tracing import Tracer
+
+STUDY_DATA = pathlib.Path(__file__).resolve().parent / "study-data"
+
+TABLES = ("nodes", "retention", "calls")
+# Hive partitions of every table, in directory order
+PARTITIONS = pa.schema([("task", pa.string()), ("model", pa.string())])
+# format: (`pyarrow.dataset` format, file suffix)
+FORMATS = {"arrow": ("ipc", ".arrow"), "parquet": ("parquet", ".parquet")}
+
+SCHEMAS = {
+    "nodes": pa.schema([
+        ("run", pa.string()), ("study", pa.string()), ("sim_id", pa.int64()), ("generation", pa.int32()),
+        ("position", pa.int32()), ("input_hash", pa.string()),
+        ("output_offset", pa.int64()), ("output_length", pa.int64()),
+        ("evaluation_offset", pa.int64()), ("evaluation_length", pa.int64()),
+        ("execute_s", pa.float64()), ("evaluate_s", pa.float64()), ("finished_at", pa.float64()),
+    ]),
+    "retention": pa.schema([
+        ("run", pa.string()), ("annotator", pa.string()), ("sim_id", pa.int64()), ("generation", pa.int32()),
+        ("position", pa.int32()), ("phrase_id", pa.int32()), ("tone", pa.string()),
+    ]),
+    "calls": pa.schema([
+        ("run", pa.string()), ("sim_id", pa.int64()), ("generation", pa.int32()), ("position", pa.int32()),
+        ("kind", pa.string()), ("query_model", pa.string()), ("start", pa.float64()), ("duration_s", pa.float64()),
+        ("error", pa.string()),
+    ] + [(metric, pa.bool_() if metric == "stopped_early" else pa.float64()) for metric in METRICS]),
+}
+
+# study: (task type, task kwargs, summaries in `study-data/output`)
+STUDY_OUTPUTS = {
+    "stereotype": (TaskType.GENDER_STEREOTYPE_CONSISTENCY, {}, "Stereotype consistency.docx"),
+    "negativity": (TaskType.NEGATIVITY, {}, "Negativity.docx"),
+    # study 2 codes the ambiguous phrases of the same summaries
+    "ambiguity": (TaskType.AMBIGUITY, {}, "Negativity.docx"),
+    "social": (TaskType.SOCIAL, {}, "Social.docx"),
+    "threat-lancer": (TaskType.THREAT, {"study": "lancer"}, "Threat - Lancer.docx"),
+    "threat-flash": (TaskType.THREAT, {"study": "flash"}, "Threat - Flash Ultra Color.docx"),
+    "threat-nutane": (TaskType.THREAT, {"study": "nutane"}, "Threat - Nutane.docx"),
+    "muki": (TaskType.MULTIPLEBIAS, {"study": "Muki"}, "Multiple biases - Muki.docx"),
+    "takatoro": (TaskType.MULTIPLEBIAS, {"study": "TakaToro"}, "Multiple biases - Taka and Toro.docx"),
+}
+
+Records = Union[Iterable[Dict[str, Any]], "pd.DataFrame"]
+
+
+def _text(value: Any) -> Optional[str]:
+    """The stored text of an output or evaluation; a list of lines, e.g. `ThreatTask`'s statements, is joined."""
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    if isinstance(value, (list, tuple)):
+        return "\n".join(str(line) for line in value)
+    return str(value)
+
+
+def _number(value: Any) -> Optional[float]:
+    return None if value is None or value != value else value
+
+
+def _node_id(record: Dict[str, Any]) -> Tuple[int, int]:
+    if "id" in record:
+        return int(record["id"][0]), int(record["id"][1])
+    return int(record["generation"]), int(record.get("position") or 0)
+
+
+def _equals(filter: Optional[ds.Expression], equals: Dict[str, Any]) -> Optional[ds.Expression]:
+    """`filter` and the column == value (or value in list) conditions of `equals`."""
+    for column, value in equals.items():
+        if value is None:
+            continue
+        if isinstance(value, TaskType):
+            value = value.value
+        if isinstance(value, (list, tuple, set)):
+            condition = ds.field(column).isin([v.value if isinstance(v, TaskType) else v for v in value])
+        else:
+            condition = ds.field(column) == value
+        filter = condition if filter is None else filter & condition
+    return filter
+
+
+class ResultsStore:
+    """Writes runs to, and queries them from, the partitioned tables under `root`.
+
+    Args:
+        root (str or Path): directory of the store; created on first write.
+        format (str, optional, default: "arrow"): "arrow" for uncompressed Arrow IPC files,
+            which are read in place through memory maps, or "parquet" for compressed
+            Parquet files. The format of an existing store is kept in `store.json`, and
+            opening it with another raises a `ValueError`.
+    """
+
+    def __init__(self, root: pathlib.Path, format: str="arrow"):
+        if format not in FORMATS:
+            raise ValueError(f"format must be one of {sorted(FORMATS)}, got {format!r}")
+        self.root = pathlib.Path(root)
+        meta_path = self.root / "store.json"
+        if meta_path.exists():
+            stored = json.loads(meta_path.read_text())["format"]
+            if stored != format:
+                raise ValueError(f"The store at {self.root} holds {stored!r} files, not {format!r}.")
+        self.format = format
+        self._dataset_format, self._suffix = FORMATS[format]
+        self._filesystem = pyarrow.fs.LocalFileSystem(use_mmap=True)
+
+    def _partition_dir(self, table: str, task: str, model: str) -> pathlib.Path:
+        quote = lambda value: urllib.parse.quote(value, safe="")
+        return self.root / table / f"task={quote(task)}" / f"model={quote(model)}"
+
+    def _write_table(self, table: str, task: str, model: str, run: str, data: pa.Table) -> None:
+        path = self._partition_dir(table, task, model) / f"{run}{self._suffix}"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # hidden from `dataset` until it is complete
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        if self.format == "arrow":
+            with pa.OSFile(str(tmp_path), "wb") as sink, pa.ipc.new_file(sink, data.schema) as writer:
+                writer.write_table(data)
+        else:
+            pq.write_table(data, str(tmp_path))
+        os.replace(tmp_path, path)
+
+    def _mark(self) -> None:
+        meta_path = self.root / "store.json"
+        if not meta_path.exists():
+            self.root.mkdir(parents=True, exist_ok=True)
+            meta_path.write_text(json.dumps({"format": self.format}))
+
+    def write_run(self, run: str, task_type: Union[TaskType, str], records: Records, model: str,
+                  task: Optional[Any]=None, study: Optional[str]=None, annotator: str="evaluator",
+                  tracer: Optional["Tracer"]=None) -> int:
+        """Writes the nodes of a run and, if given, the retention parsed by `task` and the calls of `tracer`.
+
+        Writing a run again under the same task and model replaces it.
+
+        Args:
+            run (str): name of the run, unique per task and model.
+            task_type (TaskType or str): the task partition.
+            records (iterable of dict or DataFrame): `sink.ResultSink` records (e.g., from
+                `sink.read_records`), or a DataFrame with sim_id, generation, position and
+                output columns (e.g., from `sink.load_results` or `task.aevaluate_many`).
+            model (str): the execution model partition, e.g., "gpt-4".
+            task (BaseTask, optional): parses the evaluations into the retention table, if
+                its task data has phrases.
+            study (str, optional): the study variant, e.g., "lancer".
+            annotator (str, optional, default: "evaluator"): the retention rows' annotator,
+                e.g., the name of the evaluation model.
+            tracer (tracing.Tracer, optional): its `llm.query` spans go to the calls table.
+
+        Returns:
+            The number of nodes written.
+        """
+        task_name = task_type.value if isinstance(task_type, TaskType) else task_type
+        if hasattr(records, "to_dict"):
+            records = records.to_dict("records")
+        records = sorted(records, key=lambda record: (int(record["sim_id"]), _node_id(record)))
+
+        columns: Dict[str, List[Any]] = {name: [] for name in SCHEMAS["nodes"].names}
+        texts, offset = [], 0
+        for record in records:
+            generation, position = _node_id(record)
+            columns["run"].append(run)
+            columns["study"].append(study)
+            columns["sim_id"].append(int(record["sim_id"]))
+            columns["generation"].append(generation)
+            columns["position"].append(position)
+            columns["input_hash"].append(record.get("input_hash"))
+            for field in ("output", "evaluation"):
+                text = _text(record.get(field))
+                data = None if text is None else text.encode("utf-8")
+                columns[f"{field}_offset"].append(None if data is None else offset)
+                columns[f"{field}_length"].append(None if data is None else len(data))
+                if data is not None:
+                    texts.append(data)
+                    offset += len(data)
+            for field in ("execute_s", "evaluate_s", "finished_at"):
+                columns[field].append(_number(record.get(field)))
+
+        self._mark()
+        text_path = self._partition_dir("texts", task_name, model) / f"{run}.utf8"
+        text_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = text_path.with_name(f".{text_path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.writelines(texts)
+        os.replace(tmp_path, text_path)
+        self._write_table("nodes", task_name, model, run, pa.table(columns, schema=SCHEMAS["nodes"]))
+
+        if task is not None and "phrases" in task.task_data:
+            matrix = EvaluationMatrix.from_records(task, [(int(record["sim_id"]), *_node_id(record),
+                                                           _text(record.get("evaluation"))) for record in records])
+            self.write_retention(run, task_type, model, matrix, annotator)
+        if tracer is not None:
+            self.write_calls(run, task_type, model, tracer)
+        return len(records)
+
+    def write_retention(self, run: str, task_type: Union[TaskType, str], model: str, matrix: EvaluationMatrix,
+                        annotator: str) -> int:
+        """Writes the phrases each node of `matrix` retains, with their tone, as the rows of `annotator`.
+
+        Each annotator of a run has its own file, e.g., "human" for `EvaluationMatrix.from_codings`.
+
+        Returns:
+            The number of (node, phrase) rows written.
+        """
+        task_name = task_type.value if isinstance(task_type, TaskType) else task_type
+        presence = matrix.presence.tocoo()
+        nodes = matrix.nodes[presence.col]
+        tones: List[Optional[str]] = [None] * presence.nnz
+        if matrix.tones is not None:
+            codes = np.asarray(matrix.tones.tocsr()[presence.row, presence.col]).ravel()
+            tones = [matrix.tone_levels[code - 1] if code else None for code in codes]
+        data = pa.table({
+            "run": [run] * presence.nnz,
+            "annotator": [annotator] * presence.nnz,
+            "sim_id": nodes[:, 0],
+            "generation": nodes[:, 1].astype(np.int32),
+            "position": nodes[:, 2].astype(np.int32),
+            "phrase_id": matrix.phrase_ids[presence.row].astype(np.int32),
+            "tone": tones,
+        }, schema=SCHEMAS["retention"])
+        self._mark()
+        self._write_table("retention", task_name, model, f"{run}.{annotator}", data)
+        return presence.nnz
+
+    def write_calls(self, run: str, task_type: Union[TaskType, str], model: str, tracer: "Tracer") -> int:
+        """Writes the `llm.query` spans of `tracer`, with their node, kind (execute or evaluate) and metrics.
+
+        Returns:
+            The number of calls written.
+        """
+        task_name = task_type.value if isinstance(task_type, TaskType) else task_type
+        columns: Dict[str, List[Any]] = {name: [] for name in SCHEMAS["calls"].names}
+        for span in tracer.spans:
+            if span.name != "llm.query":
+                continue
+            parent = span.parent.name if span.parent is not None else None
+            columns["run"].append(run)
+            for field in ("sim_id", "generation", "position"):
+                columns[field].append(span.lookup(field))
+            columns["kind"].append({"node.process": "execute", "node.evaluate": "evaluate"}.get(parent))
+            columns["query_model"].append(span.attributes.get("model"))
+            columns["start"].append(span.start_ns / 1e9)
+            columns["duration_s"].append(span.duration_s)
+            columns["error"].append(span.error)
+            for metric in METRICS:
+                columns[metric].append(span.attributes.get(metric))
+        self._mark()
+        self._write_table("calls", task_name, model, run, pa.table(columns, schema=SCHEMAS["calls"]))
+        return len(columns["run"])
+
+    def dataset(self, table: str) -> Optional[ds.Dataset]:
+        """The memory-mapped `pyarrow.dataset` of `table`, with task and model columns; `None` if empty."""
+        if table not in TABLES:
+            raise ValueError(f"table must be one of {TABLES}, got {table!r}")
+        path = self.root / table
+        if not path.exists():
+            return None
+        return ds.dataset(str(path), schema=pa.unify_schemas([SCHEMAS[table], PARTITIONS]),
+                          format=self._dataset_format, filesystem=self._filesystem,
+                          partitioning=ds.partitioning(PARTITIONS, flavor="hive"),
+                          exclude_invalid_files=False, ignore_prefixes=[".", "_"])
+
+    def query(self, table: str, columns: Optional[List[str]]=None, filter: Optional[ds.Expression]=None,
+              **equals: Any) -> pa.Table:
+        """Rows of `table` matching `filter` and `equals`, e.g., `task="negativity", generation=[0, 1]`.
+
+        Conditions on task and model skip the other partitions' files. Only `columns` are read.
+        """
+        dataset = self.dataset(table)
+        if dataset is None:
+            schema = pa.unify_schemas([SCHEMAS[table], PARTITIONS])
+            return schema.empty_table().select(columns) if columns else schema.empty_table()
+        return dataset.to_table(columns=columns, filter=_equals(filter, equals))
+
+    def nodes(self, columns: Optional[List[str]]=None, filter: Optional[ds.Expression]=None, **equals: Any) -> pa.Table:
+        return self.query("nodes", columns, filter, **equals)
+
+    def retention(self, columns: Optional[List[str]]=None, filter: Optional[ds.Expression]=None,
+                  **equals: Any) -> pa.Table:
+        return self.query("retention", columns, filter, **equals)
+
+    def calls(self, columns: Optional[List[str]]=None, filter: Optional[ds.Expression]=None, **equals: Any) -> pa.Table:
+        return self.query("calls", columns, filter, **equals)
+
+    def runs(self) -> pa.Table:
+        """Task, model, run and study of every run, with its number of nodes and chains."""
+        nodes = self.nodes(columns=["task", "model", "run", "study", "sim_id"])
+        runs = nodes.group_by(["task", "model", "run", "study"]).aggregate([("sim_id", "count"),
+                                                                            ("sim_id", "count_distinct")])
+        return runs.rename_columns(["task", "model", "run", "study", "nodes", "chains"])
+
+    def texts(self, nodes: pa.Table, field: str="output") -> List[Optional[str]]:
+        """The `field` ("output" or "evaluation") of each row of `nodes`, read from the memory-mapped text files.
+
+        `nodes` needs the task, model, run, `<field>_offset` and `<field>_length` columns.
+        """
+        buffers: Dict[Tuple[str, str, str], pa.Buffer] = {}
+        texts = []
+        columns = [nodes[name].to_pylist() for name in ("task", "model", "run", f"{field}_offset", f"{field}_length")]
+        for task, model, run, offset, length in zip(*columns):
+            if length is None:
+                texts.append(None)
+                continue
+            key = (task, model, run)
+            if key not in buffers:
+                # the buffer stays valid once the file is closed
+                with pa.memory_map(str(self._partition_dir("texts", task, model) / f"{run}.utf8")) as f:
+                    buffers[key] = f.read_buffer()
+            texts.append(buffers[key].slice(offset, length).to_pybytes().decode("utf-8"))
+        return texts
+
+    def evaluation_matrix(self, task: Any, annotator: str="evaluator", **equals: Any) -> EvaluationMatrix:
+        """The `annotations.EvaluationMatrix` of the nodes of one run that match `equals`.
+
+        Raises:
+            ValueError: if the nodes belong to several runs, whose sim_ids would be merged.
+        """
+        nodes = self.nodes(columns=["task", "model", "run", "sim_id", "generation", "position"], **equals)
+        runs = set(zip(*(nodes[name].to_pylist() for name in ("task", "model", "run"))))
+        if len(runs) > 1:
+            raise ValueError(f"The nodes belong to {len(runs)} runs; select one, e.g., with run=...")
+        retention = self.retention(columns=["sim_id", "generation", "position", "phrase_id", "tone"],
+                                   annotator=annotator, **equals)
+        node_ids = list(zip(*(nodes[name].to_pylist() for name in ("sim_id", "generation", "position"))))
+        annotations: Dict[Tuple[int, int, int], List[Tuple[int, Optional[str]]]] = {node: [] for node in node_ids}
+        for sim_id, generation, position, phrase_id, tone in zip(
+                *(retention[name].to_pylist() for name in ("sim_id", "generation", "position", "phrase_id", "tone"))):
+            annotations.setdefault((sim_id, generation, position), []).append((phrase_id, tone))
+        return EvaluationMatrix._build(task, list(annotations), annotations.values())
+
+
+def import_study_data(store: ResultsStore, studies: Optional[Iterable[str]]=None, model: str="chatgpt",
+                      root: pathlib.Path=STUDY_DATA, n_simulations: int=5) -> Dict[str, int]:
+    """Imports the authors' summaries and human codings as runs named "study-data-<study>".
+
+    The summaries of each study (see `STUDY_OUTPUTS`) become nodes; those of `ThreatTask`
+    hold the statements selected at each generation. The human codings of the coded
+    studies become retention rows with the annotator "human".
+
+    Args:
+        store (ResultsStore): the store written to.
+        studies (iterable of str, optional): keys of `STUDY_OUTPUTS`; all by default.
+        model (str, optional, default: "chatgpt"): the model partition of the runs.
+        root (Path, optional): the `study-data` directory.
+        n_simulations (int, optional, default: 5): chains per output file, see
+            `utils.read_summaries`.
+
+    Returns:
+        The number of nodes imported per study.
+    """
+    imported = {}
+    for study in studies or STUDY_OUTPUTS:
+        task_type, task_kwargs, output_file = STUDY_OUTPUTS[study]
+        task = TaskFactory.create(task_type, None, None, **task_kwargs)
+        path = pathlib.Path(root) / "output" / output_file
+        if task_type == TaskType.THREAT:
+            rows = read_threat_chains(path, len(task.statements) - 1)
+        else:
+            rows = read_summaries(path, n_simulations)
+        records = [{"sim_id": sim_id, "id": [generation, 0], "output": output} for sim_id, generation, output in rows]
+
+        run = f"study-data-{study}"
+        imported[study] = store.write_run(run, task_type, records, model, study=task_kwargs.get("study"))
+        if "codings" in task.task_data:
+            store.write_retention(run, task_type, model, EvaluationMatrix.from_codings(task), "human")
+    return imported
@@ -0,0 +1,245 @@
+"""Retries with exponential backoff and a per-deployment circuit breaker for API calls."""
+
+import asyncio
+import email.utils
+import random
+import sys
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from configs import RetryConfig
+from enums import ErrorClass
+import tracing
+
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling a deployment whose circuit is open.
+
+    `retry_after` is the time left until the circuit lets a trial call through, if known.
+    """
+
+    def __init__(self, message: str, retry_after: Optional[float]=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def classify_error(exc: BaseException) -> ErrorClass:
+    """Sorts an error into retryable (transient) and fatal (retrying cannot help)."""
+    if isinstance(exc, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return ErrorClass.RETRYABLE
+
+    # an openai error can only have been raised if the SDK is loaded; importing it here would
+    # pull the whole SDK into processes that never use it
+    openai = sys.modules.get("openai")
+    if openai is not None and isinstance(exc, openai.APIConnectionError):
+        return ErrorClass.RETRYABLE
+
+    status_code = getattr(exc, "status_code", None)
+    if status_code is not None and (status_code in RETRYABLE_STATUS_CODES or status_code >= 500):
+        return ErrorClass.RETRYABLE
+
+    return ErrorClass.FATAL
+
+
+def get_retry_after(exc: BaseException) -> Optional[float]:
+    """Returns the delay in seconds requested by the server through `Retry-After`, if any."""
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    if not headers:
+        return None
+
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms is not None:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if retry_after is None:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+
+    # HTTP-date format
+    try:
+        retry_date = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    if retry_date is None:
+        return None
+    return max(0.0, retry_date.timestamp() - time.time())
+
+
+def backoff_delay(attempt: int, config: RetryConfig, retry_after: Optional[float]=None) -> float:
+    """Returns the delay before retry `attempt` (0-based): full jitter, floored at `retry_after`."""
+    bound = min(config.max_backoff, config.initial_backoff * config.backoff_multiplier ** attempt)
+    delay = random.uniform(0, bound)
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+class CircuitBreaker:
+    """Fails fast while a deployment is down.
+
+    Closed: calls go through, consecutive retryable failures are counted.
+    Open: after `failure_threshold` such failures, calls raise `CircuitOpenError` for `reset_timeout` seconds.
+    Half-open: afterwards one trial call goes through; its success closes the circuit, its failure reopens it.
+    Rate limiting (429) means the deployment is up, so it does not count as a failure.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, config: Optional[RetryConfig]=None):
+        self.config = config or RetryConfig()
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+
+    def before_call(self) -> bool:
+        """Raises `CircuitOpenError` if the call must not go through; returns whether it is the half-open trial."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return False
+
+            if self.state == self.OPEN:
+                remaining = self._opened_at + self.config.reset_timeout - time.monotonic()
+                if remaining > 0:
+                    raise CircuitOpenError(f"Circuit open, retry in {remaining:.1f}s.", remaining)
+                self.state = self.HALF_OPEN
+
+            if self._trial_in_flight:
+                raise CircuitOpenError("Circuit half-open, waiting on the trial call.")
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_abandoned(self) -> None:
+        """The trial call was cancelled before it succeeded or failed; the next call becomes the trial."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self, exc: BaseException) -> None:
+        with self._lock:
+            self._trial_in_flight = False
+            if classify_error(exc) is ErrorClass.FATAL or getattr(exc, "status_code", None) == 429:
+                if self.state == self.HALF_OPEN:
+                    self.state = self.CLOSED
+                return
+
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.config.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(deployment: str, config: Optional[RetryConfig]=None) -> CircuitBreaker:
+    """Returns the process-wide circuit breaker for `deployment`, creating it on first use."""
+    with _breakers_lock:
+        breaker = _breakers.get(deployment)
+        if breaker is None:
+            breaker = _breakers[deployment] = CircuitBreaker(config)
+        elif config is not None:
+            breaker.config = config
+        return breaker
+
+
+def retry_call(fn: Callable[[], Any], config: RetryConfig, breaker: Optional[CircuitBreaker]=None) -> Any:
+    """Calls `fn` until it succeeds, a fatal error is raised or retries are exhausted."""
+    attempt = 0
+    while True:
+        trial = False
+        if breaker is not None:
+            try:
+                trial = breaker.before_call()
+            except CircuitOpenError as exc:
+                # a short outage costs a retry, waiting until the circuit lets a trial through
+                if attempt >= config.max_retries:
+                    raise
+                delay = backoff_delay(attempt, config, exc.retry_after)
+                tracing.add("retries", 1)
+                tracing.add("retry_wait_s", delay)
+                time.sleep(delay)
+                attempt += 1
+                continue
+        try:
+            result = fn()
+        except Exception as exc:
+            if breaker is not None:
+                breaker.record_failure(exc)
+            if classify_error(exc) is ErrorClass.FATAL or attempt >= config.max_retries:
+                raise
+            delay = backoff_delay(attempt, config, get_retry_after(exc))
+            tracing.add("retries", 1)
+            tracing.add("retry_wait_s", delay)
+            time.sleep(delay)
+            attempt += 1
+        except BaseException:
+            # cancelled, e.g. by a shutting down run; without this a half-open circuit stays shut
+            if trial:
+                breaker.record_abandoned()
+            raise
+        else:
+            if breaker is not None:
+                breaker.record_success()
+            return result
+
+
+async def aretry_call(fn: Callable[[], Awaitable[Any]], config: RetryConfig,
+                      breaker: Optional[CircuitBreaker]=None) -> Any:
+    """Awaits `fn()` until it succeeds, a fatal error is raised or retries are exhausted."""
+    attempt = 0
+    while True:
+        trial = False
+        if breaker is not None:
+            try:
+                trial = breaker.before_call()
+            except CircuitOpenError as exc:
+                # a short outage costs a retry, waiting until the circuit lets a trial through
+                if attempt >= config.max_retries:
+                    raise
+                delay = backoff_delay(attempt, config, exc.retry_after)
+                tracing.add("retries", 1)
+                tracing.add("retry_wait_s", delay)
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+        try:
+            result = await fn()
+        except Exception as exc:
+            if breaker is not None:
+                breaker.record_failure(exc)
+            if classify_error(exc) is ErrorClass.FATAL or attempt >= config.max_retries:
+                raise
+            delay = backoff_delay(attempt, config, get_retry_after(exc))
+            tracing.add("retries", 1)
+            tracing.add("retry_wait_s", delay)
+            await asyncio.sleep(delay)
+            attempt += 1
+        except BaseException:
+            # cancelled, e.g. by a shutting down run; without this a half-open circuit stays shut
+            if trial:
+                breaker.record_abandoned()
+            raise
+        else:
+            if breaker is not None:
+                breaker.record_success()
+            return result
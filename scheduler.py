@@ -0,0 +1,172 @@
+"""Schedules the execution and evaluation calls of transmission chains.
+
+Nothing downstream depends on an evaluation, while every execution gates the next
+generation of its chain. `CallScheduler` therefore keeps one queue per kind of call, with
+its own budget, and hands free slots to executions first, longest remaining chain first.
+Evaluations fill the spare capacity or are deferred until the chains are generated.
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from configs import SchedulerConfig
+from enums import EvaluationPolicy
+import tracing
+
+EXECUTE = "execute"
+EVALUATE = "evaluate"
+
+
+class CallScheduler:
+    """Grants concurrency slots to execution and evaluation calls.
+
+    Args:
+        config (SchedulerConfig, optional): budgets and evaluation policy.
+
+    Example:
+        scheduler = CallScheduler(SchedulerConfig(max_concurrency=32))
+        simulations = [setup_transmission_chain(connections, Node, task, idx) for idx in range(100)]
+        await run_simulations(simulations, scheduler)
+    """
+
+    def __init__(self, config: Optional[SchedulerConfig]=None):
+        self.config = config or SchedulerConfig()
+        self.max_concurrency = self.config.max_concurrency
+        self.limits = {
+            EXECUTE: self.config.max_execute or self.max_concurrency,
+            EVALUATE: self.config.max_evaluate or self.max_concurrency,
+        }
+        self.policy = self.config.evaluation_policy
+
+        self._queues: Dict[str, List[Any]] = {EXECUTE: [], EVALUATE: []}
+        self._running = {EXECUTE: 0, EVALUATE: 0}
+        self._completed = {EXECUTE: 0, EVALUATE: 0}
+        self._seq = itertools.count()
+        self._released = self.policy is not EvaluationPolicy.DEFERRED
+        self._deferred: List[asyncio.Future] = []
+
+    @property
+    def defers_evaluations(self) -> bool:
+        """Whether evaluations are held until `release_evaluations`."""
+        return not self._released
+
+    def _has_waiting(self, kind: str) -> bool:
+        queue = self._queues[kind]
+        while queue and queue[0][-1].done():
+            heapq.heappop(queue) # cancelled while waiting
+        return bool(queue)
+
+    def _can_start(self, kind: str) -> bool:
+        if sum(self._running.values()) >= self.max_concurrency or self._running[kind] >= self.limits[kind]:
+            return False
+        if kind == EVALUATE:
+            return self._released
+        return True
+
+    def _execution_startable(self) -> bool:
+        """Whether a waiting execution could take a free slot; only then does it block evaluations."""
+        return self._has_waiting(EXECUTE) and self._can_start(EXECUTE)
+
+    def _next_kind(self) -> Optional[str]:
+        """The kind of call that gets the next free slot, if any."""
+        execute = self._execution_startable()
+        evaluate = self._has_waiting(EVALUATE) and self._can_start(EVALUATE)
+        if execute and evaluate and self.policy is EvaluationPolicy.FIFO:
+            # arrival order across both queues
+            return EXECUTE if self._queues[EXECUTE][0][1] < self._queues[EVALUATE][0][1] else EVALUATE
+        if execute:
+            return EXECUTE
+        # executions held back by their own budget leave the slot to evaluations
+        if evaluate:
+            return EVALUATE
+        return None
+
+    def _dispatch(self) -> None:
+        while True:
+            kind = self._next_kind()
+            if kind is None:
+                return
+            future = heapq.heappop(self._queues[kind])[-1]
+            self._running[kind] += 1
+            future.set_result(None)
+
+    async def _acquire(self, kind: str, priority: float) -> None:
+        # FIFO ignores priorities so that it reproduces the unscheduled order
+        key = 0.0 if self.policy is EvaluationPolicy.FIFO else -priority
+        if not self._has_waiting(kind) and self._can_start(kind) and \
+                (kind == EXECUTE or self.policy is EvaluationPolicy.FIFO or not self._execution_startable()):
+            self._running[kind] += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queues[kind], (key, next(self._seq), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release(kind) # the slot was granted before the cancellation
+            else:
+                future.cancel()
+            raise
+
+    def _release(self, kind: str) -> None:
+        self._running[kind] -= 1
+        self._completed[kind] += 1
+        self._dispatch()
+
+    async def run(self, kind: str, call: Callable[[], Awaitable[Any]], priority: float=0.0) -> Any:
+        """Awaits a slot for `kind`, then awaits `call()`. Higher `priority` goes first within a kind."""
+        start = time.perf_counter()
+        await self._acquire(kind, priority)
+        tracing.annotate(queue_wait_s=time.perf_counter() - start)
+        try:
+            return await call()
+        finally:
+            self._release(kind)
+
+    async def execute(self, call: Callable[[], Awaitable[Any]], priority: float=0.0) -> Any:
+        return await self.run(EXECUTE, call, priority)
+
+    async def evaluate(self, call: Callable[[], Awaitable[Any]], priority: float=0.0) -> Any:
+        return await self.run(EVALUATE, call, priority)
+
+    def defer(self, call: Callable[[], Awaitable[Any]]) -> asyncio.Future:
+        """Starts `call()`, e.g., `Node.evaluate` (which awaits `evaluate`), without waiting for it; see `join`."""
+        future = asyncio.ensure_future(call())
+        self._deferred.append(future)
+        return future
+
+    def release_evaluations(self) -> None:
+        """Lets held evaluations start (DEFERRED policy); later evaluations are not held."""
+        self._released = True
+        self._dispatch()
+
+    async def join(self, return_exceptions: bool=False) -> List[Any]:
+        """Releases and awaits the deferred evaluations, raising the first error unless `return_exceptions`."""
+        self.release_evaluations()
+        deferred, self._deferred = self._deferred, []
+        return await asyncio.gather(*deferred, return_exceptions=return_exceptions)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {
+            kind: {"running": self._running[kind], "queued": len(self._queues[kind]),
+                   "completed": self._completed[kind]}
+            for kind in (EXECUTE, EVALUATE)
+        }
+
+
+async def run_simulations(simulations: List[List[List[Any]]], scheduler: Optional[CallScheduler]=None) -> None:
+    """Runs every node of `simulations` (from `utils.setup_transmission_chain`) through `scheduler`.
+
+    With the DEFERRED policy, evaluations start once every chain is generated.
+    """
+    scheduler = scheduler or CallScheduler()
+    nodes = [node for all_nodes in simulations for generation in all_nodes for node in generation]
+    for node in nodes:
+        node.scheduler = scheduler
+
+    await asyncio.gather(*[node.start() for node in nodes])
+    await scheduler.join()
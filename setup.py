@@ -1,10 +1,16 @@
 #!/usr/bin/env python
 
-from distutils.core import setup
+from setuptools import setup
 
 setup(name='llm_models',
       version='1.0',
       description='LLM Evolution',
       py_modules=['enums', 'configs', 'analysis', 'prompt_generator', 
-                  'base_model', 'openai_model', 'utils', 'messages', 'node']
-     )
\ No newline at end of file
+                  'base_model', 'openai_model', 'utils', 'messages', 'node',
+                  'rate_limiter', 'retry', 'cache', 'fake_model', 'batch', 'packing',
+                  'tasks', 'task_data', 'registry', 'scheduler',
+                  'sink', 'checkpoint', 'graph', 'cascade', 'annotations', 'tracing', 'fanout', 'sharding', 'http_pool', 'streaming',
+                  'sweep', 'results_store', 'local_model'],
+      entry_points={'console_scripts': ['llm-sweep = sweep:main']},
+      extras_require={'yaml': ['pyyaml'], 'store': ['pyarrow'], 'local': ['torch', 'transformers']}
+     )
@@ -0,0 +1,325 @@
+"""Runs the simulations of one run in a pool of worker processes, on one host or on several.
+
+In a single process, the CPU work of a run (prompt rendering, response parsing, local
+evaluation) shares one event loop with its I/O. `run_sharded` splits the simulations into
+shards of `ShardConfig.shard_size` and hands them out to worker processes through a work
+queue. Each worker builds its own task, from the compiled task data, and its own model
+clients from `ModelSpec`s. It runs its shards with `sink.run_streaming` and writes their
+nodes to its own part file. The parts are then merged into one file of `sink.ResultSink`
+records, which `sink.load_results` reads. The budgets of the models' rate limiters are
+divided among the workers, so that the limits hold for the whole run.
+
+With `ShardConfig.queue_path`, the work queue is a SQLite file on a filesystem shared by
+several hosts, and `run_sharded` is started on each of them with the same arguments. The
+last host to finish merges the parts:
+
+    config = ShardConfig(n_workers=8, total_workers=32, queue_path="/shared/queue.sqlite")
+    run_sharded(TaskType.NEGATIVITY, connections, 100000, "/shared/negativity.jsonl",
+                ModelSpec("async_azure", (AzureOpenAIModelType.GPT_4, {})), config=config)
+
+Workers are started with the "spawn" method, so scripts calling `run_sharded` need an
+`if __name__ == "__main__":` guard, and `configure_task` must be a module-level function.
+"""
+
+import asyncio
+import json
+import multiprocessing
+import os
+import pathlib
+import socket
+import sqlite3
+import threading
+import time
+from bisect import bisect_right
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from configs import ModelSpec, ShardConfig
+from enums import TaskType
+from node import Node
+from rate_limiter import split_rate_limit
+from registry import create_model
+from scheduler import CallScheduler
+from sink import ResultSink, read_records, run_streaming
+from tasks import TaskFactory
+from utils import setup_transmission_chain
+
+# [start, stop) range of sim_ids
+Shard = Tuple[int, int]
+
+
+def make_shards(n_simulations: int, shard_size: int) -> List[Shard]:
+    return [(start, min(start + shard_size, n_simulations)) for start in range(0, n_simulations, shard_size)]
+
+
+class LocalWorkQueue:
+    """Hands out shards to the worker processes of one host through a `multiprocessing` queue.
+
+    Args:
+        shards (list): the shards of the run.
+        n_consumers (int): loops that claim shards until they get `None`.
+        context: the `multiprocessing` context the workers are started with.
+    """
+
+    def __init__(self, shards: List[Shard], n_consumers: int, context: Any):
+        self._queue = context.Queue()
+        for shard in shards:
+            self._queue.put(shard)
+        for _ in range(n_consumers):
+            self._queue.put(None)
+
+    def claim(self, worker: str) -> Optional[Shard]:
+        return self._queue.get()
+
+    def complete(self, shard: Shard, worker: str) -> None:
+        pass
+
+
+class SQLiteWorkQueue:
+    """Hands out shards to workers on several hosts through a SQLite file.
+
+    The file can live on a shared filesystem if it supports the file locks SQLite relies
+    on (e.g., NFSv4 with locking enabled). Leases compare wall clocks, which should
+    therefore be synchronised across hosts.
+
+    Args:
+        path (str or Path): SQLite file holding the shards of all runs.
+        run_id (str): identifies the run in the file.
+        lease_timeout (float, optional): seconds after which a claimed shard that was not
+            completed is handed out again; `None` never does.
+    """
+
+    def __init__(self, path: pathlib.Path, run_id: str, lease_timeout: Optional[float]=None):
+        self.path = pathlib.Path(path)
+        self.run_id = run_id
+        self.lease_timeout = lease_timeout
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # each process opens its own connection
+        return {"path": self.path, "run_id": self.run_id, "lease_timeout": self.lease_timeout}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__init__(**state)
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # rollback journal rather than WAL, which needs shared memory and fails on network filesystems
+            self._conn = sqlite3.connect(str(self.path), timeout=60, check_same_thread=False, isolation_level=None)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS shards ("
+                "run_id TEXT NOT NULL, start INTEGER NOT NULL, stop INTEGER NOT NULL, worker TEXT, "
+                "claimed_at REAL, completed_at REAL, PRIMARY KEY (run_id, start))"
+            )
+        return self._conn
+
+    def enqueue(self, shards: Iterable[Shard]) -> None:
+        """Adds the shards of the run; shards already in the file are left as they are."""
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.executemany("INSERT OR IGNORE INTO shards (run_id, start, stop) VALUES (?, ?, ?)",
+                                  [(self.run_id, start, stop) for start, stop in shards])
+            self.conn.execute("COMMIT")
+
+    def claim(self, worker: str) -> Optional[Shard]:
+        """The next shard that is neither completed nor claimed (within the lease), or `None`."""
+        now = time.time()
+        expired = -1.0 if self.lease_timeout is None else now - self.lease_timeout
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute(
+                    "SELECT start, stop FROM shards WHERE run_id = ? AND completed_at IS NULL "
+                    "AND (claimed_at IS NULL OR claimed_at < ?) ORDER BY start LIMIT 1",
+                    (self.run_id, expired)
+                ).fetchone()
+                if row is not None:
+                    self.conn.execute("UPDATE shards SET worker = ?, claimed_at = ? WHERE run_id = ? AND start = ?",
+                                      (worker, now, self.run_id, row[0]))
+            finally:
+                self.conn.execute("COMMIT")
+        return None if row is None else (row[0], row[1])
+
+    def complete(self, shard: Shard, worker: str) -> None:
+        """Marks `shard` as completed, unless it was handed out to another worker meanwhile."""
+        with self._lock:
+            self.conn.execute("UPDATE shards SET completed_at = ? WHERE run_id = ? AND start = ? AND worker = ?",
+                              (time.time(), self.run_id, shard[0], worker))
+
+    def done(self) -> bool:
+        with self._lock:
+            remaining = self.conn.execute("SELECT COUNT(*) FROM shards WHERE run_id = ? AND completed_at IS NULL",
+                                          (self.run_id,)).fetchone()[0]
+        return remaining == 0
+
+    def owners(self) -> Dict[str, List[Shard]]:
+        """The completed shards of each worker."""
+        with self._lock:
+            rows = self.conn.execute("SELECT worker, start, stop FROM shards WHERE run_id = ? AND completed_at IS NOT NULL",
+                                     (self.run_id,)).fetchall()
+        owners: Dict[str, List[Shard]] = {}
+        for worker, start, stop in rows:
+            owners.setdefault(worker, []).append((start, stop))
+        return owners
+
+
+def merge_parts(parts: Iterable[pathlib.Path], output_path: pathlib.Path,
+                owners: Optional[Dict[str, List[Shard]]]=None) -> int:
+    """Writes the records of the part files of a run to `output_path`, replacing it.
+
+    With `owners` (see `SQLiteWorkQueue.owners`), a part only contributes the simulations of
+    the shards its worker completed, which drops the partial results of a shard that was
+    handed out again.
+
+    Returns:
+        The number of records written.
+    """
+    output_path = pathlib.Path(output_path)
+    tmp_path = output_path.with_name(f"{output_path.name}.{os.getpid()}.tmp")
+    written = 0
+    with open(tmp_path, "w") as f:
+        for part in sorted(parts):
+            shards = None
+            if owners is not None:
+                shards = sorted(owners.get(part.stem, []))
+                if not shards:
+                    continue
+                starts = [start for start, _ in shards]
+            for record in read_records(part):
+                if shards is not None:
+                    idx = bisect_right(starts, record["sim_id"]) - 1
+                    if idx < 0 or record["sim_id"] >= shards[idx][1]:
+                        continue
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                written += 1
+    os.replace(tmp_path, output_path)
+    return written
+
+
+@dataclass(frozen=True)
+class _Run:
+    """What a worker needs to build its task and run its shards."""
+    task_type: Any
+    task_kwargs: Dict[str, Any]
+    connections: List[List[List[int]]]
+    NODE_CLS: Any
+    execute_model: Optional[ModelSpec]
+    evaluate_model: Optional[ModelSpec]
+    configure_task: Optional[Callable[[Any], None]]
+    config: ShardConfig
+    total_workers: int
+
+
+def _create_model(spec: Optional[ModelSpec]) -> Any:
+    return None if spec is None else create_model(spec.backend, *spec.args, **spec.kwargs)
+
+
+def _build_task(run: _Run) -> Any:
+    task = TaskFactory.create(run.task_type, _create_model(run.execute_model), _create_model(run.evaluate_model),
+                              **run.task_kwargs)
+    # models of the same deployment share a limiter, which is split once
+    limiters = {}
+    for model in (task.llm_model_execute, task.llm_model_evaluate):
+        limiter = getattr(model, "rate_limiter", None)
+        if limiter is not None:
+            limiters[id(limiter)] = limiter
+    for limiter in limiters.values():
+        limiter.configure(split_rate_limit(limiter.config, run.total_workers))
+    if run.configure_task is not None:
+        run.configure_task(task)
+    return task
+
+
+async def _run_worker(worker: str, queue: Any, part_path: pathlib.Path, run: _Run) -> None:
+    task = _build_task(run)
+    scheduler = CallScheduler(run.config.scheduler)
+
+    def build_simulation(sim_id):
+        return setup_transmission_chain(run.connections, run.NODE_CLS, task, sim_id)
+
+    async with ResultSink(part_path) as sink:
+        async def process_shards():
+            while True:
+                shard = await asyncio.to_thread(queue.claim, worker)
+                if shard is None:
+                    return
+                await run_streaming(build_simulation, range(*shard), sink, run.config.shard_size, scheduler)
+                # the shard only counts as completed once its records are on disk
+                await sink.drain()
+                await asyncio.to_thread(queue.complete, shard, worker)
+
+        await asyncio.gather(*[process_shards() for _ in range(run.config.shards_per_worker)])
+
+
+def _worker_main(queue: Any, parts_dir: pathlib.Path, run: _Run) -> None:
+    worker = f"{socket.gethostname()}-{os.getpid()}"
+    asyncio.run(_run_worker(worker, queue, parts_dir / f"{worker}.jsonl", run))
+
+
+def run_sharded(task_type: TaskType, connections: List[List[List[int]]], n_simulations: int,
+                output_path: pathlib.Path, execute_model: Optional[ModelSpec],
+                evaluate_model: Optional[ModelSpec]=None, task_kwargs: Optional[Dict[str, Any]]=None,
+                config: Optional[ShardConfig]=None, NODE_CLS: Any=Node,
+                configure_task: Optional[Callable[[Any], None]]=None, run_id: Optional[str]=None) -> Optional[int]:
+    """Runs `n_simulations` chains of `connections` in worker processes and merges their results.
+
+    Args:
+        task_type (TaskType): the task, created in each worker with `task_kwargs`.
+        connections (list): see `utils.setup_transmission_chain`.
+        n_simulations (int): simulations of the run, with sim_ids 0 to `n_simulations - 1`.
+        output_path (str or Path): merged JSONL results; part files are kept in `<output_path>.parts`.
+        execute_model (ModelSpec): the execution model of each worker.
+        evaluate_model (ModelSpec, optional): the evaluation model of each worker.
+        task_kwargs (dict, optional): e.g., {"study": "Muki"}.
+        config (ShardConfig, optional): workers, shards and work queue.
+        NODE_CLS (type, optional, default: Node): the nodes of the chains.
+        configure_task (callable, optional): called with the task of each worker, e.g., to
+            enable `set_evaluation_cascade`; must be a module-level function.
+        run_id (str, optional): identifies the run in a SQLite work queue; defaults to the
+            stem of `output_path`.
+
+    Returns:
+        The number of merged records, or `None` if other hosts are still running shards of
+        the run (the last one merges).
+    """
+    config = config or ShardConfig()
+    task_kwargs = task_kwargs or {}
+    n_workers = config.n_workers or os.cpu_count() or 1
+    output_path = pathlib.Path(output_path)
+    parts_dir = output_path.with_name(f"{output_path.name}.parts")
+    parts_dir.mkdir(parents=True, exist_ok=True)
+
+    # compiles the task data artifact once, before the workers load it
+    TaskFactory.create(task_type, None, None, **task_kwargs).task_data
+
+    context = multiprocessing.get_context("spawn")
+    shards = make_shards(n_simulations, config.shard_size)
+    if config.queue_path is None:
+        for part in parts_dir.glob("*.jsonl"):
+            part.unlink()
+        queue = LocalWorkQueue(shards, n_workers * config.shards_per_worker, context)
+    else:
+        queue = SQLiteWorkQueue(config.queue_path, run_id or output_path.stem, config.lease_timeout)
+        queue.enqueue(shards)
+
+    run = _Run(task_type, task_kwargs, connections, NODE_CLS, execute_model, evaluate_model, configure_task,
+               config, config.total_workers or n_workers)
+    processes = [context.Process(target=_worker_main, args=(queue, parts_dir, run), name=f"shard-worker-{idx}")
+                 for idx in range(n_workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    failed = [process.exitcode for process in processes if process.exitcode != 0]
+    if failed:
+        raise RuntimeError(f"{len(failed)} of {n_workers} workers failed with exit codes {failed}; "
+                           f"their part files are kept in {parts_dir}.")
+    if config.queue_path is None:
+        return merge_parts(parts_dir.glob("*.jsonl"), output_path)
+    if not queue.done():
+        return None
+    return merge_parts(parts_dir.glob("*.jsonl"), output_path, queue.owners())
@@ -0,0 +1,181 @@
+"""Streams node results to disk while a run is in progress.
+
+Nodes hand themselves to a `ResultSink` once they are evaluated. The sink turns each node
+into a record, releases the node's text and appends the record to a JSONL file from a
+background writer, so the memory of a run does not grow with the number of chains and
+completed results survive a crash.
+"""
+
+import asyncio
+import hashlib
+import json
+import pathlib
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+def input_hash(inputs: List[Any]) -> str:
+    """Short hash identifying the inputs a node was executed on."""
+    return hashlib.sha256(json.dumps(inputs, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+
+def node_record(node: Any) -> Dict[str, Any]:
+    return {
+        "sim_id": node.sim_id,
+        "id": list(node.id),
+        "input_hash": input_hash(node.inputs),
+        "output": node.output,
+        "evaluation": node.evaluation,
+        "execute_s": node.timings.get("execute_s"),
+        "evaluate_s": node.timings.get("evaluate_s"),
+        "finished_at": time.time(),
+    }
+
+
+class ResultSink:
+    """Appends node records to a JSONL file through a bounded queue.
+
+    Args:
+        path (str or Path): JSONL file; records are appended to existing content.
+        max_queue (int, optional, default: 1000): records waiting to be written. Nodes
+            block in `put` when the writer falls behind, so the memory of a run is bounded
+            by `max_queue` records plus the simulations in flight.
+        release_text (bool, optional, default: True): release the text of a node
+            (`Node.release`) once its record is queued.
+        flush_every (int, optional, default: 100): records between flushes of the file.
+
+    Example:
+        async with ResultSink("results.jsonl") as sink:
+            await run_streaming(lambda idx: setup_transmission_chain(connections, Node, task, idx), 10000, sink)
+    """
+
+    def __init__(self, path: pathlib.Path, max_queue: int=1000, release_text: bool=True, flush_every: int=100):
+        self.path = pathlib.Path(path)
+        self.max_queue = max_queue
+        self.release_text = release_text
+        self.flush_every = flush_every
+        self.written = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._writer: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._queue = asyncio.Queue(self.max_queue)
+        self._writer = asyncio.ensure_future(self._write())
+
+    async def _write(self) -> None:
+        with open(self.path, "a") as f:
+            while True:
+                record = await self._queue.get()
+                if record is None:
+                    break
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                self.written += 1
+                if self.written % self.flush_every == 0 or self._queue.empty():
+                    f.flush()
+                self._queue.task_done()
+
+    async def put(self, node: Any) -> None:
+        """Queues the record of `node`, waiting while the queue is full."""
+        record = node_record(node)
+        if self.release_text:
+            node.release()
+        await self.put_record(record)
+
+    async def put_record(self, record: Dict[str, Any]) -> None:
+        """Queues a record with the fields of `node_record`, waiting while the queue is full."""
+        if self._queue is None:
+            raise RuntimeError("ResultSink is not started; use `async with` or `await sink.start()`.")
+        await self._queue.put(record)
+
+    async def drain(self) -> None:
+        """Waits until the records queued so far are written and flushed."""
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def close(self) -> None:
+        """Writes the remaining records and closes the file."""
+        if self._writer is None:
+            return
+        await self._queue.put(None)
+        await self._writer
+        self._writer = self._queue = None
+
+    async def __aenter__(self) -> "ResultSink":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.close()
+
+
+async def _gather_or_cancel(tasks: List[asyncio.Future]) -> None:
+    """Awaits `tasks`; once one fails, cancels the others and waits for them to stop before raising."""
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        # `gather` leaves the other tasks running, e.g. nodes waiting forever for a failed input
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+async def run_streaming(build_simulation: Callable[[int], List[List[Any]]], sim_ids: Iterable[int],
+                        sink: ResultSink, max_active: int=64, scheduler: Optional[Any]=None,
+                        join: bool=True) -> None:
+    """Runs simulations with at most `max_active` of them built at a time, streaming results to `sink`.
+
+    Args:
+        build_simulation (callable): returns the nodes of a simulation given its `sim_id`,
+            e.g., `lambda idx: setup_transmission_chain(connections, Node, task, idx)`.
+        sim_ids (iterable of int or int): the simulations to run, or their number.
+        sink (ResultSink): receives every node once it is evaluated.
+        max_active (int, optional, default: 64): simulations in memory at the same time.
+        scheduler (scheduler.CallScheduler, optional): shared by the nodes of all simulations.
+            Under the DEFERRED policy, nodes are only released at the end of the run.
+        join (bool, optional, default: True): await `scheduler.join()` at the end. Runs
+            sharing a scheduler under the DEFERRED policy pass `False` and join it once
+            all of them are generated, since joining releases the evaluations of every run.
+    """
+    sim_ids = iter(range(sim_ids) if isinstance(sim_ids, int) else sim_ids)
+
+    async def worker():
+        # the workers share `sim_ids`, so a simulation is only built once a worker is free
+        for sim_id in sim_ids:
+            all_nodes = build_simulation(sim_id)
+            nodes = [node for generation in all_nodes for node in generation]
+            for node in nodes:
+                node.sink = sink
+                node.scheduler = scheduler
+            await _gather_or_cancel([asyncio.ensure_future(node.start()) for node in nodes])
+
+    workers = [asyncio.ensure_future(worker()) for _ in range(max_active)]
+    # a failed simulation stops the run rather than leaving the other workers writing to `sink`
+    await _gather_or_cancel(workers)
+    if scheduler is not None and join:
+        await scheduler.join()
+
+
+def read_records(path: pathlib.Path) -> Iterator[Dict[str, Any]]:
+    """Yields the records of a sink file, skipping a truncated last line."""
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def load_results(path: pathlib.Path) -> "pd.DataFrame":
+    """The records of a sink file as a DataFrame with `generation` and `position` columns, sorted by node."""
+    import pandas as pd
+
+    data = pd.DataFrame(read_records(path))
+    if data.empty:
+        return data
+    data[["generation", "position"]] = pd.DataFrame(data.pop("id").tolist(), index=data.index)
+    return data.sort_values(["sim_id", "generation", "position"]).reset_index(drop=True)
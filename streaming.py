@@ -0,0 +1,165 @@
+"""Collects streamed chat completions into a `ChatCompletion` and stops generations early.
+
+With `stream=True`, the API sends the completion as `ChatCompletionChunk`s. `collect_stream`
+and `acollect_stream` add up their deltas into the response a non-streaming call returns,
+so that the tasks parse it as usual, and annotate the current span with the time to first
+token (`ttft_s`) and the decoding rate (`tokens_per_s`). A stop condition closes the stream
+once the text is complete for the task, e.g. `StopAfterLines(n)` once `n` lines arrived,
+which releases the connection and the rate limiter slot before the model stops by itself.
+"""
+
+import re
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, TYPE_CHECKING
+
+import tracing
+
+if TYPE_CHECKING:
+    from openai.types.chat import ChatCompletion
+
+# asks the API for a last chunk with the usage of the whole stream
+STREAM_OPTIONS = {"include_usage": True}
+
+
+@dataclass(frozen=True)
+class StopAfterLines:
+    """Stops once `n` non-blank lines are complete and keeps only them, e.g. the statements of `ThreatTask`."""
+    n: int
+
+    def __call__(self, text: str) -> Optional[int]:
+        start, complete = 0, 0
+        while True:
+            end = text.find("\n", start)
+            if end < 0:
+                return None
+            complete += bool(text[start:end].strip())
+            if complete >= self.n:
+                return end
+            start = end + 1
+
+
+@dataclass(frozen=True)
+class StopAfterWords:
+    """Stops once `n` words are complete and keeps only them, e.g. a length budget of a summary."""
+    n: int
+
+    def __call__(self, text: str) -> Optional[int]:
+        # the n-th word is complete once whitespace follows it
+        for i, match in enumerate(re.finditer(r"\S+(?=\s)", text), 1):
+            if i == self.n:
+                return match.end()
+        return None
+
+
+class StreamAccumulator:
+    """Adds up the deltas of `ChatCompletionChunk`s, per choice.
+
+    Only the content of the deltas is kept; log probabilities and tool calls are not.
+
+    Args:
+        stop (callable, optional): Called with the text of a choice, returns the length of
+            the text to keep once the generation can stop, else `None`. The stream stops
+            once every choice can.
+        sent (float, optional): `time.perf_counter()` when the request was sent, from which
+            the time to first token is measured.
+    """
+
+    def __init__(self, stop: Optional[Any]=None, sent: Optional[float]=None):
+        self.stop = stop
+        self.sent = time.perf_counter() if sent is None else sent
+        self.first_token: Optional[float] = None
+        self.last_token: Optional[float] = None
+        self.chunks = 0
+        self.stopped_early = False
+        self._parts: Dict[int, List[str]] = {}
+        self._finish_reasons: Dict[int, Optional[str]] = {}
+        self._cuts: Dict[int, int] = {}
+        self._meta: Dict[str, Any] = {}
+        self._usage: Any = None
+
+    def add(self, chunk: Any) -> bool:
+        """Adds `chunk`; returns whether the stream can be closed."""
+        if not self._meta:
+            self._meta = {"id": chunk.id, "created": chunk.created, "model": chunk.model,
+                          "system_fingerprint": getattr(chunk, "system_fingerprint", None)}
+        if getattr(chunk, "usage", None) is not None:
+            self._usage = chunk.usage
+        for choice in chunk.choices:
+            parts = self._parts.setdefault(choice.index, [])
+            content = choice.delta.content if choice.delta is not None else None
+            if content:
+                now = time.perf_counter()
+                if self.first_token is None:
+                    self.first_token = now
+                self.last_token = now
+                self.chunks += 1
+                parts.append(content)
+                if self.stop is not None and choice.index not in self._cuts:
+                    cut = self.stop("".join(parts))
+                    if cut is not None:
+                        self._cuts[choice.index] = cut
+            if choice.finish_reason is not None:
+                self._finish_reasons[choice.index] = choice.finish_reason
+
+        # choices that finished by themselves need no cut; once all did, the usage chunk follows
+        if self._cuts and all(index in self._cuts or index in self._finish_reasons for index in self._parts):
+            self.stopped_early = any(index not in self._finish_reasons for index in self._cuts)
+        return self.stopped_early
+
+    def response(self) -> "ChatCompletion":
+        """The `ChatCompletion` a non-streaming call would have returned, cut where `stop` allowed."""
+        # `tasks` imports the stop conditions, which must not load the SDK
+        from openai.types.chat import ChatCompletion, ChatCompletionMessage
+        from openai.types.chat.chat_completion import Choice
+
+        choices = []
+        for index in sorted(self._parts):
+            content = "".join(self._parts[index])
+            if index in self._cuts:
+                content = content[:self._cuts[index]]
+            # a choice cut by `stop` ended like one that reached a stop sequence
+            finish_reason = self._finish_reasons.get(index) or "stop"
+            choices.append(Choice.model_construct(
+                index=index, finish_reason=finish_reason,
+                message=ChatCompletionMessage.model_construct(role="assistant", content=content)))
+        return ChatCompletion.model_construct(object="chat.completion", choices=choices, usage=self._usage,
+                                              **self._meta)
+
+    def annotate(self) -> None:
+        """Annotates the current span with the time to first token and the decoding rate."""
+        if self.first_token is None:
+            return
+        # without a usage chunk, e.g. when stopped early, each content delta counts as a token
+        completion_tokens = getattr(self._usage, "completion_tokens", None) or self.chunks
+        decoding_s = self.last_token - self.first_token
+        tracing.annotate(ttft_s=self.first_token - self.sent, stopped_early=self.stopped_early)
+        if decoding_s > 0:
+            tracing.annotate(tokens_per_s=completion_tokens / decoding_s)
+
+
+def collect_stream(stream: Iterator[Any], stop: Optional[Any]=None, sent: Optional[float]=None) -> "ChatCompletion":
+    """Reads `stream` until it ends or `stop` allows, then closes it. See `StreamAccumulator`."""
+    accumulator = StreamAccumulator(stop, sent)
+    try:
+        for chunk in stream:
+            if accumulator.add(chunk):
+                break
+    finally:
+        stream.close()
+    accumulator.annotate()
+    return accumulator.response()
+
+
+async def acollect_stream(stream: AsyncIterator[Any], stop: Optional[Any]=None,
+                          sent: Optional[float]=None) -> "ChatCompletion":
+    """Awaitable `collect_stream`, for `AsyncStream`s and async generators."""
+    accumulator = StreamAccumulator(stop, sent)
+    try:
+        async for chunk in stream:
+            if accumulator.add(chunk):
+                break
+    finally:
+        await stream.aclose()
+    accumulator.annotate()
+    return accumulator.response()
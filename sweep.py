@@ -0,0 +1,396 @@
+"""Runs a parameter sweep from a YAML or JSON spec, without a notebook.
+
+A spec fixes the settings of the sweep at its top level and lists the values of the swept
+parameters under `grid`; every combination is a cell. The tasks and models of the cells are
+built once, before anything runs, and shared by the cells that use the same ones. All
+cells then run at the same time through one `scheduler.CallScheduler`, whose budgets are
+the sweep's global concurrency limits, and stream their nodes to one `sink.ResultSink`
+file per cell. The `sweep.json` manifest next to them records the parameters, status,
+records and run time of each cell; rerunning a spec skips the cells that are done, so an
+interrupted sweep resumes where it stopped.
+
+    output_dir: results/temperature
+    backend: async_azure            # key in `registry.model_registry`
+    n_simulations: 50
+    evaluate_model: gpt-4
+    evaluate_config: {temperature: 0}
+    scheduler: {max_concurrency: 64}
+    rate_limit: {requests_per_minute: 600, tokens_per_minute: 80000}
+    topologies:
+      chain: {depth: 5}             # or explicit `connections`, see `utils.setup_transmission_chain`
+    grid:
+      - task: [negativity, social]
+        execute_model: [gpt-35-turbo, gpt-4]
+        temperature: [0.5, 1.0]     # any `OpenAIChatConfig` field, for the execution model
+        topology: chain
+      - task: threat
+        study: [lancer, flash, nutane]
+        task_kwargs: {seed: 0}
+        topology: chain
+
+`grid` is one mapping of parameters or a list of them, whose cells are added up. A list is
+always a list of values, so a list-valued parameter is given as a list of lists. The
+parameters (`AXES`, plus the fields of `OpenAIChatConfig`) may also be set at the top level,
+for every grid that does not set them. The settings are those of `configs.SweepConfig`, plus the base
+model configs `execute_config` and `evaluate_config` and the named `topologies`. A model
+is a value of `AzureOpenAIModelType` or `OpenAIModelType` (or its name) depending on the
+backend, or a Hugging Face model for the "local" backends, see `local_model`;
+`evaluate_model` defaults to `execute_model`. YAML specs need PyYAML.
+
+The tasks read `study-data/` next to the modules, which the package does not install, so
+`llm-sweep` only works from a checkout, installed with `pip install -e .`.
+
+Usage:
+    llm-sweep spec.yaml
+    llm-sweep spec.yaml --dry-run
+    llm-sweep spec.json --output-dir results/rerun --rerun
+"""
+
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+import logging
+import os
+import pathlib
+import time
+from dataclasses import dataclass, fields, replace
+from typing import Any, Dict, List, Optional, Tuple
+
+from configs import (FakeModelConfig, HTTPPoolConfig, LocalModelConfig, ModelSpec, OPENAI_API_PARAMS, RateLimitConfig,
+                     RetryConfig, SchedulerConfig, SweepConfig)
+from enums import AzureOpenAIModelType, EvaluationPolicy, OpenAIModelType
+from node import Node
+from registry import create_model
+from scheduler import CallScheduler
+from sink import ResultSink, run_streaming
+from tasks import TaskFactory
+from utils import setup_transmission_chain
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "sweep.json"
+
+# parameters of a cell besides the fields of `OpenAIChatConfig`
+AXES = ("task", "study", "task_kwargs", "execute_model", "evaluate_model", "topology", "n_simulations")
+
+_CONFIG_TYPES = {"scheduler": SchedulerConfig, "rate_limit": RateLimitConfig, "retry": RetryConfig,
+                 "http_pool": HTTPPoolConfig, "fake_model": FakeModelConfig, "local_model": LocalModelConfig}
+_SPEC_KEYS = {f.name for f in fields(SweepConfig)} | set(AXES) | set(OPENAI_API_PARAMS) | {
+    "grid", "topologies", "execute_config", "evaluate_config"}
+
+_MODEL_TYPES = {"openai": OpenAIModelType, "async_openai": OpenAIModelType,
+                "azure": AzureOpenAIModelType, "async_azure": AzureOpenAIModelType}
+
+
+@dataclass(frozen=True)
+class SweepCell:
+    """One combination of the grid; `id` names its results file and its entry in the manifest."""
+    id: str
+    params: Dict[str, Any]
+
+
+def load_spec(path: pathlib.Path) -> Dict[str, Any]:
+    """Reads a spec from a `.yaml`/`.yml` file, or else from a JSON file."""
+    path = pathlib.Path(path)
+    if path.suffix.lower() in (".yaml", ".yml"):
+        try:
+            import yaml
+        except ImportError as e:
+            raise ImportError("Reading YAML specs requires PyYAML (`pip install pyyaml`); "
+                              "or write the spec as JSON.") from e
+        spec = yaml.safe_load(path.read_text())
+    else:
+        spec = json.loads(path.read_text())
+    if not isinstance(spec, dict):
+        raise ValueError(f"The sweep spec {path} must be a mapping.")
+    return spec
+
+
+def sweep_config(spec: Dict[str, Any], output_dir: Optional[str]=None) -> SweepConfig:
+    """The `SweepConfig` of a spec; `output_dir` overrides the spec's."""
+    unknown = set(spec) - _SPEC_KEYS
+    if unknown:
+        raise ValueError(f"Unknown keys in the sweep spec: {sorted(unknown)}.")
+    kwargs = {f.name: spec[f.name] for f in fields(SweepConfig) if f.name in spec}
+    if output_dir is not None:
+        kwargs["output_dir"] = output_dir
+    if "output_dir" not in kwargs:
+        raise ValueError("The sweep spec needs an `output_dir`.")
+    for name, cls in _CONFIG_TYPES.items():
+        value = kwargs.get(name)
+        if isinstance(value, dict):
+            value = dict(value)
+            if cls is LocalModelConfig:
+                value.setdefault("model", "")
+            if "evaluation_policy" in value:
+                value["evaluation_policy"] = EvaluationPolicy(str(value["evaluation_policy"]).lower())
+            kwargs[name] = cls(**value)
+    return SweepConfig(**kwargs)
+
+
+def chain_topology(depth: int, width: int=1) -> List[List[List[int]]]:
+    """Connections of `width` parallel chains of `depth` generations, see `utils.setup_transmission_chain`."""
+    return [[[i] for i in range(width)] for _ in range(depth)]
+
+
+def _values(value: Any) -> List[Any]:
+    return value if isinstance(value, list) else [value]
+
+
+def _cell_id(params: Dict[str, Any]) -> str:
+    digest = hashlib.sha256(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()[:10]
+    return f"{params['task']}-{digest}"
+
+
+def expand_grid(spec: Dict[str, Any]) -> List[SweepCell]:
+    """The cells of a spec, in the order of its grid; duplicate combinations run once."""
+    grids = spec.get("grid") or {}
+    grids = grids if isinstance(grids, list) else [grids]
+    defaults = {key: _values(spec[key]) for key in itertools.chain(AXES, sorted(OPENAI_API_PARAMS)) if key in spec}
+
+    cells: Dict[str, SweepCell] = {}
+    for grid in grids:
+        unknown = set(grid) - set(AXES) - set(OPENAI_API_PARAMS)
+        if unknown:
+            raise ValueError(f"Unknown parameters in the sweep grid: {sorted(unknown)}.")
+        axes = {**defaults, **{key: _values(value) for key, value in grid.items()}}
+        for missing in ("task", "topology", "n_simulations"):
+            if missing not in axes:
+                raise ValueError(f"Every cell of the sweep needs a `{missing}`.")
+        names = list(axes)
+        for values in itertools.product(*(axes[name] for name in names)):
+            combination = dict(zip(names, values))
+            chat = {name: combination.pop(name) for name in list(combination) if name in OPENAI_API_PARAMS}
+            params = {
+                "task": combination["task"],
+                "study": combination.get("study"),
+                "task_kwargs": combination.get("task_kwargs") or {},
+                "execute_model": combination.get("execute_model"),
+                "execute_config": {**(spec.get("execute_config") or {}), **chat},
+                "evaluate_model": combination.get("evaluate_model", combination.get("execute_model")),
+                "evaluate_config": spec.get("evaluate_config") or {},
+                "topology": combination["topology"],
+                "n_simulations": int(combination["n_simulations"]),
+            }
+            cell = SweepCell(_cell_id(params), params)
+            cells.setdefault(cell.id, cell)
+    return list(cells.values())
+
+
+def topology_connections(topology: Any, topologies: Dict[str, Any]) -> List[List[List[int]]]:
+    """Resolves the `topology` of a cell: a name in `topologies`, `{depth, width}` or explicit connections."""
+    if isinstance(topology, str):
+        if topology not in topologies:
+            raise ValueError(f"Unknown topology {topology!r}; the spec defines {sorted(topologies)}.")
+        topology = topologies[topology]
+    if isinstance(topology, dict):
+        if "connections" in topology:
+            return topology["connections"]
+        return chain_topology(topology["depth"], topology.get("width", 1))
+    return topology
+
+
+def model_spec(config: SweepConfig, model: Optional[str], model_config: Dict[str, Any]) -> ModelSpec:
+    """The `ModelSpec` of a model of the sweep, with the sweep's rate limits, retries and connections."""
+    if config.backend in ("fake", "async_fake"):
+        kwargs = {"retry_config": config.retry} if config.retry is not None else {}
+        return ModelSpec(config.backend, (config.fake_model, model_config), kwargs)
+
+    if model is None:
+        raise ValueError(f"The {config.backend!r} backend needs an `execute_model`.")
+    if config.backend in ("local", "async_local"):
+        kwargs = {"retry_config": config.retry} if config.retry is not None else {}
+        local_config = replace(config.local_model or LocalModelConfig(model), model=model)
+        return ModelSpec(config.backend, (local_config, model_config), kwargs)
+
+    model_type = model
+    enum = _MODEL_TYPES.get(config.backend)
+    if enum is not None:
+        try:
+            model_type = enum(model)
+        except ValueError:
+            if model not in enum.__members__:
+                raise ValueError(f"Unknown {enum.__name__} {model!r}; "
+                                 f"choose from {[member.value for member in enum]}.") from None
+            model_type = enum[model]
+    kwargs = {name: value for name, value in (("rate_limit_config", config.rate_limit),
+                                              ("retry_config", config.retry),
+                                              ("http_pool_config", config.http_pool)) if value is not None}
+    return ModelSpec(config.backend, (model_type, model_config), kwargs)
+
+
+class _Builder:
+    """Builds each model and task of the sweep once."""
+
+    def __init__(self, config: SweepConfig):
+        self.config = config
+        self.models: Dict[Tuple, Any] = {}
+        self.tasks: Dict[Tuple, Any] = {}
+
+    def model(self, model: Optional[str], model_config: Dict[str, Any]) -> Tuple[Tuple, Any]:
+        key = (model, json.dumps(model_config, sort_keys=True))
+        if key not in self.models:
+            spec = model_spec(self.config, model, model_config)
+            self.models[key] = create_model(spec.backend, *spec.args, **spec.kwargs)
+        return key, self.models[key]
+
+    def task(self, params: Dict[str, Any]) -> Any:
+        execute_key, execute_model = self.model(params["execute_model"], params["execute_config"])
+        evaluate_key, evaluate_model = self.model(params["evaluate_model"], params["evaluate_config"])
+        task_kwargs = dict(params["task_kwargs"])
+        if params["study"] is not None:
+            task_kwargs["study"] = params["study"]
+        key = (params["task"], json.dumps(task_kwargs, sort_keys=True), execute_key, evaluate_key)
+        if key not in self.tasks:
+            self.tasks[key] = TaskFactory.create(params["task"], execute_model, evaluate_model, **task_kwargs)
+        return self.tasks[key]
+
+
+class _Manifest:
+    """The `sweep.json` of a sweep, rewritten whole whenever a cell changes status."""
+
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        self.cells: Dict[str, Dict[str, Any]] = {}
+        if path.exists():
+            self.cells = json.loads(path.read_text()).get("cells", {})
+
+    def done(self, cell: SweepCell) -> bool:
+        entry = self.cells.get(cell.id)
+        return entry is not None and entry["status"] == "done" and entry["params"] == cell.params
+
+    def update(self, cell: SweepCell, **entry: Any) -> None:
+        self.cells[cell.id] = {"params": cell.params, **entry}
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps({"cells": self.cells}, indent=2))
+        os.replace(tmp_path, self.path)
+
+
+async def run_sweep(cells: List[SweepCell], config: SweepConfig, topologies: Optional[Dict[str, Any]]=None,
+                    rerun: bool=False) -> Dict[str, Dict[str, Any]]:
+    """Runs the cells that are not done yet through one shared scheduler.
+
+    A cell whose run raises is recorded as failed without stopping the others. Under the
+    DEFERRED policy, evaluations start once every cell is generated, and the cells are
+    done when they end.
+
+    Args:
+        cells (list of SweepCell): see `expand_grid`.
+        config (SweepConfig): see `sweep_config`.
+        topologies (dict, optional): named topologies, see `topology_connections`.
+        rerun (bool, optional, default: False): also run the cells the manifest lists as done.
+
+    Returns:
+        The manifest's entry of each cell, by cell ID.
+    """
+    output_dir = pathlib.Path(config.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    manifest = _Manifest(output_dir / MANIFEST)
+    topologies = topologies or {}
+
+    pending = []
+    for cell in cells:
+        if manifest.done(cell) and not rerun:
+            logger.info("Skipping %s, which is done.", cell.id)
+            continue
+        # results of an interrupted or failed run of the cell are replaced
+        (output_dir / f"{cell.id}.jsonl").unlink(missing_ok=True)
+        pending.append(cell)
+
+    # builds every task, model and topology up front, so that a bad spec fails before any call
+    builder = _Builder(config)
+    runs = [(cell, builder.task(cell.params), topology_connections(cell.params["topology"], topologies))
+            for cell in pending]
+    logger.info("Running %d of %d cells with %d models and %d tasks.", len(pending), len(cells),
+                len(builder.models), len(builder.tasks))
+
+    scheduler = CallScheduler(config.scheduler)
+    deferred = scheduler.defers_evaluations
+    gate = asyncio.Semaphore(config.max_cells or max(len(pending), 1))
+    finished = []
+
+    async def finish(cell, sink, expected, start, error=None):
+        await sink.close()
+        if error is None and sink.written < expected:
+            error = f"{sink.written} of {expected} nodes were recorded"
+        status = "done" if error is None else "failed"
+        manifest.update(cell, status=status, records=sink.written, seconds=time.perf_counter() - start,
+                        error=error)
+        finished.append(cell)
+        log = logger.info if error is None else logger.error
+        log("Cell %s %s (%d/%d): %d records%s.", cell.id, status, len(finished), len(pending), sink.written,
+            "" if error is None else f", {error}")
+
+    async def run_cell(cell, task, connections):
+        expected = 0
+
+        def build_simulation(sim_id):
+            nonlocal expected
+            nodes = setup_transmission_chain(connections, Node, task, sim_id)
+            expected += sum(len(generation) for generation in nodes)
+            return nodes
+
+        async with gate:
+            start = time.perf_counter()
+            manifest.update(cell, status="running")
+            sink = ResultSink(output_dir / f"{cell.id}.jsonl")
+            await sink.start()
+            try:
+                await run_streaming(build_simulation, cell.params["n_simulations"], sink, config.max_active,
+                                    scheduler, join=False)
+            except Exception as e:
+                logger.exception("Cell %s failed.", cell.id)
+                await finish(cell, sink, expected, start, repr(e))
+                return None
+        if deferred:
+            return cell, sink, expected, start
+        await finish(cell, sink, expected, start)
+        return None
+
+    try:
+        held = await asyncio.gather(*[run_cell(*run) for run in runs])
+        if deferred:
+            # nodes whose evaluation failed are missing from their cell's records
+            await scheduler.join(return_exceptions=True)
+            for entry in held:
+                if entry is not None:
+                    await finish(*entry)
+    finally:
+        if config.backend not in ("fake", "async_fake", "local", "async_local"):
+            from http_pool import aclose_http_pools
+            await aclose_http_pools()
+    return {cell.id: manifest.cells[cell.id] for cell in cells}
+
+
+def main(argv: Optional[List[str]]=None) -> int:
+    parser = argparse.ArgumentParser(prog="llm-sweep", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("spec", type=pathlib.Path, help="YAML or JSON sweep spec")
+    parser.add_argument("--output-dir", help="overrides the spec's `output_dir`")
+    parser.add_argument("--dry-run", action="store_true", help="list the cells without running them")
+    parser.add_argument("--rerun", action="store_true", help="also run the cells that are done")
+    parser.add_argument("--log-level", default="INFO")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    spec = load_spec(args.spec)
+    config = sweep_config(spec, args.output_dir)
+    cells = expand_grid(spec)
+    if args.dry_run:
+        for cell in cells:
+            print(cell.id, json.dumps(cell.params, sort_keys=True))
+        print(f"{len(cells)} cells, {sum(cell.params['n_simulations'] for cell in cells)} simulations")
+        return 0
+
+    results = asyncio.run(run_sweep(cells, config, spec.get("topologies"), args.rerun))
+    failed = [cell_id for cell_id, entry in results.items() if entry["status"] != "done"]
+    if failed:
+        logger.error("%d of %d cells failed: %s; rerun the spec to retry them.", len(failed), len(results),
+                     ", ".join(failed))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
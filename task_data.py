@@ -0,0 +1,193 @@
+"""Compiles the study inputs (stories and coding sheets) into cached JSON artifacts.
+
+Reading an `.xlsx` coding sheet needs pandas and openpyxl, which dominate the time it takes
+to create a task. A task compiles its inputs once into `<cache_dir>/<name>.json`; later
+setups, in any process, load that file as long as its sources are unchanged, and never
+import pandas.
+"""
+
+import hashlib
+import json
+import os
+import pathlib
+import re
+import tempfile
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+DEFAULT_TASK_DATA_DIR = pathlib.Path.home() / ".cache" / "llm_transmission_chains" / "task-data"
+
+# bump whenever a compile function changes its output, to invalidate existing artifacts
+COMPILER_VERSION = 2
+
+
+def _sha256(path: pathlib.Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_signature(path: pathlib.Path) -> Dict[str, Any]:
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": _sha256(path)}
+
+
+def _is_fresh(signatures: Dict[str, Dict[str, Any]], sources: Sequence[pathlib.Path]) -> bool:
+    """Whether `sources` still match `signatures`.
+
+    Size and mtime are compared first; the (slower) hash is only checked when the mtime
+    changed, so that touching or checking out a file again does not trigger a recompile.
+    """
+    if sorted(signatures) != sorted(str(path) for path in sources):
+        return False
+    for path in sources:
+        signature = signatures[str(path)]
+        stat = os.stat(path)
+        if stat.st_size != signature["size"]:
+            return False
+        if stat.st_mtime_ns != signature["mtime_ns"] and _sha256(path) != signature["sha256"]:
+            return False
+    return True
+
+
+def _write_atomic(path: pathlib.Path, content: str) -> None:
+    """Writes through a temporary file so that concurrent readers never see a partial artifact."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def task_data_dir() -> pathlib.Path:
+    """`$LLM_CHAINS_TASK_DATA_DIR` if set, else `DEFAULT_TASK_DATA_DIR`."""
+    return pathlib.Path(os.environ.get("LLM_CHAINS_TASK_DATA_DIR", DEFAULT_TASK_DATA_DIR))
+
+
+def load_task_data(name: str, sources: Sequence[pathlib.Path], compile_fn: Callable[[], Dict[str, Any]],
+                   cache_dir: Optional[pathlib.Path]=None) -> Dict[str, Any]:
+    """Returns the compiled data of `name`, recompiling it with `compile_fn` if `sources` changed.
+
+    Args:
+        name (str): file name of the artifact, unique per task and sources.
+        sources (list of Path): input files `compile_fn` reads.
+        compile_fn (callable): returns the JSON-serializable task data.
+        cache_dir (Path, optional): defaults to `task_data_dir()`.
+    """
+    path = pathlib.Path(cache_dir or task_data_dir()) / f"{name}.json"
+    sources = [pathlib.Path(source) for source in sources]
+    try:
+        with open(path, "r") as f:
+            artifact = json.load(f)
+        if artifact["version"] == COMPILER_VERSION and _is_fresh(artifact["sources"], sources):
+            return artifact["data"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    data = compile_fn()
+    artifact = {
+        "version": COMPILER_VERSION,
+        "sources": {str(source): source_signature(source) for source in sources},
+        "data": data
+    }
+    try:
+        _write_atomic(path, json.dumps(artifact, ensure_ascii=False))
+    except OSError:
+        pass # e.g., read-only home; the data is still returned, just recompiled next time
+    return data
+
+
+def read_text(path: pathlib.Path) -> str:
+    with open(path, "r") as f:
+        return f.read()
+
+
+def _codings(row: Any, coding_columns: Dict[Any, Tuple[int, int]]) -> List[List[Optional[str]]]:
+    """Human codings of one phrase as [chain step][chain]: `None` if absent, otherwise the
+    (lowercase) mark, i.e., "x", or the tone of an ambiguous phrase in study 2."""
+    n_steps = 1 + max(step for step, _ in coding_columns.values())
+    n_chains = 1 + max(chain for _, chain in coding_columns.values())
+    codings = [[None] * n_chains for _ in range(n_steps)]
+    for column, (step, chain) in coding_columns.items():
+        value = row[column]
+        if isinstance(value, str) and value.strip():
+            codings[step][chain] = value.strip().lower()
+        elif isinstance(value, (int, float)) and value == value and value:
+            codings[step][chain] = "x"
+    return codings
+
+
+def compile_marked_phrases(story_file: pathlib.Path, coding_file: pathlib.Path,
+                           markers: List[str]) -> Dict[str, Any]:
+    """Story and phrases of a coding sheet listing each category marker followed by its phrases.
+
+    The sheets of studies 1 and 2 have the markers (e.g., "BMC", "POSITIVE:") and the
+    phrases in their first column, and the human codings in "chain <i>[.<step>]" columns.
+    """
+    import pandas as pd
+
+    exp_data = pd.read_excel(str(coding_file))
+    # "chain 3" is chain 3 at the first chain step, "chain 3.1" at the second, and so on
+    coding_columns = {}
+    for column in exp_data.columns:
+        match = re.fullmatch(r"chain (\d+)(?:\.(\d+))?", str(column))
+        if match:
+            coding_columns[column] = (int(match.group(2) or 0), int(match.group(1)) - 1)
+
+    phrases, categories, codings = [], [], []
+    category = None
+    for _, row in exp_data.iterrows():
+        x = row['Unnamed: 0']
+        if pd.isna(x):
+            continue
+        if x in markers:
+            category = x
+            continue
+        phrases.append(x.strip())
+        categories.append([category])
+        codings.append(_codings(row, coding_columns))
+
+    return {"original_story": read_text(story_file), "phrases": phrases, "categories": categories,
+            "codings": codings}
+
+
+def compile_propositions(story_file: pathlib.Path, coding_file: pathlib.Path,
+                         sort: bool=False) -> Dict[str, Any]:
+    """Story and numbered propositions ("<number>\\t<proposition>") of a coding sheet.
+
+    The sheets of studies 3 and 5 have a header row (Number, Proposition, Type or
+    Type_1, Type_2, ...) above the propositions; the types become the categories. The
+    human codings follow in one block of chain columns per "Chain Step".
+    """
+    import pandas as pd
+
+    exp_data = pd.read_excel(str(coding_file))
+    header = exp_data.iloc[0].tolist()
+    exp_data = exp_data.iloc[1:]
+    if sort:
+        exp_data = exp_data.sort_values(by=['Unnamed: 0'])
+
+    type_columns = [column for column, title in zip(exp_data.columns, header)
+                    if isinstance(title, str) and title.startswith("Type")]
+    # each "Chain Step <n>" column starts a block with one column per chain, numbered in the header row
+    coding_columns = {}
+    step = -1
+    for column, title in zip(exp_data.columns, header):
+        if str(column).startswith("Chain Step"):
+            step += 1
+        if step >= 0 and not pd.isna(title):
+            coding_columns[column] = (step, int(title) - 1)
+
+    phrases, categories, codings = [], [], []
+    for _, row in exp_data.iterrows():
+        phrases.append(f"{row['Unnamed: 0']}\t{row['Unnamed: 1']}")
+        categories.append([row[column] for column in type_columns if not pd.isna(row[column])])
+        codings.append(_codings(row, coding_columns))
+
+    return {"original_story": read_text(story_file), "phrases": phrases, "categories": categories,
+            "codings": codings}
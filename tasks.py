@@ -1,11 +1,25 @@
 from abc import ABC, abstractmethod
-from typing import Any, Dict, Optional, List
+from typing import Any, Callable, Dict, Optional, List, Iterable, Tuple, Union, TYPE_CHECKING
 from prompt_generator import TaskPromptFactory
 from enums import TaskType
 from base_model import BaseAPIModel
+from utils import read_summaries
+from packing import EvaluationPacker, plan_packs, split_packed_response
+from fanout import MAX_N, ExecutionFanOut, split_choices
+from streaming import StopAfterLines, StopAfterWords
+from registry import task_registry
+from task_data import load_task_data, read_text, compile_marked_phrases, compile_propositions
+import tracing
+import asyncio
+import inspect
 import pathlib
-import pandas as pd
 import random
+import time
+
+if TYPE_CHECKING:
+    import pandas as pd
+    from annotations import EvaluationMatrix, PhraseIndex
+    from configs import CascadeConfig
 
 
 ROOT = pathlib.Path(__file__).resolve().parent
@@ -14,26 +28,14 @@ class TaskFactory:
 
     @staticmethod
     def create(task_type: TaskType, llm_model_execute: BaseAPIModel, llm_model_evaluate: Optional[BaseAPIModel], **kwargs):
-        if not isinstance(task_type, TaskType):
+        if not isinstance(task_type, (TaskType, str)):
             raise ValueError("Invalid task type.")
 
-        if task_type is TaskType.GENDER_STEREOTYPE_CONSISTENCY:
-            cls = GenderStereotypeConsistencyTask
-        elif task_type is TaskType.NEGATIVITY:
-            cls = NegativityTask
-        elif task_type is TaskType.AMBIGUITY:
-            cls = AmbiguityTask
-        elif task_type is TaskType.SOCIAL:
-            cls = SocialTask
-        elif task_type is TaskType.THREAT:
-            cls = ThreatTask
-        elif task_type is TaskType.MULTIPLEBIAS:
-            cls = MultipleBiasTask
-        else:
-            raise ValueError(f"Task not recognized as a valid class: {task_type.name}")
-
+        # task classes, including those of plugins, are looked up (and imported) in the registry
+        cls = task_registry.get(task_type)
         return cls(llm_model_execute, llm_model_evaluate, **kwargs)
 
+
 class BaseTask(ABC):
     """Base class for agents."""
 
@@ -52,44 +54,349 @@ class BaseTask(ABC):
         """Performs a single step of the agent."""
         pass
 
+    async def aexecute(self, *args: Any, **kwargs: Any) -> Any:
+        """Awaitable `execute`. Runs the blocking version in a thread unless overridden."""
+        return await asyncio.to_thread(self.execute, *args, **kwargs)
+
+    async def aevaluate(self, *args: Any, **kwargs: Any) -> Any:
+        """Awaitable `evaluate`. Runs the blocking version in a thread unless overridden."""
+        return await asyncio.to_thread(self.evaluate, *args, **kwargs)
+
+
+def streams(llm_model: BaseAPIModel, parameters: Optional[Dict[str, Any]]=None) -> bool:
+    """Whether a call of `llm_model` with `parameters` streams its completion (`stream=True`)."""
+    return bool({**(getattr(llm_model, "model_config_dict", None) or {}), **(parameters or {})}.get("stream"))
+
+
+def query(llm_model: BaseAPIModel, messages: List[Dict[str, str]],
+          parameters: Optional[Dict[str, Any]]=None, stream_stop: Optional[Callable[[str], Optional[int]]]=None):
+    """Calls `llm_model.failsafe_query`; `stream_stop` is only passed to streaming calls, as only they take it."""
+    if stream_stop is None or not streams(llm_model, parameters):
+        return llm_model.failsafe_query(messages, parameters)
+    return llm_model.failsafe_query(messages, parameters, stream_stop=stream_stop)
+
+
+async def aquery(llm_model: BaseAPIModel, messages: List[Dict[str, str]],
+                 parameters: Optional[Dict[str, Any]]=None, stream_stop: Optional[Callable[[str], Optional[int]]]=None):
+    """Awaits `llm_model.failsafe_query`, falling back to a thread for blocking models."""
+    if inspect.iscoroutinefunction(llm_model.failsafe_query):
+        return await query(llm_model, messages, parameters, stream_stop)
+
+    submitted = time.perf_counter()
+
+    def call():
+        # time spent waiting for a worker thread of the default executor
+        tracing.annotate(executor_wait_s=time.perf_counter() - submitted)
+        return query(llm_model, messages, parameters, stream_stop)
+
+    return await asyncio.to_thread(call)
+
 
 class BaseTelephoneGameTask(BaseTask):
 
+    # whether `evaluate` queries the evaluation model
+    requires_evaluation = True
+    # whether the evaluator only reports which phrases are present (see `cascade.EvaluationCascade`)
+    phrase_presence_only = True
+    # tones the evaluator may report after a phrase ("<phrase>\t:<tone>")
+    evaluation_tones: Tuple[str, ...] = ()
+
     def __init__(self, task_type: TaskType, llm_model_execute: Optional[BaseAPIModel]=None, llm_model_evaluate: Optional[BaseAPIModel]=None):
         self.prompts = TaskPromptFactory.create(task_type)
         self.llm_model_execute = llm_model_execute
         self.llm_model_evaluate = llm_model_evaluate
+        self.evaluation_packer = None
+        self.evaluation_cascade = None
+        self.execution_fanout = None
+        self.summary_max_words = None
         self.setup()
 
     def setup(self):
-        raise NotImplementedError("Subclasses must implement the setup method.")
-
-    def execute(self, input_story: Optional[List[str]]):
+        # the task data is loaded from its compiled artifact on first use, see `task_data`
+        self._task_data = None
+        self._phrase_index = None
+
+    def task_data_sources(self) -> List[pathlib.Path]:
+        """The input files `compile_task_data` reads."""
+        raise NotImplementedError("Subclasses must implement the task_data_sources method.")
+
+    def compile_task_data(self) -> Dict[str, Any]:
+        """Parses the input files into JSON-serializable task data."""
+        raise NotImplementedError("Subclasses must implement the compile_task_data method.")
+
+    @property
+    def task_data(self) -> Dict[str, Any]:
+        """The compiled task data, see `task_data.load_task_data`."""
+        if self._task_data is None:
+            sources = self.task_data_sources()
+            name = "_".join(source.stem for source in sources)
+            self._task_data = load_task_data(name, sources, self.compile_task_data)
+        return self._task_data
+
+    @property
+    def _original_story(self) -> str:
+        return self.task_data["original_story"]
+
+    @property
+    def evaluation_phrase_ids(self) -> List[int]:
+        """Indices in `task_data["phrases"]` of the phrases the evaluator is asked about."""
+        return list(range(len(self.task_data["phrases"])))
+
+    @property
+    def evaluation_phrases(self) -> List[str]:
+        phrases = self.task_data["phrases"]
+        return [phrases[i] for i in self.evaluation_phrase_ids]
+
+    @property
+    def _phrases(self) -> str:
+        return "\n".join(self.evaluation_phrases)
+
+    def phrase_text(self, phrase: str) -> str:
+        """The text of `phrase` to match against summaries."""
+        return phrase
+
+    def phrase_label(self, phrase: str) -> str:
+        """How the evaluator reports `phrase` when it is present."""
+        return phrase
+
+    @property
+    def phrase_index(self) -> "PhraseIndex":
+        """Resolves evaluator lines to canonical phrase IDs, see `annotations.PhraseIndex`."""
+        if self._phrase_index is None:
+            from annotations import PhraseIndex
+
+            phrases = self.task_data["phrases"]
+            ids = self.evaluation_phrase_ids
+            keys = [(phrases[i], self.phrase_text(phrases[i]), self.phrase_label(phrases[i])) for i in ids]
+            self._phrase_index = PhraseIndex(ids, keys)
+        return self._phrase_index
+
+    def parse_evaluation(self, evaluation: Optional[str]) -> List[Tuple[int, Optional[str]]]:
+        """(canonical phrase ID, tone) of every phrase `evaluation` reports; unmatched lines are dropped."""
+        if not evaluation:
+            return []
+        annotations = []
+        for line in evaluation.split("\n"):
+            tone = None
+            if self.evaluation_tones:
+                head, sep, tail = line.rpartition(":")
+                if sep and tail.strip().upper() in self.evaluation_tones:
+                    line, tone = head, tail.strip().upper()
+            phrase_id = self.phrase_index.lookup(line)
+            if phrase_id is not None:
+                annotations.append((phrase_id, tone))
+        return annotations
+
+    def evaluation_matrix(self, results: Any) -> "EvaluationMatrix":
+        """Parses the evaluations of `results` (simulations of nodes, or a DataFrame with sim_id,
+        generation, [position] and evaluation columns) into an `annotations.EvaluationMatrix`."""
+        from annotations import EvaluationMatrix
+
+        if hasattr(results, "columns"):
+            return EvaluationMatrix.from_frame(self, results)
+        return EvaluationMatrix.from_simulations(self, results)
+
+    def prompt_static_kwargs(self) -> Dict[str, str]:
+        """Prompt fields that are constant for the task, rendered once, see `TaskPrompt.compile`."""
+        return {"original_story": self._original_story, "phrases": self._phrases}
+
+    @property
+    def compiled_prompts(self):
+        """`self.prompts`, compiled on first use since the task data is loaded lazily."""
+        if self.prompts.static_kwargs is None:
+            self.prompts.compile(**self.prompt_static_kwargs())
+        return self.prompts
+
+    def execution_messages(self, input_story: Optional[List[str]], sim_id: Optional[int]=None,
+                           node_id: Optional[Any]=None):
         if input_story is None or len(input_story) == 0:
             exec_kwargs = {"input_story": self._original_story}
         else:
             exec_kwargs = {"input_story": input_story[0]}
 
-        messages = self.prompts.get_execution_messages(**exec_kwargs)
-        response = self.llm_model_execute.query(messages)
+        return self.compiled_prompts.get_execution_messages(**exec_kwargs)
+
+    def parse_execution_response(self, response):
         return response.choices[0].message.content
-    
-    def evaluate(self, summary):
-        prompt_kwargs = {
-            "original_story": self._original_story,
-            "phrases": self._phrases,
-            "summary": summary
-        }
-
-        messages = self.prompts.get_evaluation_messages(**prompt_kwargs)
-        response = self.llm_model_evaluate.query(messages)
+
+    def execution_stop(self, input_story: Optional[List[str]]) -> Optional[Callable[[str], Optional[int]]]:
+        """Closes the stream of a streamed execution call once the output is complete, see `streaming`."""
+        return None if self.summary_max_words is None else StopAfterWords(self.summary_max_words)
+
+    def set_summary_budget(self, max_words: Optional[int]):
+        """Closes the stream of an execution call once the summary has `max_words` words, and keeps
+        only those. Only affects models with `stream=True`; `None` lets the model finish.
+        """
+        self.summary_max_words = max_words
+
+    def evaluation_messages(self, summary, phrases: Optional[List[str]]=None):
+        # the phrases and the original story are rendered in the compiled prompts
+        prompt_kwargs = {"summary": summary}
+        if phrases is not None:
+            prompt_kwargs["phrases"] = "\n".join(phrases)
+
+        return self.compiled_prompts.get_evaluation_messages(**prompt_kwargs)
+
+    def parse_evaluation_response(self, response):
         return response.choices[0].message.content
+
+    def execute(self, input_story: Optional[List[str]], sim_id: Optional[int]=None,
+                node_id: Optional[Any]=None):
+        messages = self.execution_messages(input_story, sim_id, node_id)
+        response = query(self.llm_model_execute, messages, stream_stop=self.execution_stop(input_story))
+        return self.parse_execution_response(response)
+
+    def evaluate(self, summary, phrases: Optional[List[str]]=None):
+        if self.evaluation_cascade is not None and phrases is None:
+            return self.evaluation_cascade.evaluate(summary)
+        messages = self.evaluation_messages(summary, phrases)
+        response = self.llm_model_evaluate.failsafe_query(messages)
+        return self.parse_evaluation_response(response)
+
+    async def aexecute(self, input_story: Optional[List[str]], sim_id: Optional[int]=None,
+                       node_id: Optional[Any]=None):
+        messages = self.execution_messages(input_story, sim_id, node_id)
+        # only the first generation, without inputs, sends the same messages in every simulation
+        if self.execution_fanout is not None and not input_story:
+            response = await self.execution_fanout.execute(messages)
+        else:
+            response = await aquery(self.llm_model_execute, messages, stream_stop=self.execution_stop(input_story))
+        return self.parse_execution_response(response)
+
+    async def aquery_choices(self, messages: List[Dict[str, str]], n: int) -> List[Any]:
+        """Queries the execution model once for `n` choices; returns one single-choice response per choice."""
+        response = await aquery(self.llm_model_execute, messages, None if n == 1 else {"n": n})
+        return split_choices(response)
+
+    def set_execution_fanout(self, max_n: Optional[int]=MAX_N, window: float=0.05):
+        """Serves concurrent first-generation `aexecute` calls with identical messages from one request
+        with up to `max_n` choices, see `fanout.ExecutionFanOut`; `None` disables it.
+        """
+        self.execution_fanout = None if max_n is None else ExecutionFanOut(self, max_n, window)
+
+    async def aevaluate(self, summary):
+        if self.evaluation_cascade is not None:
+            return await self.evaluation_cascade.aevaluate(summary)
+        if self.evaluation_packer is not None:
+            return await self.evaluation_packer.evaluate(summary)
+        return await self.aevaluate_unpacked(summary)
+
+    async def aevaluate_unpacked(self, summary, phrases: Optional[List[str]]=None):
+        messages = self.evaluation_messages(summary, phrases)
+        response = await aquery(self.llm_model_evaluate, messages)
+        return self.parse_evaluation_response(response)
+
+    def set_evaluation_cascade(self, config: Optional["CascadeConfig"]=None, enabled: bool=True):
+        """Settles confident phrases locally and only asks the evaluator about the others, see
+        `cascade.EvaluationCascade`. It takes precedence over evaluation packing; `enabled=False` disables it.
+        """
+        from cascade import EvaluationCascade
+
+        self.evaluation_cascade = EvaluationCascade(self, config) if enabled else None
+
+    def set_evaluation_packing(self, pack_size: Optional[int], window: float=0.05):
+        """Packs up to `pack_size` concurrent `aevaluate` calls into one request; `None` disables packing.
+
+        The phrases and the original story are then sent once per pack instead of once per summary.
+        """
+        self.evaluation_packer = None if pack_size is None else EvaluationPacker(self, pack_size, window)
+
+    def packed_evaluation_messages(self, summaries: List[str]):
+        return self.compiled_prompts.get_packed_evaluation_messages(summaries)
+
+    def plan_evaluation_packs(self, summaries: List[str], pack_size: int) -> List[Tuple[int, int]]:
+        """Splits `summaries` into packs of at most `pack_size` that fit the evaluator's `token_limit`."""
+        model_type = getattr(self.llm_model_evaluate, "model_type", None)
+        token_limit = getattr(model_type, "token_limit", None)
+        max_tokens = getattr(self.llm_model_evaluate, "model_config_dict", {}).get("max_tokens") or 512
+        return plan_packs(summaries, pack_size, self.packed_evaluation_messages([]), token_limit, max_tokens)
+
+    def _packed_parameters(self, n_summaries: int) -> Optional[Dict[str, Any]]:
+        """Scales the evaluator's `max_tokens` with the number of summaries in the pack."""
+        max_tokens = getattr(self.llm_model_evaluate, "model_config_dict", {}).get("max_tokens")
+        return None if max_tokens is None else {"max_tokens": n_summaries * max_tokens}
+
+    def evaluate_packed(self, summaries: List[str], pack_size: Optional[int]=None) -> List[str]:
+        """Evaluates `summaries` in packs of at most `pack_size` (default: all) summaries per request.
+
+        Summaries missing from a packed response are evaluated on their own.
+        """
+        evaluations = []
+        for start, end in self.plan_evaluation_packs(summaries, pack_size or len(summaries)):
+            pack = summaries[start:end]
+            messages = self.packed_evaluation_messages(pack)
+            response = self.llm_model_evaluate.failsafe_query(messages, self._packed_parameters(len(pack)))
+            split = split_packed_response(self.parse_evaluation_response(response), len(pack))
+            evaluations += [self.evaluate(summary) if evaluation is None else evaluation
+                            for summary, evaluation in zip(pack, split)]
+        return evaluations
+
+    async def aevaluate_packed(self, summaries: List[str], pack_size: Optional[int]=None) -> List[str]:
+        """Awaitable `evaluate_packed`; packs are sent concurrently."""
+        async def evaluate_pack(pack):
+            messages = self.packed_evaluation_messages(pack)
+            response = await aquery(self.llm_model_evaluate, messages, self._packed_parameters(len(pack)))
+            split = split_packed_response(self.parse_evaluation_response(response), len(pack))
+            return await asyncio.gather(*[
+                self.aevaluate_unpacked(summary) if evaluation is None else asyncio.sleep(0, evaluation)
+                for summary, evaluation in zip(pack, split)
+            ])
+
+        packs = self.plan_evaluation_packs(summaries, pack_size or len(summaries))
+        results = await asyncio.gather(*[evaluate_pack(summaries[start:end]) for start, end in packs])
+        return [evaluation for pack in results for evaluation in pack]
+
+    async def aevaluate_many(self, records: Union[Iterable[Tuple[int, int, str]], str, pathlib.Path],
+                             max_concurrency: int=16, n_simulations: Optional[int]=None) -> "pd.DataFrame":
+        """Evaluates stored summaries without building a transmission chain.
+
+        Args:
+            records: (sim_id, generation, summary) records, or a `.docx`/text file read with
+                `utils.read_summaries` (requires `n_simulations`).
+            max_concurrency (int): maximum number of evaluations in flight.
+            n_simulations (int, optional): number of chains in the file `records` points to.
+
+        Returns:
+            A DataFrame with columns sim_id, generation, summary, evaluation and error, in the
+            order of `records`. A summary whose evaluation failed has its exception in `error`.
+        """
+        if isinstance(records, (str, pathlib.Path)):
+            if n_simulations is None:
+                raise ValueError("n_simulations is required to read summaries from a file.")
+            records = read_summaries(records, n_simulations)
+
+        records = list(records)
+        semaphore = asyncio.Semaphore(max_concurrency)
+        # the local scores of all summaries are computed at once
+        decisions = None
+        if self.evaluation_cascade is not None:
+            decisions = self.evaluation_cascade.settle([summary for _, _, summary in records])
+
+        async def evaluate_record(idx, sim_id, generation, summary):
+            async with semaphore:
+                try:
+                    if decisions is None:
+                        evaluation = await self.aevaluate(summary)
+                    else:
+                        evaluation = await self.evaluation_cascade.aevaluate(summary, decisions[idx])
+                    return sim_id, generation, summary, evaluation, None
+                except Exception as e:
+                    return sim_id, generation, summary, None, repr(e)
+
+        rows = await asyncio.gather(*[evaluate_record(idx, *record) for idx, record in enumerate(records)])
+        import pandas as pd
+        return pd.DataFrame(rows, columns=["sim_id", "generation", "summary", "evaluation", "error"])
+
+    def evaluate_many(self, records: Union[Iterable[Tuple[int, int, str]], str, pathlib.Path],
+                      max_concurrency: int=16, n_simulations: Optional[int]=None) -> "pd.DataFrame":
+        """Blocking `aevaluate_many`. Inside a running event loop (e.g., Jupyter), await `aevaluate_many` instead."""
+        return asyncio.run(self.aevaluate_many(records, max_concurrency, n_simulations))
   
 
 class GenderStereotypeConsistencyTask(BaseTelephoneGameTask):
 
     # input_files
-    coding_data_RA = ROOT / "study-data/coding/Second Coder/study1_RA.xlsx"
+    coding_data_RA = ROOT / "study-data/coding/Second Coder/Study1_RA.xlsx"
     coding_data = ROOT / "study-data/coding/study1.xlsx"
     story_file = ROOT / "study-data/stories/kashima.txt"
 
@@ -99,33 +406,18 @@ class GenderStereotypeConsistencyTask(BaseTelephoneGameTask):
     def __init__(self, llm_model_execute: Optional[BaseAPIModel]=None, llm_model_evaluate: Optional[BaseAPIModel]=None):
         super().__init__(TaskType.GENDER_STEREOTYPE_CONSISTENCY, llm_model_execute, llm_model_evaluate)
 
-    def setup(self):
-        # for prompt: original story 
-        self._original_story = open(str(self.story_file), 'r').read()
+    def task_data_sources(self):
+        return [self.story_file, self.coding_data]
 
-        # for prompt: phrases from the story
-        exp_data = pd.read_excel(str(self.coding_data))
-        phrases = []
-        for row in exp_data.iterrows():
-            x = row[1]['Unnamed: 0']
-
-            if pd.isna(x):
-                continue 
-
-            if x in self.index_consistent or x in self.index_inconsistent:
-                cat = x
-                continue
-            else:
-                phrase = x
-            phrases.append(phrase.strip())
-
-        self._phrases = "\n".join(phrases)
+    def compile_task_data(self):
+        # for prompt: original story and the phrases from the story, tagged with their category
+        return compile_marked_phrases(self.story_file, self.coding_data, self.index_consistent + self.index_inconsistent)
 
 
 class NegativityTask(BaseTelephoneGameTask):
 
     # input_files
-    coding_data_RA = ROOT / "study-data/coding/Second Coder/study2_RA.xlsx"
+    coding_data_RA = ROOT / "study-data/coding/Second Coder/Study2_RA.xlsx"
     coding_data = ROOT / "study-data/coding/study2.xlsx"
     story_file = ROOT / "study-data/stories/bebbington.txt"
 
@@ -137,32 +429,22 @@ class NegativityTask(BaseTelephoneGameTask):
     def __init__(self, llm_model_execute: Optional[BaseAPIModel]=None, llm_model_evaluate: Optional[BaseAPIModel]=None):
         super().__init__(TaskType.NEGATIVITY, llm_model_execute, llm_model_evaluate)
 
-    def setup(self):
-        # for prompt: original story 
-        self._original_story = open(str(self.story_file), 'r').read()
-
-        # for prompt: phrases from the story
-        exp_data = pd.read_excel(str(self.coding_data))
-        phrases = []
-        for row in exp_data.iterrows():
-            x = row[1]['Unnamed: 0']
-
-            if pd.isna(x):
-                continue 
-
-            if x in self.sentiments:
-                continue
-            else:
-                phrase = x
-            phrases.append(phrase.strip())
+    def task_data_sources(self):
+        return [self.story_file, self.coding_data]
 
-        self._phrases = "\n".join(phrases)
+    def compile_task_data(self):
+        # for prompt: original story and the phrases from the story, tagged with their sentiment
+        return compile_marked_phrases(self.story_file, self.coding_data, self.sentiments)
 
 
 class AmbiguityTask(BaseTelephoneGameTask):
 
+    # the evaluator also infers the tone of each phrase
+    phrase_presence_only = False
+    evaluation_tones = ("POSITIVE", "NEGATIVE", "NEUTRAL")
+
     # input_files
-    coding_data_RA = ROOT / "study-data/coding/Second Coder/study2_RA.xlsx"
+    coding_data_RA = ROOT / "study-data/coding/Second Coder/Study2_RA.xlsx"
     coding_data = ROOT / "study-data/coding/study2.xlsx"
     story_file = ROOT / "study-data/stories/bebbington.txt"
 
@@ -174,54 +456,48 @@ class AmbiguityTask(BaseTelephoneGameTask):
     def __init__(self, llm_model_execute: Optional[BaseAPIModel]=None, llm_model_evaluate: Optional[BaseAPIModel]=None):
         super().__init__(TaskType.AMBIGUITY, llm_model_execute, llm_model_evaluate)
 
-    def setup(self):
-        # for prompt: original story 
-        self._original_story = open(str(self.story_file), 'r').read()
-
-        # for prompt: phrases from the story
-        exp_data = pd.read_excel(str(self.coding_data))
-        phrases = []
-        for row in exp_data.iterrows():
-            x = row[1]['Unnamed: 0']
-
-            if pd.isna(x):
-                continue 
+    def task_data_sources(self):
+        return [self.story_file, self.coding_data]
 
-            if x in self.sentiments:
-                cat = x
-                continue
-            else:
-                phrase = x
+    def compile_task_data(self):
+        # for prompt: original story and the phrases from the story, tagged with their sentiment
+        return compile_marked_phrases(self.story_file, self.coding_data, self.sentiments)
 
-            if cat != self.AMBIGUOUS:
-                continue
-            phrases.append(phrase.strip())
-
-        self._phrases = "\n".join(phrases)
+    @property
+    def evaluation_phrase_ids(self):
+        # only the ambiguous phrases are coded
+        return [i for i, (category,) in enumerate(self.task_data["categories"]) if category == self.AMBIGUOUS]
 
 
 class SocialTask(BaseTelephoneGameTask):
 
     # input_files
-    coding_data_RA = ROOT / "study-data/coding/Second Coder/study3_RA.xlsx"
-    coding_data = ROOT / "study-data/coding/study3.xlsx"
+    coding_data_RA = ROOT / "study-data/coding/Second Coder/Study3_RA.xlsx"
+    coding_data = ROOT / "study-data/coding/Study3.xlsx"
     story_file = ROOT / "study-data/stories/mesoudi.txt"
 
     def __init__(self, llm_model_execute: Optional[BaseAPIModel]=None, llm_model_evaluate: Optional[BaseAPIModel]=None):
         super().__init__(TaskType.SOCIAL, llm_model_execute, llm_model_evaluate)
 
-    def setup(self):
-        # for prompt: original story 
-        self._original_story = open(str(self.story_file), 'r').read()
+    def task_data_sources(self):
+        return [self.story_file, self.coding_data]
 
-        exp_data = pd.read_excel(str(self.coding_data))
-        props = exp_data['Unnamed: 0'].iloc[1:].tolist()
-        nums = exp_data['Unnamed: 1'].iloc[1:].tolist()
-        self._phrases = "\n".join([f"{x}\t{y}" for x, y in list(zip(props, nums))])
+    def compile_task_data(self):
+        # for prompt: original story and the numbered propositions, tagged with their type
+        return compile_propositions(self.story_file, self.coding_data)
+
+    def phrase_text(self, phrase):
+        return phrase.split("\t", 1)[1]
+
+    def phrase_label(self, phrase):
+        # the evaluator outputs the numbers of the propositions
+        return phrase.split("\t", 1)[0]
 
 
 class ThreatTask(BaseTelephoneGameTask):
 
+    requires_evaluation = False
+
     # input_files
     narrative_file: pathlib.Path
     lancer_file = ROOT / "study-data/stories/blaine_boyer_lancer.txt"
@@ -230,7 +506,9 @@ class ThreatTask(BaseTelephoneGameTask):
 
     def __init__(self, llm_model_execute: Optional[BaseAPIModel]=None, llm_model_evaluate: Optional[BaseAPIModel]=None, **kwargs):
         study_type = kwargs['study']
-        
+        # seeds the shuffle of the statements per (simulation, node) so that reruns are reproducible
+        self.seed = kwargs.get('seed')
+
         if study_type == "lancer":
             self.narrative_file = self.lancer_file
         elif study_type == "flash":
@@ -242,10 +520,12 @@ class ThreatTask(BaseTelephoneGameTask):
 
         super().__init__(TaskType.THREAT, llm_model_execute, llm_model_evaluate)
 
-    def setup(self):
+    def task_data_sources(self):
+        return [self.narrative_file]
+
+    def compile_task_data(self):
         # for prompt
-        narrative = open(str(self.narrative_file), "r").read()
-        self.narrative, raw_statements = narrative.split("Here are the statements:")
+        narrative, raw_statements = read_text(self.narrative_file).split("Here are the statements:")
         raw_statements = raw_statements.strip().split("\n")
         statements = []
         for raw in raw_statements:
@@ -254,35 +534,57 @@ class ThreatTask(BaseTelephoneGameTask):
 
             statement = self.normalize_string(raw)
             statements.append(statement)
-        
-        self.statements = tuple(statements)
 
-    
-    def execute(self, statements: Optional[List[str]]):
+        return {"narrative": narrative, "statements": statements}
+
+    @property
+    def narrative(self):
+        return self.task_data["narrative"]
+
+    @property
+    def statements(self):
+        return tuple(self.task_data["statements"])
+
+    def prompt_static_kwargs(self):
+        return {"narrative": self.narrative}
+
+    def execution_messages(self, statements: Optional[List[str]], sim_id: Optional[int]=None,
+                           node_id: Optional[Any]=None):
         if statements is None or len(statements) == 0:
             statements = list(self.statements).copy()
-            random.shuffle(statements)
+            if self.seed is None:
+                random.shuffle(statements)
+            else:
+                random.Random(f"{self.seed}:{sim_id}:{node_id}").shuffle(statements)
         else:
             statements = statements[0] # it should be a list of statements
-        
+
         exec_kwargs = {}
         exec_kwargs['statements'] = "\n".join(statements)
-        exec_kwargs['narrative'] = self.narrative
         exec_kwargs['n'] = len(statements) - 1
-        messages = self.prompts.get_execution_messages(**exec_kwargs)
-        response = self.llm_model_execute.query(messages)
+        return self.compiled_prompts.get_execution_messages(**exec_kwargs)
+
+    def parse_execution_response(self, response):
         selected_statements = response.choices[0].message.content.split("\n")
         return selected_statements
-    
+
+    def execution_stop(self, statements: Optional[List[str]]):
+        # the model selects all but one of the statements, one per line
+        n = len(statements[0] if statements else self.statements) - 1
+        return StopAfterLines(n)
+
     def evaluate(self, summary):
         pass # No evaluation required.
 
+    async def aevaluate(self, summary):
+        pass # No evaluation required.
+
     def normalize_string(self, s):
         """Normalizes string s wrt apostrophe."""
         s = s.replace('’', '')
         s = s.replace("'", '')
         return " ".join(s.split())
-    
+
 
 class MultipleBiasTask(BaseTelephoneGameTask):
 
@@ -291,8 +593,8 @@ class MultipleBiasTask(BaseTelephoneGameTask):
     muki_file = ROOT / "study-data/stories/berl_muki.txt"
     takatoro_file = ROOT / "study-data/stories/berl_takatoro.txt"
 
-    muki_coding_file = ROOT / "study-data/coding/study5_Muki.xlsx"
-    takatoro_coding_file = ROOT / "study-data/coding/study5_TakaToro.xlsx"
+    muki_coding_file = ROOT / "study-data/coding/Study5_Muki.xlsx"
+    takatoro_coding_file = ROOT / "study-data/coding/Study5_TakaToro.xlsx"
 
     def __init__(self, llm_model_execute: Optional[BaseAPIModel]=None, llm_model_evaluate: Optional[BaseAPIModel]=None, **kwargs):
         study_type = kwargs['study']
@@ -308,13 +610,16 @@ class MultipleBiasTask(BaseTelephoneGameTask):
 
         super().__init__(TaskType.MULTIPLEBIAS, llm_model_execute, llm_model_evaluate)
 
-    def setup(self):
-        # for prompt
-        self._original_story = open(str(self.narrative_file), "r").read()
-        exp_data = pd.read_excel(str(self.coding_file))
-        exp_data = exp_data.iloc[1:]
-        exp_data = exp_data.sort_values(by=['Unnamed: 0'])
-        props = exp_data['Unnamed: 0'].tolist()
-        nums = exp_data['Unnamed: 1'].tolist()
-        self._phrases = "\n".join([f"{x}\t{y}" for x, y in list(zip(props, nums))])
+    def task_data_sources(self):
+        return [self.narrative_file, self.coding_file]
+
+    def compile_task_data(self):
+        # for prompt: original story and the numbered propositions, tagged with their types
+        return compile_propositions(self.narrative_file, self.coding_file, sort=True)
+
+    def phrase_text(self, phrase):
+        return phrase.split("\t", 1)[1]
 
+    def phrase_label(self, phrase):
+        # the evaluator outputs the numbers of the propositions
+        return phrase.split("\t", 1)[0]
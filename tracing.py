@@ -0,0 +1,228 @@
+"""Span-style instrumentation of runs, exported as OTLP/JSON or aggregated per run, generation and task.
+
+Instrumentation is off unless a `Tracer` is active:
+
+    with Tracer() as tracer:
+        await run_simulations(simulations)
+    tracer.export("trace.json")  # OTLP/JSON, e.g., for an OpenTelemetry collector or Jaeger
+    tracer.summary(by="generation")
+
+Each node gets a `node` span with `node.process` and `node.evaluate` children, and every
+model call an `llm.query` span below them. Spans carry the time spent waiting for inputs
+(`wait_inputs_s`), for a scheduler slot (`queue_wait_s`), for a worker thread
+(`executor_wait_s`) and for the rate limiter (`rate_limit_wait_s`), the API latency
+(`api_s`), for streamed calls the time to first token and decoding rate (`ttft_s`,
+`tokens_per_s`, `stopped_early`), retries (`retries`, `retry_wait_s`) and the tokens of
+`response.usage`.
+The current span follows the `contextvars` context, so it is inherited by tasks and by
+`asyncio.to_thread`.
+"""
+
+import contextlib
+import contextvars
+import json
+import os
+import pathlib
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+_active_tracers: List["Tracer"] = []
+
+# numeric attributes that `Tracer.summary` adds up
+METRICS = ("wait_inputs_s", "queue_wait_s", "executor_wait_s", "rate_limit_wait_s", "api_s", "ttft_s", "retries",
+           "retry_wait_s", "prompt_tokens", "completion_tokens", "cached_tokens", "stopped_early")
+# attributes that `Tracer.summary` groups by, looked up on the span and then on its ancestors
+GROUPS = ("task", "generation", "sim_id")
+
+
+class Span:
+    """A timed operation with attributes; see the OpenTelemetry span model."""
+
+    __slots__ = ("name", "trace_id", "span_id", "parent", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, name: str, parent: Optional["Span"], attributes: Dict[str, Any]):
+        self.name = name
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent is not None else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = attributes
+        self.error: Optional[str] = None
+
+    @property
+    def duration_s(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def add(self, key: str, value: float) -> None:
+        self.attributes[key] = self.attributes.get(key, 0) + value
+
+    def lookup(self, key: str) -> Any:
+        """`key` of this span or of its closest ancestor that has it."""
+        span = self
+        while span is not None:
+            if key in span.attributes:
+                return span.attributes[key]
+            span = span.parent
+        return None
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class Tracer:
+    """Collects the spans of the code running while it is active.
+
+    Args:
+        service_name (str, optional): `service.name` of the exported resource.
+        attributes (dict, optional): resource attributes, e.g., {"run_id": ...}.
+    """
+
+    def __init__(self, service_name: str="llm_transmission_chains", attributes: Optional[Dict[str, Any]]=None):
+        self.service_name = service_name
+        self.attributes = attributes or {}
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "Tracer":
+        _active_tracers.append(self)
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        _active_tracers.remove(self)
+
+    def _finish(self, span: Span) -> None:
+        span.end_ns = time.time_ns()
+        with self._lock:
+            self.spans.append(span)
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """The spans in the OTLP/JSON format of `ExportTraceServiceRequest`."""
+        resource = {"service.name": self.service_name, **self.attributes}
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": k, "value": _otlp_value(v)} for k, v in resource.items()]},
+            "scopeSpans": [{
+                "scope": {"name": "llm_transmission_chains.tracing"},
+                "spans": [{
+                    "traceId": span.trace_id,
+                    "spanId": span.span_id,
+                    "parentSpanId": "" if span.parent is None else span.parent.span_id,
+                    "name": span.name,
+                    "kind": 1 if span.name != "llm.query" else 3, # INTERNAL, CLIENT
+                    "startTimeUnixNano": str(span.start_ns),
+                    "endTimeUnixNano": str(span.end_ns),
+                    "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in span.attributes.items()],
+                    "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+                } for span in self.spans]
+            }]
+        }]}
+
+    def export(self, path: pathlib.Path) -> None:
+        with open(path, "w") as f:
+            json.dump(self.to_otlp(), f)
+
+    def summary(self, by: Optional[str]=None) -> "pd.DataFrame":
+        """Aggregates the spans of the whole run (`by=None`) or per "generation", "task" or "sim_id".
+
+        Returns:
+            A DataFrame with one row per group: the number of nodes, model calls and
+            errors, the total time in `node.process` and `node.evaluate` spans, the sums
+            of the `METRICS` attributes, and `cached_share`, the share of prompt tokens
+            the provider reported as cached.
+        """
+        import pandas as pd
+
+        if by is not None and by not in GROUPS:
+            raise ValueError(f"by must be None or one of {GROUPS}, got {by!r}")
+        rows: Dict[Any, Dict[str, Any]] = {}
+        for span in self.spans:
+            group = "run" if by is None else span.lookup(by)
+            row = rows.setdefault(group, {"nodes": 0, "calls": 0, "errors": 0, "process_s": 0.0,
+                                          "evaluate_s": 0.0, **{metric: 0 for metric in METRICS}})
+            # `graph.TopologicalExecutor` has no `node` spans; its `node.process` spans are roots
+            if span.name == "node" or (span.name == "node.process" and span.parent is None):
+                row["nodes"] += 1
+            if span.name == "llm.query":
+                row["calls"] += 1
+                row["errors"] += span.error is not None
+            elif span.name in ("node.process", "node.evaluate"):
+                row[span.name.replace("node.", "") + "_s"] += span.duration_s
+            for metric in METRICS:
+                row[metric] += span.attributes.get(metric, 0)
+
+        data = pd.DataFrame.from_dict(rows, orient="index")
+        if rows:
+            data["cached_share"] = data["cached_tokens"] / data["prompt_tokens"].where(data["prompt_tokens"] > 0)
+        data.index.name = by or "run"
+        return data.sort_index() if by is not None else data
+
+
+def get_tracer() -> Optional[Tracer]:
+    return _active_tracers[-1] if _active_tracers else None
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    """Records a span below the current one; yields `None` when no tracer is active."""
+    tracer = get_tracer()
+    if tracer is None:
+        yield None
+        return
+
+    current = Span(name, _current_span.get(), attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = repr(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        tracer._finish(current)
+
+
+def annotate(**attributes: Any) -> None:
+    """Sets attributes of the current span, if any."""
+    current = _current_span.get()
+    if current is not None:
+        current.set(**attributes)
+
+
+def add(key: str, value: float) -> None:
+    """Adds `value` to a numeric attribute of the current span, if any."""
+    current = _current_span.get()
+    if current is not None:
+        current.add(key, value)
+
+
+def record_usage(response: Any) -> None:
+    """Annotates the current span with the token counts of `response.usage`."""
+    current = _current_span.get()
+    usage = getattr(response, "usage", None)
+    if current is None or usage is None:
+        return
+    current.set(prompt_tokens=getattr(usage, "prompt_tokens", None) or 0,
+                completion_tokens=getattr(usage, "completion_tokens", None) or 0)
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", None)
+    if cached_tokens:
+        current.set(cached_tokens=cached_tokens)
@@ -51,4 +51,57 @@ def setup_transmission_chain(connections, NODE_CLS, task, sim_id=0):
             if gen_id < len(all_nodes) - 1:
                 node.send_output_to = [all_nodes[gen_id + 1][out_id] for out_id in connections[gen_id][node.id[1]]]
 
-    return all_nodes
\ No newline at end of file
+    return all_nodes
+
+def read_summaries(path, n_simulations):
+    """
+    Reads stored summaries into (sim_id, generation, summary) records.
+
+    Args:
+        path (str or Path): a `.docx` file (one summary per non-empty paragraph, as in
+            `study-data/output`) or a text file (one summary per non-empty line).
+        n_simulations (int): number of chains; summaries are laid out generation by generation,
+            i.e., the i-th summary belongs to chain `i % n_simulations` at generation `i // n_simulations`.
+    """
+    path = str(path)
+    if path.endswith(".docx"):
+        from docx import Document
+        paragraphs = [para.text for para in Document(path).paragraphs]
+    else:
+        with open(path, "r") as f:
+            paragraphs = f.read().split("\n")
+
+    summaries = [x for x in paragraphs if x.strip()]
+    return [(idx % n_simulations, idx // n_simulations, summary) for idx, summary in enumerate(summaries)]
+
+
+def read_threat_chains(path, n_selected):
+    """
+    Reads the statements selected in a `Threat - *.docx` file of `study-data/output` into
+    (sim_id, generation, statements) records.
+
+    Args:
+        path (str or Path): a `.docx` file in which each chain starts with a "CHAIN <i>"
+            paragraph and a "Random sequence: ..." paragraph, followed by the statements
+            selected at each generation, one per paragraph.
+        n_selected (int): statements selected at the first generation, i.e., one fewer than
+            the task's statements; each generation selects one fewer than the previous one.
+    """
+    from docx import Document
+
+    chains = []
+    for text in (para.text.strip() for para in Document(str(path)).paragraphs):
+        if not text or text.startswith("Random sequence"):
+            continue
+        if text.upper().startswith("CHAIN"):
+            chains.append([])
+        elif chains:
+            chains[-1].append(text)
+
+    records = []
+    for sim_id, statements in enumerate(chains):
+        start, size, generation = 0, n_selected, 0
+        while start < len(statements) and size > 0:
+            records.append((sim_id, generation, statements[start:start + size]))
+            start, size, generation = start + size, size - 1, generation + 1
+    return records